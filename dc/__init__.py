@@ -41,11 +41,15 @@ data connector.
 
 """
 
+from dc.columnar import ColumnarConnector
+from dc.mmap import MMapConnector
 from dc.mongo import MongoDBConnector
 from dc.sqlite3 import Sqlite3Connector
 from dc.yaml import YAMLConnector
 
 connectors = {
+    "columnar": ColumnarConnector,
+    "mmap": MMapConnector,
     "mongo": MongoDBConnector,
     "sqlite3": Sqlite3Connector,
     "yaml": YAMLConnector,
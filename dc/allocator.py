@@ -0,0 +1,118 @@
+# Copyright (c) 2012 LE GOFF Vincent
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+# * Neither the name of the copyright holder nor the names of its contributors
+#   may be used to endorse or promote products derived from this software
+#   without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT
+# OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+
+"""This module contains the ID allocators of the data connectors.
+
+An allocator hands out the values of the auto-increment fields.  The
+values are given by table and field and are always increasing, but
+not necessarily contiguous:  a value, once handed out, is never
+given again.  The BlockAllocator reserves the values from the backend
+by blocks (the hi/lo algorithm), so that several processes can share
+the same backend.
+
+The backend is only asked for a value once in a while, not for each
+new object.  A data connector whose backend assigns the values itself
+(like sqlite3) doesn't need an allocator.
+
+The allocators can be shared between threads:  their methods are
+protected by a lock.
+
+"""
+
+from threading import RLock
+
+class Allocator:
+    
+    """Base class of the ID allocators.
+    
+    Methods:
+        allocate(table, field, number) -- allocate 'number' values
+        reset(table) -- forget the allocated values
+    
+    """
+    
+    def __init__(self):
+        self.counters = {}
+        self.lock = RLock()
+    
+    def allocate(self, table, field, number=1):
+        """Allocate 'number' contiguous values and return the first one."""
+        raise NotImplementedError
+    
+    def reset(self, table=None):
+        """Forget the values of a table (or of every table).
+        
+        The next values will be asked to the backend again.
+        
+        """
+        with self.lock:
+            if table is None:
+                self.counters.clear()
+            else:
+                for key in tuple(self.counters):
+                    if key[0] == table:
+                        del self.counters[key]
+
+
+class BlockAllocator(Allocator):
+    
+    """Allocator reserving the values by blocks (hi/lo).
+    
+    The 'reserve' function, given to the constructor, is called with
+    the table and field names and the number of values to reserve.
+    It should reserve them atomically in the backend and return the
+    first one.  The values are reserved by blocks of 'block_size'
+    values (or more, if more are allocated at once) and handed out
+    from memory.  The values of a block not used before the data
+    connector is closed are lost.
+    
+    """
+    
+    def __init__(self, reserve, block_size=100):
+        if block_size < 1:
+            raise ValueError("the block size should be a positive number")
+        
+        Allocator.__init__(self)
+        self.reserve = reserve
+        self.block_size = block_size
+    
+    def allocate(self, table, field, number=1):
+        """Allocate 'number' contiguous values and return the first one."""
+        key = (table, field)
+        with self.lock:
+            block = self.counters.get(key)
+            if block is None or block[1] - block[0] < number:
+                size = max(number, self.block_size)
+                first = self.reserve(table, field, size)
+                block = [first, first + size]
+                self.counters[key] = block
+            
+            value = block[0]
+            block[0] += number
+            return value
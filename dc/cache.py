@@ -0,0 +1,145 @@
+# Copyright (c) 2012 LE GOFF Vincent
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+# * Neither the name of the copyright holder nor the names of its contributors
+#   may be used to endorse or promote products derived from this software
+#   without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT
+# OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+
+"""This module contains the cache policies of the data connectors.
+
+The data connectors keep the created or retrieved objects in cache (an
+identity map), one cache by model.  The cache policy decides which
+objects are kept:
+    "unbounded" -- every object is kept (a simple dictionary)
+    "weak" -- the objects are kept as long as they are used somewhere
+            else (see WeakCache)
+    "lru" -- the most recently used objects are kept, up to a limit
+            (see LRUCache)
+
+Each cache behaves like a dictionary {primary key: object}.  The
+'create_cache' function creates a cache following a policy.  The caches
+can be shared between threads:  to add an object only if no other
+thread did it before, use 'setdefault'.
+
+"""
+
+from collections import OrderedDict
+from threading import RLock
+from weakref import WeakValueDictionary
+
+POLICIES = ("unbounded", "weak", "lru")
+
+class WeakCache(WeakValueDictionary):
+    
+    """Cache keeping weak references to the objects.
+    
+    An object is removed from cache when it isn't referenced anywhere
+    else.
+    
+    """
+    
+    pass
+
+class LRUCache(OrderedDict):
+    
+    """Cache keeping the most recently used objects, up to a limit.
+    
+    When an object is added and the limit is reached, the least
+    recently used object is removed from cache.  Since reading an
+    object modifies the order, the accesses are protected by a lock.
+    
+    An evicted object may still be referenced by the caller:  reading
+    it again builds a new object, so that two objects represent the
+    same record.  The identity of the objects is therefore only
+    guaranteed while they are in cache.
+    
+    """
+    
+    def __init__(self, limit):
+        self.lock = RLock()
+        OrderedDict.__init__(self)
+        if limit < 1:
+            raise ValueError("the cache limit should be a positive number")
+        
+        self.limit = limit
+    
+    def __getitem__(self, key):
+        with self.lock:
+            value = OrderedDict.__getitem__(self, key)
+            self.move_to_end(key)
+            return value
+    
+    def __setitem__(self, key, value):
+        with self.lock:
+            OrderedDict.__setitem__(self, key, value)
+            self.move_to_end(key)
+            while len(self) > self.limit:
+                self.popitem(last=False)
+    
+    def __delitem__(self, key):
+        with self.lock:
+            OrderedDict.__delitem__(self, key)
+    
+    def pop(self, key, *default):
+        """Remove the object and return it (or 'default' if not found)."""
+        with self.lock:
+            return OrderedDict.pop(self, key, *default)
+    
+    def get(self, key, default=None):
+        """Return the object if found, updating its position."""
+        with self.lock:
+            if key in self:
+                return self[key]
+            
+            return default
+    
+    def setdefault(self, key, default=None):
+        """Return the object if found, otherwise add 'default'."""
+        with self.lock:
+            if key in self:
+                return self[key]
+            
+            self[key] = default
+            return default
+
+def create_cache(policy="unbounded", limit=None):
+    """Create and return a cache following the specified policy.
+    
+    The 'limit' parameter is only used by the "lru" policy, for which
+    it is mandatory.
+    
+    """
+    if policy == "unbounded":
+        return {}
+    elif policy == "weak":
+        return WeakCache()
+    elif policy == "lru":
+        if limit is None:
+            raise ValueError("the lru cache policy needs a limit")
+        
+        return LRUCache(limit)
+    
+    raise ValueError("unknown cache policy {}, expected one of {}".format(
+            repr(policy), POLICIES))
@@ -0,0 +1,332 @@
+# Copyright (c) 2012 LE GOFF Vincent
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+# * Neither the name of the copyright holder nor the names of its contributors
+#   may be used to endorse or promote products derived from this software
+#   without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT
+# OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+
+"""Module defining the ColumnarConnector class."""
+
+import os
+
+driver = True
+
+try:
+    import numpy
+except ImportError:
+    driver = False
+else:
+    from dc.columnar.table import ColumnTable
+
+from dc.allocator import BlockAllocator
+from dc.connector import DataConnector
+from dc import exceptions
+from model import exceptions as mod_exceptions
+from model.functions import *
+
+class ColumnarConnector(DataConnector):
+    
+    """Data connector keeping the tables in memory, by column.
+    
+    Each table is stored in NumPy arrays, one by field (see
+    ./table.py).  The conditions of a query are checked on whole
+    columns at once and only the selected rows are built as objects,
+    which makes it fit for analytics jobs reading big tables.  The
+    objects are counted, aggregated and grouped on the columns too,
+    without building any object.
+    
+    Only the integer and string fields can be stored.  The strings are
+    dictionary-encoded:  each different string is stored once, and the
+    strings no longer used are replaced by the new ones.
+    
+    The tables are written in 'loop' in NumPy files ({table}.npz), if
+    they have changed, and read when the models are recorded.  A
+    changed table is written again as a whole, however few rows have
+    changed:  this data connector doesn't fit write-heavy workloads.  The
+    auto-increment values are reserved by blocks of 'id_block' values
+    (see dc.allocator.BlockAllocator).
+    
+    """
+    
+    name = "columnar"
+    executor_workers = 1
+    def __init__(self):
+        """Check the driver presence.
+        
+        If not found, raise a DriverNotFound exception.
+        
+        """
+        if not driver:
+            raise exceptions.DriverNotFound(
+                    "the numpy library can not be found")
+        
+        self.location = None
+        self.tables = {}
+        self.to_update = set()
+    
+    def setup(self, location=None, id_block=100):
+        """Setup the data connector."""
+        if location is None:
+            raise exceptions.InsufficientConfiguration(
+                    "the location for storing datas was not specified for " \
+                    "the columnar data connector")
+        
+        location = location.replace("\\", "/")
+        if location.startswith("~"):
+            location = os.path.expanduser("~") + location[1:]
+        
+        if location.endswith("/"):
+            location = location[:-1]
+        
+        if not os.path.exists(location):
+            # Try to create it
+            os.makedirs(location)
+        
+        DataConnector.__init__(self)
+        self.allocator = BlockAllocator(self.reserve_increments, id_block)
+        self.location = location
+    
+    def close(self):
+        """Close the data connector (stop the thread pool if needed)."""
+        self.shutdown_executor()
+    
+    def destroy(self):
+        """Erase EVERY stored data."""
+        for name in self.tables:
+            path = self.get_path(name)
+            if os.path.exists(path):
+                os.remove(path)
+        
+        self.tables = dict((name, ColumnTable(get_schema(model))) for \
+                name, model in self.models.items())
+        self.to_update.clear()
+        self.clear_cache()
+    
+    def get_path(self, name):
+        """Return the path of the table's file."""
+        return self.location + "/" + name + ".npz"
+    
+    def record_model(self, model):
+        """Record the given model and read its table, if stored."""
+        table = ColumnTable(get_schema(model))
+        name = DataConnector.record_model(self, model)
+        if name in self.tables:
+            return
+        
+        path = self.get_path(name)
+        if os.path.exists(path):
+            with numpy.load(path) as arrays:
+                table.load(arrays)
+        
+        self.tables[name] = table
+    
+    def loop(self):
+        """Flush the pending changes and write the changed tables."""
+        self.flush()
+        for name in self.to_update:
+            self.write_table(name)
+        
+        self.to_update.clear()
+        self.compact_deletions()
+    
+    def write_table(self, name):
+        """Write the table in its file, through a temporary file."""
+        path = self.get_path(name)
+        with open(path + ".tmp", "wb") as file:
+            numpy.savez(file, **self.tables[name].dump())
+        
+        os.replace(path + ".tmp", path)
+    
+    def reserve_increments(self, table, field, number):
+        """Reserve 'number' values of an auto-increment field.
+        
+        The first reserved value is returned.  The next free value is
+        written with the table.
+        
+        """
+        increments = self.tables[table].increments
+        value = increments.get(field, 1)
+        increments[field] = value + number
+        self.to_update.add(table)
+        return value
+    
+    def load_objects(self, model, rows, cache=True):
+        """Return the objects built from the selected rows.
+        
+        The 'rows' parameter is an array of row indexes (see
+        DataConnector.load_objects).
+        
+        """
+        table = self.tables[get_name(model)]
+        return DataConnector.load_objects(self, model, table.read_rows(rows),
+                cache)
+    
+    def get_all_objects(self, model):
+        """Return all the model's objects in a list."""
+        return list(self.iter_objects(model))
+    
+    def iter_objects(self, model, batch_size=1000, cache=True):
+        """Iterate over the model's objects, built by batches."""
+        table = self.tables[get_name(model)]
+        rows = numpy.flatnonzero(table.live[:table.size])
+        for i in range(0, len(rows), batch_size):
+            for object in self.load_objects(model, rows[i:i + batch_size],
+                    cache):
+                yield object
+    
+    def select_objects(self, query):
+        """Return the objects matching the query (a QuerySet).
+        
+        The rows are selected, sorted and limited on the columns (see
+        ColumnTable.select_rows).  Only the selected objects are built.
+        
+        """
+        table = self.tables[get_name(query.model)]
+        return self.load_objects(query.model, table.select_rows(query))
+    
+    def count_objects(self, query):
+        """Return the number of objects matching the query (a QuerySet).
+        
+        No object is built.
+        
+        """
+        table = self.tables[get_name(query.model)]
+        return len(table.select_rows(query))
+    
+    def aggregate_objects(self, query, aggregates):
+        """Aggregate the fields of the objects matching the query.
+        
+        No object is built.
+        
+        """
+        table = self.tables[get_name(query.model)]
+        rows = table.select_rows(query)
+        return dict((function, table.aggregate(rows, function, name)) for \
+                function, name in aggregates.items())
+    
+    def group_objects(self, query, name, aggregates):
+        """Group the objects matching the query by the value of a field.
+        
+        No object is built.
+        
+        """
+        table = self.tables[get_name(query.model)]
+        groups = {}
+        for value, rows in table.group(table.select_rows(query),
+                name).items():
+            results = {"count": len(rows)}
+            for function, field_name in aggregates.items():
+                results[function] = table.aggregate(rows, function,
+                        field_name)
+            groups[value] = results
+        
+        return groups
+    
+    def find_object(self, model, pkey_values):
+        """Return, if found, the selected object.
+        
+        Raise a model.exceptions.ObjectNotFound if not found.
+        
+        """
+        object = self.get_from_cache(model, pkey_values)
+        if object:
+            return object
+        
+        schema = get_schema(model)
+        row = self.tables[schema.name].positions.get(schema.get_dict_pkey(
+                pkey_values))
+        if row is None:
+            raise mod_exceptions.ObjectNotFound(model, pkey_values)
+        
+        return self.load_objects(model, [row])[0]
+    
+    def read_fields(self, objects, names):
+        """Read the specified fields of the objects."""
+        if not objects:
+            return {}
+        
+        schema = get_schema(type(objects[0]))
+        table = self.tables[schema.name]
+        positions = [schema.indexes[name] for name in names]
+        values = {}
+        for object in objects:
+            row = table.positions.get(schema.get_pkey(object))
+            if row is not None:
+                row_values = table.read_rows([row])[0]
+                values[object] = tuple(row_values[i] for i in positions)
+        
+        return values
+    
+    def add_object(self, object):
+        """Save the object, issued from a model."""
+        self.add_objects([object])
+    
+    def add_objects(self, objects):
+        """Save the objects, issued from the same model.
+        
+        The auto-increment values are reserved at once.
+        
+        """
+        if not objects:
+            return
+        
+        schema = get_schema(type(objects[0]))
+        name = schema.name
+        table = self.tables[name]
+        for field in schema.auto_increments:
+            value = self.allocator.allocate(name, field, len(objects))
+            for i, object in enumerate(objects):
+                update_attr(object, field, value + i)
+        
+        get_values = schema.get_values
+        for object in objects:
+            table.append(get_values(object))
+        
+        self.cache_objects(objects)
+        self.to_update.add(name)
+    
+    def update_object(self, object, attribute):
+        """Update an object.
+        
+        Raise a model.exceptions.UpdateDeletedObject if the object was
+        deleted.
+        
+        """
+        self.check_update(object)
+        schema = get_schema(type(object))
+        table = self.tables[schema.name]
+        row = table.positions.get(schema.get_pkey(object))
+        if row is None:
+            raise mod_exceptions.UpdateDeletedObject(object)
+        
+        table.set(row, attribute, getattr(object, attribute))
+        self.to_update.add(schema.name)
+    
+    def remove_object(self, object):
+        """Delete the object."""
+        self.uncache_object(object)
+        schema = get_schema(type(object))
+        self.tables[schema.name].delete(schema.get_pkey(object))
+        self.to_update.add(schema.name)
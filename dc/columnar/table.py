@@ -0,0 +1,468 @@
+# Copyright (c) 2012 LE GOFF Vincent
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+# * Neither the name of the copyright holder nor the names of its contributors
+#   may be used to endorse or promote products derived from this software
+#   without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT
+# OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+
+"""This module contains the ColumnTable class, a table stored by column.
+
+Each field of a model is stored in a NumPy array, a row being an
+index in these arrays:
+    Integer -- an array of 64-bit integers
+    String -- an array of 32-bit codes, the strings being stored
+            once in a dictionary (the code -1 being the None value).
+            The codes are counted:  the code of a string no longer
+            used by any row is given to the next new string.
+Each column has a mask of the None values as well, and the table has
+a mask of the live rows (a deleted row is only marked as dead).
+
+The conditions of a query (see model.query.QuerySet) are checked
+on whole columns at once (see 'select_rows'):  the objects are only
+built from the selected rows.
+
+"""
+
+import operator
+
+import numpy
+
+from model.types import Integer, String
+
+NUMPY_OPERATORS = {
+    "exact": operator.eq,
+    "ne": operator.ne,
+    "gt": operator.gt,
+    "gte": operator.ge,
+    "lt": operator.lt,
+    "lte": operator.le,
+}
+
+class ColumnTable:
+    
+    """Class representing a table stored by column.
+    
+    Attributes:
+        schema -- the model's schema
+        size -- the number of rows (dead rows included)
+        columns -- a dictionary {field_name: array}
+        nulls -- a dictionary {field_name: mask of the None values}
+        live -- the mask of the live rows
+        strings -- a dictionary {field_name: list of strings}
+        codes -- a dictionary {field_name: {string: code}}
+        uses -- a dictionary {field_name: number of rows by code}
+        free_codes -- a dictionary {field_name: list of unused codes}
+        positions -- a dictionary {primary key: row}
+        increments -- a dictionary {field_name: next auto-increment value}
+    
+    Methods:
+        append(values) -- add a row
+        set(row, name, value) -- update a value
+        delete(pkey) -- mark a row as dead
+        read_rows(rows) -- return the rows as tuples of values
+        select_rows(query) -- return the selected rows
+        aggregate(rows, function, name) -- aggregate the values of a field
+        group(rows, name) -- group the rows by the values of a field
+        compact() -- remove the dead rows
+        dump() / load(arrays) -- convert the table from / to arrays
+    
+    """
+    
+    def __init__(self, schema):
+        for field in schema.fields:
+            if not isinstance(field, (Integer, String)):
+                raise ValueError("the field {} of {} can't be stored by " \
+                        "column".format(field.field_name, schema.name))
+        
+        self.schema = schema
+        self.size = 0
+        self.capacity = 0
+        self.columns = {}
+        self.nulls = {}
+        self.live = numpy.zeros(0, dtype=bool)
+        self.strings = {}
+        self.codes = {}
+        self.uses = {}
+        self.free_codes = {}
+        self.positions = {}
+        self.increments = {}
+        for field in schema.fields:
+            name = field.field_name
+            if isinstance(field, String):
+                self.columns[name] = numpy.zeros(0, dtype=numpy.int32)
+                self.strings[name] = []
+                self.codes[name] = {}
+                self.uses[name] = []
+                self.free_codes[name] = []
+            else:
+                self.columns[name] = numpy.zeros(0, dtype=numpy.int64)
+            
+            self.nulls[name] = numpy.zeros(0, dtype=bool)
+        
+        self.grow(64)
+    
+    def __repr__(self):
+        return "<column table {} ({} rows)>".format(self.schema.name,
+                len(self.positions))
+    
+    def grow(self, capacity):
+        """Extend the arrays to contain 'capacity' rows at least.
+        
+        The capacity is doubled at least.
+        
+        """
+        if capacity <= self.capacity:
+            return
+        
+        capacity = max(capacity, self.capacity * 2)
+        def extend(array):
+            extended = numpy.zeros(capacity, dtype=array.dtype)
+            extended[:self.size] = array[:self.size]
+            return extended
+        
+        self.columns = dict((name, extend(array)) for name, array in \
+                self.columns.items())
+        self.nulls = dict((name, extend(array)) for name, array in \
+                self.nulls.items())
+        self.live = extend(self.live)
+        self.capacity = capacity
+    
+    def encode(self, name, value):
+        """Return the code of a string, adding it to the dictionary.
+        
+        The string is counted as used once more.  A new string takes
+        an unused code if any.
+        
+        """
+        if value is None:
+            return -1
+        
+        codes = self.codes[name]
+        code = codes.get(value)
+        if code is None:
+            free_codes = self.free_codes[name]
+            if free_codes:
+                code = free_codes.pop()
+                self.strings[name][code] = value
+            else:
+                code = len(self.strings[name])
+                self.strings[name].append(value)
+                self.uses[name].append(0)
+            
+            codes[value] = code
+        
+        self.uses[name][code] += 1
+        return code
+    
+    def release(self, name, row):
+        """Count the string of a row as used once less.
+        
+        A string no longer used is removed from the dictionary and its
+        code kept for the next new string.  The string itself stays in
+        the list, so that the conditions checked on the whole list
+        don't see holes (no row has its code).
+        
+        """
+        if self.nulls[name][row]:
+            return
+        
+        code = int(self.columns[name][row])
+        uses = self.uses[name]
+        uses[code] -= 1
+        if uses[code] == 0:
+            del self.codes[name][self.strings[name][code]]
+            self.free_codes[name].append(code)
+    
+    def store(self, row, name, value, replace=True):
+        """Write a value in a column.
+        
+        If 'replace' is True, the former value of the row is replaced
+        (its string is released).  Raise a ValueError if an integer
+        can't be stored on 64 bits.
+        
+        """
+        if name in self.strings:
+            code = self.encode(name, value)
+            if replace:
+                self.release(name, row)
+            
+            self.columns[name][row] = code
+        elif value is None:
+            self.columns[name][row] = 0
+        else:
+            try:
+                self.columns[name][row] = value
+            except OverflowError:
+                raise ValueError("the integer {} can't be stored on 64 " \
+                        "bits".format(value)) from None
+        
+        self.nulls[name][row] = value is None
+    
+    def append(self, values):
+        """Add a row (a tuple of values in the field order).
+        
+        Return the index of the new row.
+        
+        """
+        row = self.size
+        self.grow(row + 1)
+        for name, value in zip(self.schema.field_names, values):
+            self.store(row, name, value, replace=False)
+        
+        self.live[row] = True
+        self.size += 1
+        self.positions[self.schema.get_row_pkey(values)] = row
+        return row
+    
+    def set(self, row, name, value):
+        """Update a value of a row."""
+        self.store(row, name, value)
+    
+    def delete(self, pkey):
+        """Mark the row of a primary key as dead."""
+        row = self.positions.pop(pkey, None)
+        if row is not None:
+            self.live[row] = False
+            for name in self.strings:
+                self.release(name, row)
+    
+    def read_rows(self, rows):
+        """Return the values of the rows (a list of tuples)."""
+        columns = []
+        for name in self.schema.field_names:
+            values = self.columns[name][rows].tolist()
+            nulls = self.nulls[name][rows].tolist()
+            if name in self.strings:
+                strings = self.strings[name]
+                values = [None if null else strings[code] for code, null in \
+                        zip(values, nulls)]
+            else:
+                values = [None if null else value for value, null in \
+                        zip(values, nulls)]
+            columns.append(values)
+        
+        return list(zip(*columns))
+    
+    def select_rows(self, query):
+        """Return the selected rows of the query (an array of indexes).
+        
+        The rows are filtered, sorted and limited following the query.
+        
+        """
+        size = self.size
+        mask = self.live[:size].copy()
+        for name, op, value in query.conditions:
+            mask &= self.match(name, op, value)
+        
+        rows = numpy.flatnonzero(mask)
+        if query.ordering:
+            keys = []
+            for name, descending in reversed(query.ordering):
+                values = self.sort_values(name)[rows]
+                not_null = ~self.nulls[name][rows]
+                if descending:
+                    values = -values
+                    not_null = ~not_null
+                keys.extend((values, not_null))
+            
+            rows = rows[numpy.lexsort(keys)]
+        
+        if query.limit_count is not None:
+            rows = rows[:query.limit_count]
+        
+        return rows
+    
+    def match(self, name, op, value):
+        """Return the mask of the rows matching a condition."""
+        size = self.size
+        column = self.columns[name][:size]
+        nulls = self.nulls[name][:size]
+        if op == "in":
+            values = [single for single in value if single is not None]
+            if name in self.strings:
+                codes = self.codes[name]
+                values = [codes[single] for single in values if single in \
+                        codes]
+            
+            mask = numpy.isin(column, numpy.array(values, dtype=column.dtype))
+            mask &= ~nulls
+            if None in value:
+                mask |= nulls
+            return mask
+        
+        if value is None:
+            if op == "exact":
+                return nulls.copy()
+            elif op == "ne":
+                return ~nulls
+            
+            return numpy.zeros(size, dtype=bool)
+        
+        if name in self.strings:
+            # Check the condition on the dictionary, then on the codes
+            strings = self.strings[name]
+            matching = numpy.array([NUMPY_OPERATORS[op](string, value) for \
+                    string in strings] + [op == "ne"], dtype=bool)
+            return matching[column]
+        
+        mask = NUMPY_OPERATORS[op](column, value)
+        if op == "ne":
+            return mask | nulls
+        
+        return mask & ~nulls
+    
+    def sort_values(self, name):
+        """Return the values of a column, as sortable integers.
+        
+        The codes of a string column are replaced by the rank of the
+        strings.
+        
+        """
+        column = self.columns[name][:self.size]
+        if name not in self.strings:
+            return column
+        
+        strings = self.strings[name]
+        ranks = numpy.zeros(len(strings) + 1, dtype=numpy.int64)
+        ranks[sorted(range(len(strings)), key=strings.__getitem__)] = \
+                numpy.arange(len(strings))
+        return ranks[column]
+    
+    def aggregate(self, rows, function, name):
+        """Return the sum, the min or the max of a field on the rows.
+        
+        The None values are ignored.  If there's no value, None is
+        returned (0 for the sum).
+        
+        """
+        rows = rows[~self.nulls[name][rows]]
+        if function == "sum":
+            if name in self.strings:
+                raise ValueError("the strings of {} can't be " \
+                        "summed".format(name))
+            
+            return int(self.columns[name][rows].sum())
+        
+        if len(rows) == 0:
+            return None
+        
+        if name in self.strings:
+            ranks = self.sort_values(name)[rows]
+            position = ranks.argmin() if function == "min" else ranks.argmax()
+            return self.strings[name][self.columns[name][rows[position]]]
+        
+        values = self.columns[name][rows]
+        return int(values.min() if function == "min" else values.max())
+    
+    def group(self, rows, name):
+        """Group the rows by the values of a field.
+        
+        Return a dictionary {value: rows}, the rows being arrays of
+        indexes.
+        
+        """
+        groups = {}
+        nulls = self.nulls[name][rows]
+        if nulls.any():
+            groups[None] = rows[nulls]
+            rows = rows[~nulls]
+        
+        values, inverse = numpy.unique(self.columns[name][rows],
+                return_inverse=True)
+        order = numpy.argsort(inverse, kind="stable")
+        bounds = numpy.cumsum(numpy.bincount(inverse))[:-1]
+        strings = self.strings.get(name)
+        for value, group_rows in zip(values.tolist(), numpy.split(
+                rows[order], bounds)):
+            groups[strings[value] if strings is not None else value] = \
+                    group_rows
+        
+        return groups
+    
+    def compact(self):
+        """Remove the dead rows, if any."""
+        rows = numpy.flatnonzero(self.live[:self.size])
+        if len(rows) == self.size:
+            return
+        
+        capacity = self.capacity
+        for name in self.schema.field_names:
+            self.columns[name] = self.columns[name][rows]
+            self.nulls[name] = self.nulls[name][rows]
+        
+        self.live = numpy.ones(len(rows), dtype=bool)
+        self.size = self.capacity = len(rows)
+        get_pkey = self.schema.get_row_pkey
+        self.positions = dict((get_pkey(values), row) for row, values in \
+                enumerate(self.read_rows(numpy.arange(self.size))))
+        self.grow(capacity)
+    
+    def dump(self):
+        """Return the live rows as a dictionary of arrays."""
+        self.compact()
+        arrays = {}
+        for name in self.schema.field_names:
+            arrays["column_" + name] = self.columns[name][:self.size]
+            arrays["nulls_" + name] = self.nulls[name][:self.size]
+            if name in self.strings:
+                arrays["strings_" + name] = numpy.array(self.strings[name],
+                        dtype=str)
+        
+        for name, value in self.increments.items():
+            arrays["increment_" + name] = numpy.array(value)
+        
+        return arrays
+    
+    def load(self, arrays):
+        """Load the rows from a dictionary of arrays (see 'dump')."""
+        size = None
+        for name in self.schema.field_names:
+            if "column_" + name not in arrays:
+                raise ValueError("the column {} of {} can't be " \
+                        "found".format(name, self.schema.name))
+            
+            self.columns[name] = arrays["column_" + name]
+            self.nulls[name] = arrays["nulls_" + name]
+            size = len(self.columns[name])
+            if name in self.strings:
+                strings = arrays["strings_" + name].tolist()
+                column = self.columns[name][~self.nulls[name]]
+                uses = numpy.bincount(column, minlength=len(strings))
+                self.strings[name] = strings
+                self.uses[name] = uses.tolist()
+                self.codes[name] = dict((strings[code], code) for code in \
+                        numpy.flatnonzero(uses).tolist())
+                self.free_codes[name] = numpy.flatnonzero(uses == 0).tolist()
+        
+        for name in self.schema.auto_increments:
+            if "increment_" + name in arrays:
+                self.increments[name] = int(arrays["increment_" + name])
+        
+        self.size = self.capacity = size
+        self.live = numpy.ones(size, dtype=bool)
+        get_pkey = self.schema.get_row_pkey
+        self.positions = dict((get_pkey(values), row) for row, values in \
+                enumerate(self.read_rows(numpy.arange(size))))
+        self.grow(64)
@@ -28,9 +28,22 @@
 
 """This file contains the DataConnector class, defined below."""
 
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from itertools import islice
 import os
+from threading import RLock
+from weakref import WeakKeyDictionary, WeakSet
+
 import yaml
 
+try:
+    from yaml import CSafeLoader as Loader
+except ImportError:
+    from yaml import SafeLoader as Loader
+
+from dc.cache import POLICIES, create_cache
 from model import exceptions as mod_exceptions
 from model.functions import *
 
@@ -53,29 +66,111 @@ class DataConnector:
         record_models(self, models) -- record the given models
         record_model(self, model) -- record a specifid model
         get_all_objects(self, model) -- return all model's objects
+        iter_objects(self, model, batch_size, cache) -- iterate over them
+        select_objects(self, query) -- return the objects matching a query
+        count_objects(self, query) -- count the objects matching a query
+        aggregate_objects(self, query, aggregates) -- aggregate fields
+        group_objects(self, query, name, aggregates) -- group by a field
         find_object(self, model, pkey_values) -- find an object
         add_object(self, object) -- save a new object
+        add_objects(self, objects) -- save new objects of the same model
         update_object(self, object, attribute) -- update an object
+        update_fields(self, object, attributes) -- update several fields
+        update_objects(self, dirty_objects) -- update several objects
         remove_object(self, object) -- delete a stored object
+        remove_objects(self, objects) -- delete several stored objects
+        read_fields(self, objects, names) -- read some fields of objects
+    
+    By default, the objects are counted, aggregated and grouped in
+    memory (see 'reduce_objects'), after being selected.  The data
+    connectors which can compute them without building the objects
+    (in the database, for instance) should redefine these methods.
+    
+    The models don't call these methods directly, but register their
+    changes (see 'register_new', 'register_update' and
+    'register_delete').  By default, the changes are sent to the data
+    connector immediately.  If the 'write_behind' attribute is set to
+    True, however, the data connector works as a unit of work:  it
+    records the new, modified and deleted objects and sends all the
+    changes when 'flush' is called, which is done in 'loop' and before
+    reading datas through the models.  The attributes modified several
+    times in an object are sent once, and all the modified attributes of
+    an object are sent together.  The auto-increment fields of the new
+    objects are set when the changes are flushed.  The unit of work is
+    protected by a lock ('lock'), so that a data connector can be
+    shared between threads.
+    
+    The values of the auto-increment fields are handed out by the
+    'allocator' of the data connector (see ./allocator.py), which the
+    subclasses should create in 'setup' (unless their backend assigns
+    the values itself).
     
     In addition, the created or retrieved objects are stored in cache.
+    There is one cache by model, in the 'objects_tree' dictionary.  The
+    cache policy (see ./cache.py) can be changed with
+    'set_cache_policy':  by default, the objects are kept forever.
     Methods to access or manipulate cached objects:
         get_from_cache(self, model, primary_attributes)
+        load_objects(self, model, rows, cache, names, mapping)
         cache_object(self, object)
+        cache_objects(self, objects)
         uncache(self, object)
+        defer_fields(self, objects, names)
+        load_deferred(self, object, name)
+        forget_deletion(self, object)
+        compact_deletions(self)
         clear_cache(self)
+    
+    The objects read without some of their fields (see QuerySet.only)
+    are remembered with their deferred fields.  When a deferred field
+    is first accessed, the deferred fields of the object (and of the
+    objects read with it) are read through 'read_fields'.
+    
+    The deleted objects are remembered, to prevent them from being
+    updated afterward.  The primary keys of the deleted objects are
+    kept in a set by model (the tombstones) until the deletion is
+    durable (committed, or written), then dropped:  the deleted objects
+    still referenced are remembered in a weak set.  The 'stats' method
+    returns the number of tombstones, cached and pending objects.
         
+    The data connectors can be used from coroutines (with asyncio)
+    through asynchronous methods:
+        aflush(self)
+        afind_object(self, model, pkey_values)
+        aiter_objects(self, model, batch_size, cache)
+        asave_object(self, object)
+    By default, they run the blocking methods in a thread pool (see
+    'run_async'), of 'executor_workers' threads, so that the event
+    loop isn't blocked.  The data connectors whose stored datas aren't
+    protected against concurrent accesses should set
+    'executor_workers' to 1.  The changes done in the thread pool are
+    committed after each call (see 'commit_thread').  The data
+    connectors having an asynchronous driver can redefine them.
+    
     For more informations, see the details of each method.
     
     """
     
     name = "unspecified"
+    executor_workers = 4
     def __init__(self):
         """Initialize the data connector."""
         self.running = False
         self.objects_tree = {}
         self.models = {}
-        self.deleted_objects = []
+        self.allocator = None
+        self.deleted_objects = {}
+        self.deleted_instances = WeakSet()
+        self.deferred = WeakKeyDictionary()
+        self.cache_policy = "unbounded"
+        self.cache_limit = None
+        self.cache_limits = {}
+        self.write_behind = False
+        self.lock = RLock()
+        self.executor = None
+        self.new_objects = {}
+        self.dirty_objects = {}
+        self.removed_objects = {}
     
     def setup(self):
         """Setup the data connector."""
@@ -99,7 +194,7 @@ class DataConnector:
             with open(cfg_path, "r") as cfg_file:
                 cfg_content = cfg_file.read()
         
-        cfg_dict = yaml.load(cfg_content)
+        cfg_dict = yaml.load(cfg_content, Loader=Loader)
         self.setup(**cfg_dict)
     
     def close(self):
@@ -109,6 +204,8 @@ class DataConnector:
     def clear(self):
         """Clear the stored datas and register the models."""
         self.objects_tree = {}
+        if self.allocator:
+            self.allocator.reset()
         self.record_models(list(self.models.values()))
     
     def destroy(self):
@@ -131,17 +228,371 @@ class DataConnector:
         """Record the given model, a subclass of model.Model."""
         name = get_name(model)
         self.models[name] = model
-        self.objects_tree[name] = {}
+        self.objects_tree[name] = self.create_model_cache(name)
         return name
     
     def loop(self):
-        """Record some datas or commit some changes if necessary."""
+        """Record some datas or commit some changes if necessary.
+        
+        The data connectors redefining this method should call 'flush'
+        first, and 'compact_deletions' once the changes are durable.
+        By default, the changes are considered durable when sent.
+        
+        """
+        self.flush()
+        self.compact_deletions()
+    
+    def register_new(self, object):
+        """Register a new object, to be saved."""
+        if self.write_behind:
+            with self.lock:
+                self.new_objects[object] = True
+        else:
+            self.add_object(object)
+    
+    def register_update(self, object, attribute):
+        """Register an updated attribute of an object.
+        
+        Raise a model.exceptions.UpdateDeletedObject if the object was
+        deleted.
+        
+        """
+        deferred = self.deferred.get(object)
+        if deferred:
+            # The new value shouldn't be overwritten by the stored one
+            deferred[0].discard(attribute)
+        
+        if self.write_behind:
+            with self.lock:
+                if object in self.new_objects:
+                    # The object will be inserted with its new value
+                    return
+                
+                self.check_update(object)
+                self.dirty_objects.setdefault(object, set()).add(attribute)
+        else:
+            self.update_object(object, attribute)
+    
+    def register_delete(self, object):
+        """Register an object to delete.
+        
+        In write-behind mode, the object is removed from cache at once,
+        but deleted when the changes are flushed.
+        
+        """
+        if self.write_behind:
+            with self.lock:
+                if self.new_objects.pop(object, None):
+                    # The object was never saved
+                    return
+                
+                self.dirty_objects.pop(object, None)
+                self.removed_objects[object] = True
+                self.uncache_object(object)
+        else:
+            self.remove_object(object)
+    
+    def flush(self):
+        """Send the pending changes (in write-behind mode).
+        
+        The new objects are saved first (by model, through
+        'add_objects'), then the modified objects are updated (through
+        'update_objects') and the deleted objects are removed (by model,
+        through 'remove_objects').  If an exception is raised, the
+        changes not sent yet are pending again (see 'requeue_changes').
+        
+        """
+        if not (self.new_objects or self.dirty_objects or \
+                self.removed_objects):
+            return
+        
+        # Take the pending changes, other threads could add new ones
+        with self.lock:
+            new_groups = self.group_by_model(self.new_objects)
+            self.new_objects.clear()
+            dirty_objects = self.dirty_objects
+            self.dirty_objects = {}
+            removed_groups = self.group_by_model(self.removed_objects)
+            self.removed_objects.clear()
+        
+        try:
+            while new_groups:
+                self.add_objects(new_groups[0])
+                del new_groups[0]
+            
+            if dirty_objects:
+                self.update_objects(dirty_objects)
+                dirty_objects = {}
+            
+            while removed_groups:
+                self.remove_objects(removed_groups[0])
+                del removed_groups[0]
+        except BaseException:
+            self.requeue_changes(new_groups, dirty_objects, removed_groups)
+            raise
+    
+    def requeue_changes(self, new_groups, dirty_objects, removed_groups):
+        """Put back the changes that couldn't be sent by 'flush'.
+        
+        They are pending again, before the changes registered since.
+        The updates of the objects deleted meanwhile are dropped:  they
+        can't be applied any more.
+        
+        """
+        with self.lock:
+            new_objects = dict((object, True) for objects in new_groups \
+                    for object in objects)
+            new_objects.update(self.new_objects)
+            self.new_objects = new_objects
+            for object, attributes in self.dirty_objects.items():
+                dirty_objects.setdefault(object, set()).update(attributes)
+            
+            self.dirty_objects = dict((object, attributes) for object, \
+                    attributes in dirty_objects.items() if \
+                    not self.was_deleted(object))
+            removed_objects = dict((object, True) for objects in \
+                    removed_groups for object in objects)
+            removed_objects.update(self.removed_objects)
+            self.removed_objects = removed_objects
+    
+    def save_object(self, object):
+        """Send the pending changes of an object (in write-behind mode).
+        
+        The other pending changes are not sent.
+        
+        """
+        with self.lock:
+            new = self.new_objects.pop(object, None)
+            attributes = self.dirty_objects.pop(object, None)
+            removed = self.removed_objects.pop(object, None)
+        
+        if new:
+            self.add_objects([object])
+        if attributes:
+            self.update_objects({object: attributes})
+        if removed:
+            self.remove_objects([object])
+    
+    def get_executor(self):
+        """Return the thread pool running the blocking methods."""
+        with self.lock:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(self.executor_workers)
+            
+            return self.executor
+    
+    def shutdown_executor(self):
+        """Stop the thread pool, if started."""
+        with self.lock:
+            executor = self.executor
+            self.executor = None
+        
+        if executor:
+            executor.shutdown()
+    
+    async def run_async(self, function, *args):
+        """Call a blocking function in the thread pool and return its result.
+        
+        The calling coroutine waits for the function to return, while
+        the event loop runs other coroutines.
+        
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.get_executor(),
+                partial(self.run_in_thread, function, *args))
+    
+    def run_in_thread(self, function, *args):
+        """Call the function in the thread pool, then 'commit_thread'."""
+        try:
+            return function(*args)
+        finally:
+            self.commit_thread()
+    
+    def commit_thread(self):
+        """Commit the changes done in the current thread, if needed.
+        
+        This method is called in the thread pool, after each call.
+        By default, nothing is done.
+        
+        """
         pass
     
+    async def aflush(self):
+        """Send the pending changes, without blocking (see 'flush')."""
+        if self.new_objects or self.dirty_objects or self.removed_objects:
+            await self.run_async(self.flush)
+    
+    async def afind_object(self, model, pkey_values):
+        """Return the object, without blocking (see 'find_object')."""
+        object = self.get_from_cache(model, pkey_values)
+        if object is not None:
+            return object
+        
+        return await self.run_async(self.find_object, model, pkey_values)
+    
+    async def aiter_objects(self, model, batch_size=1000, cache=True):
+        """Iterate asynchronously over the model's objects.
+        
+        By default, each batch is read by 'iter_objects' in the thread
+        pool.
+        
+        """
+        await self.aflush()
+        iterator = self.iter_objects(model, batch_size, cache)
+        while True:
+            batch = await self.run_async(list, islice(iterator, batch_size))
+            for object in batch:
+                yield object
+            
+            if len(batch) < batch_size:
+                break
+    
+    async def asave_object(self, object):
+        """Send the pending changes of an object, without blocking."""
+        if object in self.new_objects or object in self.dirty_objects or \
+                object in self.removed_objects:
+            await self.run_async(self.save_object, object)
+    
+    @staticmethod
+    def group_by_model(objects):
+        """Return a list of lists of objects, grouped by model.
+        
+        The order of the objects is kept in each group.
+        
+        """
+        groups = {}
+        for object in objects:
+            groups.setdefault(type(object), []).append(object)
+        
+        return list(groups.values())
+    
     def get_all_objects(self, model):
         """Return all the model's object in a list."""
         raise NotImplementedError
     
+    def iter_objects(self, model, batch_size=1000, cache=True):
+        """Iterate over the model's objects.
+        
+        The objects are read from the backend by batches of
+        'batch_size' objects.  If 'cache' is False, the objects read
+        aren't kept in cache (the objects already in cache are returned
+        though), so that iterating over a whole table doesn't keep
+        every object in memory.
+        
+        By default, the objects are read through 'get_all_objects'.  If
+        'cache' is False, the objects it has cached are then removed
+        from cache.
+        
+        """
+        cached = self.objects_tree.get(get_name(model), {})
+        known = set(cached.keys())
+        objects = self.get_all_objects(model)
+        if not cache:
+            get_pkey = get_schema(model).get_pkey
+            for object in objects:
+                pkey = get_pkey(object)
+                if pkey not in known and cached.get(pkey) is object:
+                    del cached[pkey]
+        
+        for object in objects:
+            yield object
+    
+    def select_objects(self, query):
+        """Return the objects matching the query (a QuerySet).
+        
+        By default, the conditions are checked in memory on every
+        object returned by 'get_all_objects', then the objects are
+        sorted and limited (see QuerySet.sort).  The data connectors
+        which can do better (translate the query in a database query,
+        for instance) should redefine this method.
+        
+        """
+        return query.sort(object for object in self.get_all_objects(
+                query.model) if query.matches(object))
+    
+    def count_objects(self, query):
+        """Return the number of objects matching the query (a QuerySet).
+        
+        By default, the objects returned by 'select_objects' are
+        counted.
+        
+        """
+        return len(self.select_objects(query))
+    
+    def aggregate_objects(self, query, aggregates):
+        """Aggregate the fields of the objects matching the query.
+        
+        The 'aggregates' parameter is a dictionary {function: field
+        name}, the functions being "sum", "min" or "max" (see
+        QuerySet.aggregate).  Return a dictionary {function: value}.
+        
+        By default, the objects returned by 'select_objects' are
+        aggregated in memory.
+        
+        """
+        return self.reduce_objects(self.select_objects(query),
+                aggregates)[None]
+    
+    def group_objects(self, query, name, aggregates):
+        """Group the objects matching the query by the value of a field.
+        
+        Return a dictionary {value: results}, the results of each
+        group being a dictionary {function: value} which contains the
+        number of objects ("count") and the aggregated fields (see
+        'aggregate_objects').
+        
+        By default, the objects returned by 'select_objects' are
+        grouped in memory.
+        
+        """
+        return self.reduce_objects(self.select_objects(query), aggregates,
+                name, count=True)
+    
+    @staticmethod
+    def reduce_objects(objects, aggregates, name=None, count=False):
+        """Aggregate the objects in a single pass.
+        
+        The objects are grouped by the value of the field 'name' (in a
+        single group, whose key is None, if no name is given).  Return
+        a dictionary {group: results} (see 'group_objects').  The
+        number of objects is only in the results if 'count' is True.
+        The None values are ignored:  the sum of no value is 0, the
+        minimum and maximum of no value are None.
+        
+        """
+        groups = {}
+        def create():
+            results = {"count": 0} if count else {}
+            for function in aggregates:
+                results[function] = 0 if function == "sum" else None
+            return results
+        
+        if name is None:
+            groups[None] = create()
+        
+        for object in objects:
+            key = getattr(object, name) if name else None
+            results = groups.get(key)
+            if results is None:
+                results = groups[key] = create()
+            
+            if count:
+                results["count"] += 1
+            
+            for function, field_name in aggregates.items():
+                value = getattr(object, field_name)
+                if value is None:
+                    continue
+                
+                current = results[function]
+                if function == "sum":
+                    results[function] = current + value
+                elif current is None or (value < current if function == \
+                        "min" else value > current):
+                    results[function] = value
+        
+        return groups
+    
     def find_object(self, model, pkey_values):
         """Return, if found, the selected object.
         
@@ -160,14 +611,97 @@ class DataConnector:
         """
         raise NotImplementedError
     
+    def add_objects(self, objects):
+        """Save several objects, issued from the same model.
+        
+        By default, 'add_object' is called for each object.  The data
+        connectors which can insert several objects at once (and
+        reserve several auto-increment values at once) should redefine
+        this method.
+        
+        """
+        for object in objects:
+            self.add_object(object)
+    
     def update_object(self, object, attribute):
         """Update an object."""
         raise NotImplementedError
     
+    def update_fields(self, object, attributes):
+        """Update several attributes of an object.
+        
+        By default, 'update_object' is called for each attribute.  The
+        data connectors which can update several attributes at once
+        should redefine this method.
+        
+        """
+        for attribute in attributes:
+            self.update_object(object, attribute)
+    
+    def update_objects(self, dirty_objects):
+        """Update several objects.
+        
+        The parameter is a dictionary {object: attributes}, the
+        attributes being a collection of modified attribute names.
+        By default, 'update_fields' is called for each object.
+        
+        """
+        for object, attributes in dirty_objects.items():
+            self.update_fields(object, attributes)
+    
     def remove_object(self, object):
         """Delete object from cache."""
         raise NotImplementedError
     
+    def remove_objects(self, objects):
+        """Delete several objects, issued from the same model.
+        
+        By default, 'remove_object' is called for each object.
+        
+        """
+        for object in objects:
+            self.remove_object(object)
+    
+    def read_fields(self, objects, names):
+        """Read the specified fields of the objects, of the same model.
+        
+        Return a dictionary {object: values}, the values being a tuple
+        in the 'names' order.  The objects which can't be found are
+        not in the dictionary.  This method is called to load the
+        deferred fields (see 'load_deferred').
+        
+        """
+        raise NotImplementedError
+    
+    def set_cache_policy(self, policy, limit=None, limits=None):
+        """Change the cache policy.
+        
+        Parameters:
+            policy -- the policy name ("unbounded", "weak" or "lru")
+            limit -- the default number of objects kept by model ("lru")
+            limits -- a dictionary {model name: limit} ("lru")
+        
+        The objects already in cache are kept if the new policy allows it.
+        
+        """
+        if policy not in POLICIES:
+            raise ValueError("unknown cache policy {}, expected one " \
+                    "of {}".format(repr(policy), POLICIES))
+        
+        self.cache_policy = policy
+        self.cache_limit = limit
+        self.cache_limits = dict(limits) if limits else {}
+        for name, cache in tuple(self.objects_tree.items()):
+            new_cache = self.create_model_cache(name)
+            for pkey, object in tuple(cache.items()):
+                new_cache[pkey] = object
+            self.objects_tree[name] = new_cache
+    
+    def create_model_cache(self, name):
+        """Create the cache of a model, following the cache policy."""
+        limit = self.cache_limits.get(name, self.cache_limit)
+        return create_cache(self.cache_policy, limit)
+    
     def get_from_cache(self, model, attributes):
         """Return, if found, the cached object.
         
@@ -176,38 +710,155 @@ class DataConnector:
             attributes -- a dictionary {name1: value1, ...}
         
         """
-        name = get_name(model)
-        pkey_names = get_pkey_names(model)
-        cache = self.objects_tree.get(name, {})
-        values = tuple(attributes.get(name) for name in pkey_names)
-        if len(values) == 1:
-            values = values[0]
+        schema = model._schema
+        cache = self.objects_tree.get(schema.name, {})
+        return cache.get(schema.get_dict_pkey(attributes))
+    
+    def load_objects(self, model, rows, cache=True, names=None,
+            mapping=False):
+        """Return the objects built from the rows.
         
-        return cache.get(values)
+        The rows are tuples of values in the 'names' order (all the
+        fields if not specified), or dictionaries {field: value} if
+        'mapping' is True.  The objects already in cache are not built
+        again.  The new objects are cached, unless 'cache' is False.
+        If the rows only contain some fields ('names'), the other
+        fields of the new objects are deferred.
+        
+        """
+        schema = get_schema(model)
+        names = schema.field_names if names is None else tuple(names)
+        hydrate = schema.get_hydrator(names, mapping)
+        if mapping:
+            get_row_pkey = schema.get_dict_pkey
+        else:
+            get_row_pkey = schema.get_pkey_getter(names)
+        
+        cached = self.objects_tree[schema.name]
+        objects = []
+        new_objects = []
+        for row in rows:
+            pkey = get_row_pkey(row)
+            object = cached.get(pkey)
+            if object is None:
+                new_object = hydrate(row)
+                if cache:
+                    # Another thread could have read the same object
+                    object = cached.setdefault(pkey, new_object)
+                else:
+                    object = new_object
+                
+                if object is new_object:
+                    new_objects.append(object)
+            
+            objects.append(object)
+        
+        if new_objects and names != schema.field_names:
+            self.defer_fields(new_objects, [name for name in \
+                    schema.field_names if name not in names])
+        
+        return objects
     
     def cache_object(self, object):
         """Save the object in cache."""
-        pkey = get_pkey_values(object)
-        if len(pkey) == 1:
-            pkey = pkey[0]
+        schema = object._schema
+        self.objects_tree[schema.name][schema.get_pkey(object)] = object
+    
+    def cache_objects(self, objects):
+        """Save several objects, issued from the same model, in cache."""
+        if not objects:
+            return
         
-        self.objects_tree[get_name(type(object))][pkey] = object
+        schema = objects[0]._schema
+        get_pkey = schema.get_pkey
+        cache = self.objects_tree[schema.name]
+        for object in objects:
+            cache[get_pkey(object)] = object
     
     def uncache_object(self, object):
-        """Remove the object from cache."""
-        name = get_name(type(object))
-        values = tuple(get_pkey_values(object))
-        if len(values) == 1:
-            values = values[0]
+        """Remove a deleted object from cache and record its deletion.
+        
+        The deletion is recorded even if the object is no longer in
+        cache (evicted by the cache policy, for instance).
+        
+        """
+        schema = object._schema
+        name = schema.name
+        values = schema.get_pkey(object)
+        self.objects_tree.get(name, {}).pop(values, None)
+        self.deleted_objects.setdefault(name, set()).add(values)
+        self.deleted_instances.add(object)
+    
+    def defer_fields(self, objects, names):
+        """Remember that the fields 'names' of the objects weren't read.
+        
+        The objects are read together:  the deferred fields of all of
+        them will be loaded at once.
         
-        cache = self.objects_tree.get(name, {})
-        if values in cache.keys():
-            del cache[values]
-            self.deleted_objects.append((name, values))
+        """
+        group = WeakSet(objects)
+        for object in objects:
+            self.deferred[object] = (set(names), group)
+    
+    def load_deferred(self, object, name):
+        """Load the deferred field 'name' of the object.
+        
+        Every deferred field of the objects read with this one is
+        read in one call to 'read_fields'.  Return True if the field
+        was deferred, False otherwise.
+        
+        """
+        deferred = self.deferred.get(object)
+        if deferred is None or name not in deferred[0]:
+            return False
+        
+        group = {}
+        for member in list(deferred[1]):
+            if member in self.deferred:
+                group[member] = self.deferred.pop(member)[0]
+        
+        names = set()
+        for member_names in group.values():
+            names.update(member_names)
+        
+        names = [field for field in object._schema.field_names if \
+                field in names]
+        rows = self.read_fields(list(group), names)
+        for member, values in rows.items():
+            member_names = group[member]
+            for field, value in zip(names, values):
+                if field in member_names:
+                    update_attr(member, field, value)
+        
+        return True
+    
+    def forget_deletion(self, object):
+        """Forget that the object was deleted (if it was).
+        
+        This method should be called when a deletion is cancelled
+        (rolled back, for instance).
+        
+        """
+        schema = object._schema
+        tombstones = self.deleted_objects.get(schema.name)
+        if tombstones:
+            tombstones.discard(schema.get_pkey(object))
+        self.deleted_instances.discard(object)
+    
+    def compact_deletions(self):
+        """Drop the tombstones of the durable deletions.
+        
+        This method should be called when the backend confirms the
+        deletions (after a commit, for instance).  The deleted objects
+        still referenced can't be updated anyway.
+        
+        """
+        self.deleted_objects.clear()
     
     def clear_cache(self):
         """Clear the cache."""
-        self.objects_tree = {}
+        self.objects_tree = dict((name, self.create_model_cache(name)) \
+                for name in self.models)
     
     def check_update(self, object):
         """Raise a ValueError if the object was deleted."""
@@ -216,9 +867,30 @@ class DataConnector:
     
     def was_deleted(self, object):
         """Return whether the object was deleted (uncached)."""
-        name = get_name(type(object))
-        values = tuple(get_pkey_values(object))
-        if len(values) == 1:
-            values = values[0]
+        if object in self.deleted_instances:
+            return True
+        
+        schema = object._schema
+        tombstones = self.deleted_objects.get(schema.name)
+        return bool(tombstones) and schema.get_pkey(object) in tombstones
+    
+    def stats(self):
+        """Return a dictionary of statistics about the data connector.
         
-        return (name, values) in self.deleted_objects
+        The keys are:
+            cached_objects -- the number of objects in cache
+            tombstones -- the number of non-durable deletions
+            new_objects -- the number of new objects to save
+            dirty_objects -- the number of modified objects to update
+            removed_objects -- the number of objects to delete
+        
+        """
+        return {
+            "cached_objects": sum(len(cache) for cache in \
+                    self.objects_tree.values()),
+            "tombstones": sum(len(tombstones) for tombstones in \
+                    self.deleted_objects.values()),
+            "new_objects": len(self.new_objects),
+            "dirty_objects": len(self.dirty_objects),
+            "removed_objects": len(self.removed_objects),
+        }
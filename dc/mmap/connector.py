@@ -0,0 +1,275 @@
+# Copyright (c) 2012 LE GOFF Vincent
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+# * Neither the name of the copyright holder nor the names of its contributors
+#   may be used to endorse or promote products derived from this software
+#   without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT
+# OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+
+"""Module defining the MMapConnector class."""
+
+import os
+
+from dc.allocator import BlockAllocator
+from dc.connector import DataConnector
+from dc import exceptions
+from dc.mmap.table import Table
+from model import exceptions as mod_exceptions
+from model.functions import *
+
+class MMapConnector(DataConnector):
+    
+    """Data connector storing fixed-width records in mapped files.
+    
+    Each table is a file of fixed-width records, mapped in memory (see
+    ./table.py).  The record of an object is addressed by its ID:
+    finding an object by ID is a single offset computation, and
+    opening a table doesn't read its records.  The records are decoded
+    when the objects are read.
+    
+    Only the models whose primary key is the 'id' auto-increment field
+    and whose fields are integers or strings can be stored.  The
+    strings are stored in 'string_size' bytes (UTF-8 encoded), unless
+    their field has a maximum size (see model.types.String):  4 bytes
+    are then reserved by character, so that any string accepted by
+    the field can be stored.  A string too long to be stored raises a
+    ValueError.
+    
+    The 'id' values are reserved by blocks of 'id_block' values (see
+    dc.allocator.BlockAllocator), in the header of the table.  The
+    slots of the values not used are left empty:  the default block of
+    1 value keeps the table dense, reserving a value being a write in
+    the mapped memory.
+    
+    The changes are written in the mapped memory at once and written
+    on disk in 'loop'.  The asynchronous methods (see DataConnector)
+    run in a single thread, since a table can be extended (and mapped
+    again) when a record is added.
+    
+    """
+    
+    name = "mmap"
+    executor_workers = 1
+    def __init__(self):
+        """Initialize the data connector (mmap is always available)."""
+        self.location = None
+        self.tables = {}
+    
+    def setup(self, location=None, string_size=64, id_block=1):
+        """Setup the data connector."""
+        if location is None:
+            raise exceptions.InsufficientConfiguration(
+                    "the location for storing datas was not specified for " \
+                    "the mmap data connector")
+        
+        location = location.replace("\\", "/")
+        if location.startswith("~"):
+            location = os.path.expanduser("~") + location[1:]
+        
+        if location.endswith("/"):
+            location = location[:-1]
+        
+        if not os.path.exists(location):
+            # Try to create it
+            os.makedirs(location)
+        
+        DataConnector.__init__(self)
+        self.allocator = BlockAllocator(self.reserve_increments, id_block)
+        self.location = location
+        self.string_size = string_size
+    
+    def close(self):
+        """Close the data connector (the mapped files)."""
+        self.shutdown_executor()
+        for table in self.tables.values():
+            table.close()
+        
+        self.tables = {}
+    
+    def destroy(self):
+        """Erase EVERY stored data."""
+        tables = self.tables
+        self.close()
+        for table in tables.values():
+            if os.path.exists(table.path):
+                os.remove(table.path)
+        
+        self.clear_cache()
+    
+    def record_model(self, model):
+        """Record the given model and open its table.
+        
+        Raise a ValueError if the model can't be stored in fixed-width
+        records.
+        
+        """
+        schema = get_schema(model)
+        if schema.pkey_names != ("id", ) or schema.auto_increments != \
+                ("id", ):
+            raise ValueError("the model {} can't be stored by the mmap " \
+                    "data connector:  its primary key should be the 'id' " \
+                    "auto-increment field".format(schema.name))
+        
+        fields = Table.layout(schema, self.string_size)
+        name = DataConnector.record_model(self, model)
+        if name in self.tables:
+            return
+        
+        path = self.location + "/" + name + ".dat"
+        self.tables[name] = Table(path, fields)
+    
+    def loop(self):
+        """Flush the pending changes and write the tables on disk."""
+        self.flush()
+        for table in self.tables.values():
+            table.flush()
+        
+        self.compact_deletions()
+    
+    def reserve_increments(self, table, field, number):
+        """Reserve 'number' values of the 'id' field in the table header.
+        
+        The first reserved value is returned.
+        
+        """
+        table = self.tables[table]
+        value = table.next_id
+        table.next_id = value + number
+        return value
+    
+    def get_all_objects(self, model):
+        """Return all the model's objects in a list."""
+        return list(self.iter_objects(model))
+    
+    def iter_objects(self, model, batch_size=1000, cache=True):
+        """Iterate over the model's objects, in the 'id' order."""
+        table = self.tables[get_name(model)]
+        for rows in table.read_batches(batch_size):
+            for object in self.load_objects(model, rows, cache):
+                yield object
+    
+    def select_objects(self, query):
+        """Return the objects matching the query (a QuerySet).
+        
+        If the query selects some 'id' values (with the "exact" or
+        "in" operators), only these records are read.  Otherwise, the
+        whole table is browsed.  The conditions are checked in memory.
+        
+        """
+        ids = None
+        for name, op, value in query.conditions:
+            if name == "id" and op in ("exact", "in"):
+                ids = [value] if op == "exact" else list(dict.fromkeys(value))
+                break
+        
+        if ids is None:
+            objects = self.iter_objects(query.model)
+        else:
+            table = self.tables[get_name(query.model)]
+            rows = [table.read(id) for id in ids]
+            objects = self.load_objects(query.model, [row for row in rows \
+                    if row is not None])
+        
+        return query.sort(object for object in objects if \
+                query.matches(object))
+    
+    def find_object(self, model, pkey_values):
+        """Return, if found, the selected object.
+        
+        Raise a model.exceptions.ObjectNotFound if not found.
+        
+        """
+        object = self.get_from_cache(model, pkey_values)
+        if object:
+            return object
+        
+        row = self.tables[get_name(model)].read(pkey_values.get("id"))
+        if row is None:
+            raise mod_exceptions.ObjectNotFound(model, pkey_values)
+        
+        return self.load_objects(model, [row])[0]
+    
+    def read_fields(self, objects, names):
+        """Read the specified fields of the objects."""
+        if not objects:
+            return {}
+        
+        schema = get_schema(type(objects[0]))
+        table = self.tables[schema.name]
+        positions = [schema.indexes[name] for name in names]
+        values = {}
+        for object in objects:
+            row = table.read(object.id)
+            if row is not None:
+                values[object] = tuple(row[i] for i in positions)
+        
+        return values
+    
+    def add_object(self, object):
+        """Save the object, issued from a model."""
+        self.add_objects([object])
+    
+    def add_objects(self, objects):
+        """Save the objects, issued from the same model.
+        
+        The 'id' values are allocated at once.
+        
+        """
+        if not objects:
+            return
+        
+        schema = get_schema(type(objects[0]))
+        name = schema.name
+        table = self.tables[name]
+        value = self.allocator.allocate(name, "id", len(objects))
+        get_values = schema.get_values
+        for i, object in enumerate(objects):
+            update_attr(object, "id", value + i)
+            table.write(value + i, get_values(object))
+        
+        self.cache_objects(objects)
+    
+    def update_object(self, object, attribute):
+        """Update an object."""
+        self.update_fields(object, (attribute, ))
+    
+    def update_fields(self, object, attributes):
+        """Update several attributes of an object.
+        
+        The whole record is written again.  Raise a
+        model.exceptions.UpdateDeletedObject if the object was deleted.
+        
+        """
+        self.check_update(object)
+        schema = get_schema(type(object))
+        table = self.tables[schema.name]
+        if not table.exists(object.id):
+            raise mod_exceptions.UpdateDeletedObject(object)
+        
+        table.write(object.id, schema.get_values(object))
+    
+    def remove_object(self, object):
+        """Delete the object."""
+        self.uncache_object(object)
+        self.tables[get_name(type(object))].delete(object.id)
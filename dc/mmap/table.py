@@ -0,0 +1,311 @@
+# Copyright (c) 2012 LE GOFF Vincent
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+# * Neither the name of the copyright holder nor the names of its contributors
+#   may be used to endorse or promote products derived from this software
+#   without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT
+# OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+
+"""This module contains the Table class, a file of fixed-width records.
+
+A table is a file mapped in memory (see the mmap module).  It begins
+with a header of HEADER_SIZE bytes, followed by records of the same
+size.  The record of the ID 'n' is at the offset:
+    HEADER_SIZE + (n - 1) * record_size
+so that reading a record doesn't require any index.  The records are
+decoded with a struct.Struct, directly from the mapped memory.
+
+The header contains:
+    the MAGIC bytes
+    the format version
+    the number of fields
+    the size of a record (in bytes)
+    the next auto-increment value
+
+Each record begins with a status byte (0 if the slot is empty or the
+record was deleted, 1 otherwise) and a mask of the None values (one
+bit by field), followed by the fields:
+    Integer -- a signed integer on 8 bytes
+    String -- the size of the UTF-8 encoded string (4 bytes), then
+            the encoded string, padded with null bytes (4 bytes by
+            character if the field has a maximum size, since a
+            character takes up to 4 bytes in UTF-8)
+
+"""
+
+import mmap
+import os
+import struct
+
+from model.types import Integer, String
+
+MAGIC = b"PAMM"
+VERSION = 1
+HEADER = struct.Struct("<4sHHIQ")
+HEADER_SIZE = 64
+MIN_CAPACITY = 64
+
+class Table:
+    
+    """Class representing a file of fixed-width records.
+    
+    Attributes:
+        path -- the path of the file
+        fields -- a tuple of (kind, width), kind being "i" or "s"
+        struct -- the struct.Struct of a record
+        record_size -- the size of a record, in bytes
+        capacity -- the number of records the file can contain
+    
+    Methods:
+        read(id) -- return the values of a record, or None
+        read_batches(size) -- iterate over the records by batches
+        write(id, values) -- write a record
+        delete(id) -- delete a record
+        exists(id) -- return whether a record exists
+        next_id -- the next auto-increment value (property)
+        flush() -- write the changes on disk
+        close() -- close the file
+    
+    """
+    
+    def __init__(self, path, fields):
+        """Open (or create) the table.
+        
+        The 'fields' parameter is a sequence of (kind, width) tuples,
+        in the field order (see 'layout').
+        
+        """
+        if len(fields) > 64:
+            raise ValueError("a table can't have more than 64 fields")
+        
+        self.path = path
+        self.fields = tuple(fields)
+        format = "<BQ"
+        for kind, width in self.fields:
+            format += "q" if kind == "i" else "I{}s".format(width)
+        
+        self.struct = struct.Struct(format)
+        self.record_size = self.struct.size
+        self.file = None
+        self.map = None
+        if os.path.exists(path):
+            self.open()
+        else:
+            self.create()
+    
+    def __repr__(self):
+        return "<table {} ({} records)>".format(repr(self.path),
+                self.capacity)
+    
+    @staticmethod
+    def layout(schema, string_size):
+        """Return the fields of a model's schema, as (kind, width) tuples.
+        
+        The strings with a maximum size (in characters) are 4 bytes
+        wide by character, the others 'string_size' bytes wide.  Raise
+        a ValueError if a field type is not supported.
+        
+        """
+        fields = []
+        for field in schema.fields:
+            if isinstance(field, Integer):
+                fields.append(("i", 8))
+            elif isinstance(field, String):
+                fields.append(("s", 4 * field.max_size if \
+                        field.max_size else string_size))
+            else:
+                raise ValueError("the field {} of {} has not a fixed " \
+                        "size".format(field.field_name, schema.name))
+        
+        return fields
+    
+    def create(self):
+        """Create the file, with an empty header."""
+        self.file = open(self.path, "w+b")
+        self.file.truncate(HEADER_SIZE + MIN_CAPACITY * self.record_size)
+        self.map = mmap.mmap(self.file.fileno(), 0)
+        HEADER.pack_into(self.map, 0, MAGIC, VERSION, len(self.fields),
+                self.record_size, 1)
+        self.capacity = MIN_CAPACITY
+    
+    def open(self):
+        """Open the file and check its header."""
+        self.file = open(self.path, "r+b")
+        self.map = mmap.mmap(self.file.fileno(), 0)
+        magic, version, number, record_size, next_id = HEADER.unpack_from(
+                self.map, 0)
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ValueError("the file {} is not a table".format(
+                    repr(self.path)))
+        
+        if number != len(self.fields) or record_size != self.record_size:
+            self.close()
+            raise ValueError("the records of the file {} don't match " \
+                    "the model".format(repr(self.path)))
+        
+        self.capacity = (len(self.map) - HEADER_SIZE) // self.record_size
+    
+    @property
+    def next_id(self):
+        """Return the next auto-increment value."""
+        return HEADER.unpack_from(self.map, 0)[4]
+    
+    @next_id.setter
+    def next_id(self, value):
+        """Write the next auto-increment value in the header."""
+        struct.pack_into("<Q", self.map, HEADER.size - 8, value)
+    
+    def grow(self, capacity):
+        """Extend the file to contain 'capacity' records at least.
+        
+        The capacity is doubled at least, so that the file is not
+        extended on every new record.
+        
+        """
+        capacity = max(capacity, self.capacity * 2)
+        self.map.close()
+        self.file.truncate(HEADER_SIZE + capacity * self.record_size)
+        self.map = mmap.mmap(self.file.fileno(), 0)
+        self.capacity = capacity
+    
+    def offset(self, id):
+        """Return the offset of a record, or None if out of the file."""
+        if not isinstance(id, int) or id < 1 or id > self.capacity:
+            return None
+        
+        return HEADER_SIZE + (id - 1) * self.record_size
+    
+    def exists(self, id):
+        """Return whether the record of this ID exists."""
+        offset = self.offset(id)
+        return offset is not None and self.map[offset] == 1
+    
+    def read(self, id):
+        """Return the values of a record (a tuple), or None if not found."""
+        offset = self.offset(id)
+        if offset is None or self.map[offset] != 1:
+            return None
+        
+        return self.decode(self.struct.unpack_from(self.map, offset))
+    
+    def read_batches(self, size):
+        """Iterate over the values of the records by batches.
+        
+        Each batch is a list of tuples, read from 'size' slots.  The
+        batches are decoded through a memoryview of the mapped file,
+        released before the batch is returned.
+        
+        """
+        record_size = self.record_size
+        decode = self.decode
+        first = 0
+        while first < self.capacity:
+            last = min(first + size, self.capacity)
+            start = HEADER_SIZE + first * record_size
+            with memoryview(self.map) as view:
+                records = self.struct.iter_unpack(view[start:HEADER_SIZE + \
+                        last * record_size])
+                batch = [decode(record) for record in records if \
+                        record[0] == 1]
+            
+            if batch:
+                yield batch
+            first = last
+    
+    def decode(self, record):
+        """Return the values of a record unpacked by the struct."""
+        mask = record[1]
+        values = []
+        position = 2
+        for i, (kind, width) in enumerate(self.fields):
+            if kind == "i":
+                value = record[position]
+                position += 1
+            else:
+                value = record[position + 1][:record[position]].decode(
+                        "utf-8")
+                position += 2
+            
+            values.append(None if mask & (1 << i) else value)
+        
+        return tuple(values)
+    
+    def encode(self, values):
+        """Return the arguments of the struct to pack the values.
+        
+        Raise a ValueError if a value can't be stored in its field.
+        
+        """
+        mask = 0
+        arguments = [1, 0]
+        for i, ((kind, width), value) in enumerate(zip(self.fields, values)):
+            if value is None:
+                mask |= 1 << i
+                arguments.extend((0, ) if kind == "i" else (0, b""))
+            elif kind == "i":
+                if not -2 ** 63 <= value < 2 ** 63:
+                    raise ValueError("the integer {} can't be stored on " \
+                            "8 bytes".format(value))
+                
+                arguments.append(value)
+            else:
+                encoded = value.encode("utf-8")
+                if len(encoded) > width:
+                    raise ValueError("the string {} can't be stored on " \
+                            "{} bytes".format(repr(value), width))
+                
+                arguments.extend((len(encoded), encoded))
+        
+        arguments[1] = mask
+        return arguments
+    
+    def write(self, id, values):
+        """Write the values (a tuple in the field order) of a record."""
+        arguments = self.encode(values)
+        if id > self.capacity:
+            self.grow(id)
+        
+        self.struct.pack_into(self.map, self.offset(id), *arguments)
+    
+    def delete(self, id):
+        """Delete a record (its slot is marked as empty)."""
+        offset = self.offset(id)
+        if offset is not None:
+            self.map[offset] = 0
+    
+    def flush(self):
+        """Write the changes on disk."""
+        if self.map is not None:
+            self.map.flush()
+    
+    def close(self):
+        """Close the file."""
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+        
+        if self.file is not None:
+            self.file.close()
+            self.file = None
@@ -28,8 +28,6 @@
 
 """Module defining the MongoConnector class."""
 
-import os
-
 driver = True
 
 try:
@@ -37,6 +35,14 @@ try:
 except ImportError:
     driver = False
 
+async_driver = True
+
+try:
+    from motor.motor_asyncio import AsyncIOMotorClient
+except ImportError:
+    async_driver = False
+
+from dc.allocator import BlockAllocator
 from dc.connector import DataConnector
 from dc import exceptions
 from model import exceptions as mod_exceptions
@@ -55,9 +61,40 @@ class MongoDBConnector(DataConnector):
     as Python Aboard uses schemas to define models, every document in a
     collection should contain the same types of information.
     
+    This data connector uses the pymongo 3 API (or above).
+    
+    The primary key of an object is the '_id' of its document:  the
+    value of the primary key field if the model has only one, an
+    embedded document {field: value} otherwise.  The objects are
+    therefore found through the '_id' index.  The primary key fields
+    are not stored again in the document (see 'get_path').  The
+    documents stored before (with a generated '_id' and the primary key
+    fields) are migrated once, when the model is first recorded (see
+    'migrate_documents').  The primary key of a stored object can't be
+    modified.
+    
+    The auto-increment values are reserved by blocks of 'id_block'
+    values, with one atomic update of the increments collection by
+    block (see dc.allocator.BlockAllocator).
+    
+    The updates only contain the modified attributes ($set).  In
+    write-behind mode, the objects modified before a flush are updated
+    with one unordered bulk write by collection.
+    
+    The objects are counted with 'count_documents', aggregated and
+    grouped with an aggregation pipeline ($match, $sort, $limit and
+    $group stages), without being read.
+    
+    If the motor library is installed, the asynchronous methods
+    reading objects ('afind_object' and 'aiter_objects') use it
+    instead of a thread pool.  The changes are still sent by pymongo,
+    in the thread pool (see DataConnector).
+    
     """
     
     name = "mongo"
+    document_format = 2
+    migration_batch_size = 1000
     def __init__(self):
         """Check the driver presence.
         
@@ -72,15 +109,17 @@ class MongoDBConnector(DataConnector):
         self.db_name = "datas"
         self.inc_name = "increments"
     
-    def setup(self, datas=None, increments=None):
+    def setup(self, datas=None, increments=None, id_block=100):
         """Setup the data connector."""
         datas = datas if datas else self.db_name
         increments = increments if increments else self.inc_name
         self.db_name = datas
         self.inc_name = increments
         
+        self.allocator = BlockAllocator(self.reserve_increments, id_block)
+        
         # Try to connect
-        self.connection = pymongo.Connection()
+        self.connection = pymongo.MongoClient()
         
         # Create the datas and increments collections
         self.datas = self.connection[datas]
@@ -90,19 +129,70 @@ class MongoDBConnector(DataConnector):
         self.collections = {}
         self.inc_collections = {}
         
-        # Keep the IDs in cache
-        self.object_ids = {}
+        # The asynchronous client is created when first needed
+        self.async_connection = None
     
     def close(self):
         """Close the data connector."""
+        self.shutdown_executor()
         self.connection.close()
+        if self.async_connection:
+            self.async_connection.close()
+            self.async_connection = None
+    
+    def get_async_datas(self):
+        """Return the datas database, through the asynchronous client."""
+        if self.async_connection is None:
+            self.async_connection = AsyncIOMotorClient()
+        
+        return self.async_connection[self.db_name]
+    
+    async def afind_object(self, model, pkey_values):
+        """Return the object, read through motor if available."""
+        if not async_driver:
+            return await DataConnector.afind_object(self, model,
+                    pkey_values)
+        
+        object = self.get_from_cache(model, pkey_values)
+        if object is not None:
+            return object
+        
+        schema = get_schema(model)
+        datas = await self.get_async_datas()[schema.name].find_one(
+                {"_id": self.get_document_id(schema, pkey_values)})
+        if datas:
+            return self.load_objects(model, [datas])[0]
+        
+        raise mod_exceptions.ObjectNotFound(model, pkey_values)
+    
+    async def aiter_objects(self, model, batch_size=1000, cache=True):
+        """Iterate over the model's objects, read through motor."""
+        if not async_driver:
+            async for object in DataConnector.aiter_objects(self, model,
+                    batch_size, cache):
+                yield object
+            return
+        
+        await self.aflush()
+        name = get_name(model)
+        cursor = self.get_async_datas()[name].find().batch_size(batch_size)
+        batch = []
+        async for data in cursor:
+            batch.append(data)
+            if len(batch) >= batch_size:
+                for object in self.load_objects(model, batch, cache):
+                    yield object
+                batch = []
+        
+        for object in self.load_objects(model, batch, cache):
+            yield object
     
     def clear(self):
         """Clear the stored datas."""
         for name in self.models.keys():
-            self.datas[name].remove()
+            self.datas[name].delete_many({})
             self.datas.drop_collection(name)
-            self.increments[name].remove({})
+            self.increments[name].delete_many({})
             self.increments.drop_collection(name)
         DataConnector.clear(self)
     
@@ -115,105 +205,429 @@ class MongoDBConnector(DataConnector):
     
     def record_model(self, model):
         """Record the given model."""
-        DataConnector.record_model(self, model)
         name = DataConnector.record_model(self, model)
         self.collections[name] = self.datas[name]
         self.inc_collections[name] = self.increments[name]
-        self.object_ids[name] = {}
+        self.migrate_documents(get_schema(model))
+    
+    def migrate_documents(self, schema):
+        """Store the primary key of the old documents in their '_id'.
+        
+        The old documents have a generated '_id' (an ObjectId) and
+        the primary key fields in the document itself.  Each of them
+        is replaced by a document whose '_id' is its primary key.  The
+        new document is written before the old one is deleted, so that
+        an interrupted migration is resumed the next time.  The
+        requests are sent by batches of 'migration_batch_size'
+        documents.
+        
+        The format of the collection ('document_format') is then kept
+        in the increments collection:  the documents are only browsed
+        if it's older.  Return the number of migrated documents.
+        
+        """
+        increments = self.increments[schema.name]
+        marker = {"name": "__format__"}
+        stored = increments.find_one(marker) or {}
+        if stored.get("version", 1) >= self.document_format:
+            return 0
+        
+        migrated = 0
+        if schema.pkey_names:
+            collection = self.datas[schema.name]
+            requests = []
+            for document in collection.find({schema.pkey_names[0]: {
+                    "$exists": True}}):
+                old_id = document.pop("_id")
+                pkey_values = dict((name, document.pop(name)) for name in \
+                        schema.pkey_names)
+                document["_id"] = self.get_document_id(schema, pkey_values)
+                requests.append(pymongo.ReplaceOne({"_id": document["_id"]},
+                        document, upsert=True))
+                requests.append(pymongo.DeleteOne({"_id": old_id}))
+                if len(requests) >= 2 * self.migration_batch_size:
+                    collection.bulk_write(requests)
+                    migrated += len(requests) // 2
+                    requests = []
+            
+            if requests:
+                collection.bulk_write(requests)
+                migrated += len(requests) // 2
+        
+        increments.update_one(marker, {"$set": {"version":
+                self.document_format}}, upsert=True)
+        return migrated
+    
+    @staticmethod
+    def get_path(schema, name):
+        """Return the path of a field in the documents.
+        
+        The primary key fields are stored in the '_id' field.
+        
+        """
+        if name in schema.pkey_names:
+            return "_id" if len(schema.pkey_names) == 1 else "_id." + name
+        
+        return name
+    
+    @staticmethod
+    def get_document_id(schema, pkey_values):
+        """Return the '_id' of a document.
+        
+        The 'pkey_values' parameter is a dictionary {field: value}
+        containing the primary key fields.
+        
+        """
+        if len(schema.pkey_names) == 1:
+            return pkey_values[schema.pkey_names[0]]
+        
+        return dict((name, pkey_values[name]) for name in schema.pkey_names)
+    
+    def to_document(self, object):
+        """Return the document of an object."""
+        schema = get_schema(type(object))
+        attributes = get_values_dict(object)
+        document = {"_id": self.get_document_id(schema, attributes)}
+        for name in schema.pkey_names:
+            del attributes[name]
+        
+        document.update(attributes)
+        return document
+    
+    @staticmethod
+    def from_document(schema, document):
+        """Return the attributes {field: value} of a document."""
+        attributes = dict(document)
+        document_id = attributes.pop("_id")
+        if len(schema.pkey_names) == 1:
+            attributes[schema.pkey_names[0]] = document_id
+        else:
+            attributes.update(document_id)
+        
+        return attributes
     
     def get_and_update_increment(self, table, field):
         """Get and update an auto-increment field.
         
-        If not found in the specified table, return 1 but update to 2.
+        If not found in the specified table, return 1.
         
         """
-        value = self.increments[table].find_one({
-                "name": field})
-        if value:
-            value = value["current"]
-        else:
-            value = 1
+        return self.allocator.allocate(table, field)
+    
+    def reserve_increments(self, table, field, number):
+        """Reserve 'number' values of an auto-increment field.
         
-        self.increments[table].remove({"name": field})
-        self.increments[table].insert({
-                "name": field,
-                "current": value + 1,
-        })
+        The first reserved value is returned, the following ones being
+        reserved as well.  The reservation is done in one atomic
+        update of the increments document, which stores the last
+        reserved value.
         
-        return value
+        """
+        document = self.increments[table].find_one_and_update(
+                {"name": field}, {"$inc": {"current": number}}, upsert=True,
+                return_document=pymongo.ReturnDocument.AFTER)
+        return document["current"] - number + 1
     
     def get_all_objects(self, model):
         """Return all the model's object in a list."""
         name = get_name(model)
-        datas = self.datas[name].find()
-        objects = []
-        for data in datas:
-            m_id = data["_id"]
-            del data["_id"]
-            object = self.get_from_cache(model, data)
-            if object is None:
-                object = model()
-                update(object, data)
-                self.cache_object(object)
-                self.object_ids[name][object] = m_id
+        return self.load_objects(model, self.datas[name].find())
+    
+    def select_objects(self, query):
+        """Return the objects matching the query (a QuerySet).
+        
+        The conditions are translated in a query document, the order
+        and the limit are given to the cursor.  Only the selected fields
+        are read (see QuerySet.only).
+        
+        """
+        schema = get_schema(query.model)
+        projection = None
+        if query.fields:
+            # The '_id' field (the primary key) is always read
+            projection = dict((field, True) for field in query.fields if \
+                    field not in schema.pkey_names)
+            projection["_id"] = True
+        
+        datas = self.datas[schema.name].find(self.build_filter(query),
+                projection)
+        if query.ordering:
+            datas = datas.sort(self.build_sort(query))
+        
+        if query.limit_count is not None:
+            if query.limit_count == 0:
+                return []
             
-            objects.append(object)
+            datas = datas.limit(query.limit_count)
         
-        return objects
+        return self.load_objects(query.model, datas, names=query.fields)
+    
+    def build_filter(self, query):
+        """Return the query document matching the query's conditions."""
+        schema = get_schema(query.model)
+        document = {}
+        for name, op, value in query.conditions:
+            if op == "exact":
+                condition = {"$eq": value}
+            elif op == "in":
+                condition = {"$in": list(value)}
+            else:
+                condition = {"$" + op: value}
+            
+            document.setdefault(self.get_path(schema, name), {}).update(
+                    condition)
+        
+        return document
+    
+    def build_sort(self, query):
+        """Return the sort specification of the query's ordering."""
+        schema = get_schema(query.model)
+        return [(self.get_path(schema, name), pymongo.DESCENDING if \
+                descending else pymongo.ASCENDING) for name, descending in \
+                query.ordering]
+    
+    def build_pipeline(self, query):
+        """Return the aggregation stages selecting the query's documents."""
+        pipeline = [{"$match": self.build_filter(query)}]
+        if query.limit_count is not None:
+            if query.ordering:
+                pipeline.append({"$sort": dict(self.build_sort(query))})
+            pipeline.append({"$limit": query.limit_count})
+        
+        return pipeline
+    
+    def count_objects(self, query):
+        """Return the number of objects matching the query."""
+        if query.limit_count == 0:
+            return 0
+        
+        options = {}
+        if query.limit_count is not None:
+            options["limit"] = query.limit_count
+        
+        return self.datas[get_name(query.model)].count_documents(
+                self.build_filter(query), **options)
+    
+    def aggregate_objects(self, query, aggregates):
+        """Aggregate the fields of the matching objects ($group stage)."""
+        results = dict((function, 0 if function == "sum" else None) for \
+                function in aggregates)
+        if query.limit_count == 0:
+            return results
+        
+        schema = get_schema(query.model)
+        group = {"_id": None}
+        for function, name in aggregates.items():
+            group[function] = {"$" + function: "$" + self.get_path(schema,
+                    name)}
+        
+        pipeline = self.build_pipeline(query) + [{"$group": group}]
+        for document in self.datas[get_name(query.model)].aggregate(
+                pipeline):
+            results.update((function, document[function]) for function \
+                    in aggregates)
+        
+        return results
+    
+    def group_objects(self, query, name, aggregates):
+        """Group the matching objects by the value of a field ($group)."""
+        if query.limit_count == 0:
+            return {}
+        
+        schema = get_schema(query.model)
+        group = {"_id": "$" + self.get_path(schema, name),
+                "count": {"$sum": 1}}
+        for function, field_name in aggregates.items():
+            group[function] = {"$" + function: "$" + self.get_path(schema,
+                    field_name)}
+        
+        pipeline = self.build_pipeline(query) + [{"$group": group}]
+        groups = {}
+        for document in self.datas[get_name(query.model)].aggregate(
+                pipeline):
+            key = document.pop("_id")
+            groups[key] = document
+        
+        return groups
+    
+    def iter_objects(self, model, batch_size=1000, cache=True):
+        """Iterate over the model's objects.
+        
+        The documents are received by batches of 'batch_size' documents.
+        
+        """
+        name = get_name(model)
+        datas = self.datas[name].find().batch_size(batch_size)
+        batch = []
+        for data in datas:
+            batch.append(data)
+            if len(batch) >= batch_size:
+                for object in self.load_objects(model, batch, cache):
+                    yield object
+                batch = []
+        
+        for object in self.load_objects(model, batch, cache):
+            yield object
+    
+    def load_objects(self, model, datas, cache=True, names=None):
+        """Return the objects built from the documents.
+        
+        See DataConnector.load_objects.
+        
+        """
+        schema = get_schema(model)
+        from_document = self.from_document
+        return DataConnector.load_objects(self, model, [from_document(schema,
+                data) for data in datas], cache, names, mapping=True)
+    
+    def read_fields(self, objects, names):
+        """Read the specified fields of the objects, in one query."""
+        if not objects:
+            return {}
+        
+        schema = get_schema(type(objects[0]))
+        by_pkey = dict((schema.get_pkey(object), object) for object in \
+                objects)
+        document_ids = [self.build_selector(object)["_id"] for object in \
+                objects]
+        projection = dict((self.get_path(schema, field), True) for field in \
+                names)
+        values = {}
+        for data in self.datas[schema.name].find({"_id": {"$in":
+                document_ids}}, projection):
+            attributes = self.from_document(schema, data)
+            object = by_pkey.get(schema.get_dict_pkey(attributes))
+            if object is not None:
+                values[object] = tuple(attributes.get(field) for field in \
+                        names)
+        
+        return values
     
     def find_object(self, model, pkey_values):
         """Return, if found, the selected object.
         
-        Raise a model.exceptions.ObjectNotFound if not found.
+        The document is found through its '_id'.  Raise a
+        model.exceptions.ObjectNotFound if not found.
         
         """
         # Look for the object in the cached tree
-        name = get_name(model)
         object = self.get_from_cache(model, pkey_values)
         if object:
             return object
         
         # Look for the object in the datas
-        datas = self.datas[name].find_one(pkey_values)
+        schema = get_schema(model)
+        datas = self.datas[schema.name].find_one({"_id":
+                self.get_document_id(schema, pkey_values)})
         if datas:
-            m_id = datas["_id"]
-            del datas["_id"]
-            object = model.build(**datas)
-            self.cache_object(object)
-            self.object_ids[name][object] = m_id
-            return object
+            return self.load_objects(model, [datas])[0]
         
         raise mod_exceptions.ObjectNotFound(model, pkey_values)
     
     def add_object(self, mod_object):
         """Save the object, issued from a model."""
-        name = get_name(type(mod_object))
-        fields = get_fields(type(mod_object))
-        for field in fields:
-            if not field.auto_increment:
-                continue
-            
-            value = self.get_and_update_increment(name, field.field_name)
-            update_attr(mod_object, field.field_name, value)
+        schema = get_schema(type(mod_object))
+        name = schema.name
+        for field in schema.auto_increments:
+            value = self.get_and_update_increment(name, field)
+            update_attr(mod_object, field, value)
         
-        m_id = self.datas[name].insert(mod_object.__dict__)
+        self.datas[name].insert_one(self.to_document(mod_object))
         self.cache_object(mod_object)
-        self.object_ids[name][mod_object] = m_id
+    
+    def add_objects(self, objects):
+        """Save the objects, issued from the same model.
+        
+        The auto-increment values are reserved in one update and the
+        documents are sent with a single insert_many.
+        
+        """
+        if not objects:
+            return
+        
+        schema = get_schema(type(objects[0]))
+        name = schema.name
+        for field in schema.auto_increments:
+            value = self.allocator.allocate(name, field, len(objects))
+            for i, mod_object in enumerate(objects):
+                update_attr(mod_object, field, value + i)
+        
+        documents = [self.to_document(mod_object) for mod_object in objects]
+        self.datas[name].insert_many(documents)
+        self.cache_objects(objects)
     
     def update_object(self, object, attribute):
         """Update an object."""
+        self.update_fields(object, (attribute, ))
+    
+    def update_fields(self, object, attributes):
+        """Update several attributes of an object, in one request.
+        
+        Only the modified attributes are sent ($set).
+        
+        """
         self.check_update(object)
-        name = get_name(type(object))
-        m_id = self.object_ids[name][object]
-        f_update = dict(object.__dict__)
-        f_update["_id"] = m_id
-        self.datas[name].update({"_id": m_id}, f_update)
+        schema = get_schema(type(object))
+        self.datas[schema.name].update_one(self.build_selector(object),
+                self.build_update(object, attributes))
+    
+    def update_objects(self, dirty_objects):
+        """Update several objects, with one bulk write by collection.
+        
+        The updates of each object only contain the modified
+        attributes ($set).  They are sent unordered:  the server can
+        apply them in parallel.
+        
+        """
+        requests = {}
+        for object, attributes in dirty_objects.items():
+            self.check_update(object)
+            name = get_name(type(object))
+            requests.setdefault(name, []).append(pymongo.UpdateOne(
+                    self.build_selector(object), self.build_update(object,
+                    attributes)))
+        
+        for name, operations in requests.items():
+            self.datas[name].bulk_write(operations, ordered=False)
+    
+    def build_selector(self, object):
+        """Return the query document selecting the object's document."""
+        schema = get_schema(type(object))
+        pkey_values = dict(zip(schema.pkey_names, schema.get_pkey_values(
+                object)))
+        return {"_id": self.get_document_id(schema, pkey_values)}
+    
+    def build_update(self, object, attributes):
+        """Return the update document setting the attributes ($set).
+        
+        Raise a ValueError if a primary key field was modified (the
+        '_id' of a document can't be).
+        
+        """
+        schema = get_schema(type(object))
+        for attribute in attributes:
+            if attribute in schema.pkey_names:
+                raise ValueError("the primary key field {} of {} can't " \
+                        "be modified".format(attribute, repr(object)))
+        
+        return {"$set": dict((self.get_path(schema, attribute),
+                getattr(object, attribute)) for attribute in attributes)}
     
     def remove_object(self, object):
         """Delete the object."""
         # Delete from cache
         self.uncache_object(object)
         name = get_name(type(object))
-        m_id = self.object_ids[name][object]
-        self.datas[name].remove(m_id, safe=True)
-        del self.object_ids[name][object]
+        self.datas[name].delete_one(self.build_selector(object))
+    
+    def remove_objects(self, objects):
+        """Delete the objects, issued from the same model, in one request."""
+        if not objects:
+            return
+        
+        name = get_name(type(objects[0]))
+        document_ids = [self.build_selector(object)["_id"] for object in \
+                objects]
+        self.datas[name].delete_many({"_id": {"$in": document_ids}})
+        for object in objects:
+            self.uncache_object(object)
@@ -28,7 +28,10 @@
 
 """Module defining the Sqlite3Connector class."""
 
+from contextlib import contextmanager
 import os
+import threading
+import weakref
 
 from model.types import *
 
@@ -37,6 +40,49 @@ SQLITE_TYPES = {
     String: "text",
 }
 
+SQLITE_OPERATORS = {
+    "exact": "=",
+    "ne": "!=",
+    "gt": ">",
+    "gte": ">=",
+    "lt": "<",
+    "lte": "<=",
+}
+
+SQLITE_AGGREGATES = {
+    "sum": "COALESCE(SUM({}), 0)",
+    "min": "MIN({})",
+    "max": "MAX({})",
+}
+
+# PRAGMA presets, applied on each connection
+PRAGMAS = ("page_size", "journal_mode", "synchronous", "cache_size",
+        "mmap_size", "temp_store")
+
+PRAGMA_PRESETS = {
+    "durable": {
+        "journal_mode": "wal",
+        "synchronous": "full",
+        "cache_size": -2000,
+        "mmap_size": 0,
+        "temp_store": "default",
+    },
+    "balanced": {
+        "journal_mode": "wal",
+        "synchronous": "normal",
+        "cache_size": -64000,
+        "mmap_size": 268435456,
+        "temp_store": "memory",
+    },
+    "bulk_load": {
+        "journal_mode": "wal",
+        "synchronous": "off",
+        "cache_size": -256000,
+        "mmap_size": 268435456,
+        "temp_store": "memory",
+    },
+}
+
 driver = True
 
 try:
@@ -49,6 +95,18 @@ from dc import exceptions
 from model import exceptions as mod_exceptions
 from model.functions import *
 
+class ThreadToken:
+    
+    """Object kept by a thread, collected when the thread ends.
+    
+    A token is created with each connection and stored in the
+    thread-local datas:  when it is collected, the connection is
+    closed (see Sqlite3Connector.reclaim_connection).
+    
+    """
+    
+    __slots__ = ("__weakref__", )
+
 class Sqlite3Connector(DataConnector):
     
     """Data connector for sqlite3.
@@ -56,6 +114,61 @@ class Sqlite3Connector(DataConnector):
     This data connector should read and write datas using the sqlite3
     module (part of the python standard library).
     
+    The changes are committed in 'loop'.  A group of changes can also
+    be done in a transaction, which is committed at once if no
+    exception is raised, rolled back otherwise:
+    >>> with connector.transaction():
+    ...     user = User(username="admin")
+    ...     user.password = "..."
+    ... 
+    The outermost transaction begins with BEGIN IMMEDIATE, so that the
+    write lock is taken at once (a transaction reading before writing
+    could otherwise fail if another thread writes meanwhile).
+    Transactions can be nested (each nested transaction being a
+    SAVEPOINT).  When a transaction is rolled back, the cache is
+    restored:  the created objects are removed from it, the deleted
+    objects are put back and the updated objects are read again.
+    
+    The auto-increment values are always assigned by sqlite3, so that
+    several threads or processes can insert in the same table.  The
+    value of an object saved alone is read from the cursor
+    ('lastrowid').  The objects saved together are inserted in one
+    'executemany' call and their values are deduced from the last one.
+    
+    The statements used to insert, update, delete and find an object
+    are built once for each model, when it is recorded (see
+    'build_statements'), so that sqlite3 finds them in its statement
+    cache.  The size of this cache is set by the 'cached_statements'
+    parameter.
+    
+    The objects are counted, aggregated and grouped in SQL (see
+    'build_aggregate'), without being read.
+    
+    The data connector can be shared between threads:  each thread
+    uses its own connection (see 'connection'), opened when first
+    needed.  The database is in WAL mode, so that the threads can read
+    while another one writes.  Only one thread can write at a time,
+    the others waiting for 'timeout' seconds at most.  Each thread
+    commits its changes by calling 'loop' or in a transaction.  The
+    database can't be in memory (each connection would open its own).
+    The connection of a thread is closed (and its changes committed)
+    when the thread ends (see 'reclaim_connection').
+    Since the asynchronous methods (see DataConnector) run in other
+    threads, the changes of the calling thread should be committed
+    before:  the connector should be used in write-behind mode.
+    
+    The connections are tuned with PRAGMA statements, following a
+    preset ("durable", "balanced" or "bulk_load", see PRAGMA_PRESETS)
+    whose values can be overridden (see the 'preset' and 'pragmas'
+    parameters).  The default preset, "durable", syncs each commit to
+    the disk:  a deployment can opt into "balanced" (the last commits
+    may be lost on a power failure) or "bulk_load".  The PRAGMA can be
+    changed at runtime, before an import job for instance:
+    >>> previous = connector.set_pragmas("bulk_load")
+    >>> # ...
+    >>> connector.set_pragmas(**previous)
+    The 'page_size' only applies to a new database.
+    
     """
     
     name = "sqlite3"
@@ -71,8 +184,10 @@ class Sqlite3Connector(DataConnector):
         
         self.location = None
         self.created_tables = ()
+        self.statements = {}
     
-    def setup(self, location=None):
+    def setup(self, location=None, cached_statements=128, timeout=5.0,
+            preset="durable", pragmas=None):
         """Setup the data connector."""
         if location is None:
             raise exceptions.InsufficientConfiguration(
@@ -90,17 +205,182 @@ class Sqlite3Connector(DataConnector):
         
         DataConnector.__init__(self)
         self.location = location
-        self.connection = sqlite3.connect(self.location)
+        self.cached_statements = cached_statements
+        self.timeout = timeout
+        self.local = threading.local()
+        self.connections = []
+        self.pool_lock = threading.Lock()
+        self.pragmas = self.build_pragmas(preset, pragmas or {})
+    
+    @property
+    def connection(self):
+        """Return the connection of the current thread.
+        
+        The connection is opened if needed.  The PRAGMA are applied
+        if they have changed, unless a transaction is in progress.
+        
+        """
+        local = self.local
+        connection = getattr(local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.location, timeout=self.timeout,
+                    cached_statements=self.cached_statements,
+                    check_same_thread=False)
+            local.connection = connection
+            local.pragmas = None
+            local.token = token = ThreadToken()
+            weakref.finalize(token, self.reclaim_connection,
+                    weakref.ref(self), connection)
+            with self.pool_lock:
+                self.connections.append(connection)
+        
+        self.update_pragmas(connection)
+        return connection
+    
+    @staticmethod
+    def reclaim_connection(reference, connection):
+        """Close the connection of a thread that has ended.
+        
+        This method is called when the thread's token is collected.
+        The pending changes are committed.  Nothing is done if the
+        connection was already closed ('release_connection' or
+        'close').
+        
+        """
+        connector = reference()
+        if connector is None:
+            return
+        
+        with connector.pool_lock:
+            if connection not in connector.connections:
+                return
+            
+            connector.connections.remove(connection)
+        
+        connection.commit()
+        connection.close()
+    
+    def update_pragmas(self, connection):
+        """Apply the PRAGMA on the current thread's connection.
+        
+        Nothing is done if the PRAGMA haven't changed since they were
+        last applied, or if a transaction is in progress.
+        
+        """
+        local = self.local
+        if local.pragmas is not self.pragmas and \
+                not connection.in_transaction:
+            self.apply_pragmas(connection, self.pragmas)
+            local.pragmas = self.pragmas
+    
+    @staticmethod
+    def build_pragmas(preset=None, pragmas=None, base=None):
+        """Return the dictionary of PRAGMA to apply.
+        
+        The values of the preset (or of 'base' if no preset is given)
+        are overridden by 'pragmas'.  Raise a ValueError if the preset
+        or a PRAGMA is unknown, or if a value is invalid.
+        
+        """
+        if preset is not None and preset not in PRAGMA_PRESETS:
+            raise ValueError("unknown PRAGMA preset {}, expected one of " \
+                    "{}".format(repr(preset), tuple(sorted(PRAGMA_PRESETS))))
+        
+        result = dict(PRAGMA_PRESETS[preset] if preset else base or {})
+        for name, value in (pragmas or {}).items():
+            if name not in PRAGMAS:
+                raise ValueError("unknown PRAGMA {}, expected one of " \
+                        "{}".format(repr(name), PRAGMAS))
+            
+            if not isinstance(value, int) and not (isinstance(value, str) \
+                    and value.isalnum()):
+                raise ValueError("invalid value {} for the PRAGMA " \
+                        "{}".format(repr(value), name))
+            
+            result[name] = value
+        
+        return result
+    
+    @staticmethod
+    def apply_pragmas(connection, pragmas):
+        """Apply the PRAGMA on the connection, in the PRAGMAS order."""
+        for name in PRAGMAS:
+            if name in pragmas:
+                connection.execute("PRAGMA {}={}".format(name,
+                        pragmas[name]))
+    
+    def set_pragmas(self, preset=None, **pragmas):
+        """Change the PRAGMA of every connection.
+        
+        If a preset is given, its values are used, otherwise the
+        current values are kept.  The named parameters override them.
+        Return the previous PRAGMA (a dictionary).
+        
+        Unless a transaction is in progress, the changes of the current
+        thread are committed and the PRAGMA applied at once.  The other
+        connections apply them when next used outside a transaction.
+        
+        """
+        previous = dict(self.pragmas)
+        self.pragmas = self.build_pragmas(preset, pragmas, previous)
+        if not self.transactions:
+            self.loop()
+            self.update_pragmas(self.connection)
+        
+        return previous
+    
+    @property
+    def transactions(self):
+        """Return the stack of transactions of the current thread."""
+        transactions = getattr(self.local, "transactions", None)
+        if transactions is None:
+            transactions = []
+            self.local.transactions = transactions
+        
+        return transactions
+    
+    def release_connection(self):
+        """Close the connection of the current thread.
+        
+        The pending changes of this thread are committed.  This method
+        should be called before a thread ends.
+        
+        """
+        connection = getattr(self.local, "connection", None)
+        if connection is not None:
+            connection.commit()
+            connection.close()
+            self.local.connection = None
+            with self.pool_lock:
+                self.connections.remove(connection)
+    
+    def commit_thread(self):
+        """Commit the changes of the current thread (a pooled thread).
+        
+        Nothing is committed if a transaction is in progress.
+        
+        """
+        if not self.transactions:
+            self.connection.commit()
     
     def close(self):
-        """Close the data connector."""
-        self.connection.close()
+        """Close the data connector (the connections of every thread)."""
+        self.shutdown_executor()
+        with self.pool_lock:
+            for connection in list(self.connections):
+                connection.close()
+            
+            self.connections = []
+        
+        self.local = threading.local()
     
     def destroy(self):
         """Erase EVERY stored data."""
         self.clear_cache()
-        self.connection.close()
-        os.remove(self.location)
+        self.close()
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(self.location + suffix):
+                os.remove(self.location + suffix)
     
     def record_models(self, models):
         """Record the tables."""
@@ -117,6 +397,41 @@ class Sqlite3Connector(DataConnector):
         name = get_plural_name(model)
         if name not in self.created_tables:
             self.create_table(name, model)
+        
+        self.build_statements(get_schema(model))
+    
+    def build_statements(self, schema):
+        """Build the statements of a model.
+        
+        The statements are stored in the 'statements' dictionary,
+        {model name: {statement name: SQL statement}}:
+            insert -- insert an object (without its auto-increment fields)
+            insert_all -- insert an object with all its fields
+            select -- select an object by primary key
+            delete -- delete an object by primary key
+            update -- a dictionary {field names: UPDATE statement}
+        
+        The UPDATE statements of each single field are built at once,
+        the other ones when first needed (see 'update_query').
+        
+        """
+        table = schema.plural_name
+        where = " AND ".join(name + "=?" for name in schema.pkey_names)
+        names = [name for name in schema.field_names if name not in \
+                schema.auto_increments]
+        statements = {
+            "insert": "INSERT INTO {} ({}) values({})".format(table,
+                    ", ".join(names), ", ".join("?" * len(names))),
+            "insert_all": "INSERT INTO {} ({}) values({})".format(table,
+                    ", ".join(schema.field_names),
+                    ", ".join("?" * len(schema.field_names))),
+            "select": "SELECT * FROM {} WHERE {}".format(table, where),
+            "delete": "DELETE FROM {} WHERE {}".format(table, where),
+            "update": {},
+        }
+        self.statements[schema.name] = statements
+        for name in schema.field_names:
+            self.update_query(schema, (name, ))
     
     def create_table(self, name, model):
         """Create the sqlite table related to the specified model."""
@@ -137,115 +452,444 @@ class Sqlite3Connector(DataConnector):
         cursor.execute(query)
     
     def loop(self):
-        """Commit the database."""
-        self.connection.commit()
+        """Flush the pending changes and commit the database.
+        
+        Nothing is committed if a transaction is in progress.
+        
+        """
+        self.flush()
+        if not self.transactions:
+            self.connection.commit()
+            self.compact_deletions()
+    
+    @contextmanager
+    def transaction(self):
+        """Context manager wrapping the changes in a transaction.
+        
+        The outermost transaction commits the changes done before
+        it and begins a new transaction (BEGIN IMMEDIATE, taking the
+        write lock), committed when leaving the block.  The nested
+        transactions are savepoints.  If an exception is raised in the
+        block, the changes done in it are rolled back and the cache is
+        restored.
+        
+        """
+        self.flush()
+        depth = len(self.transactions)
+        connection = self.connection
+        savepoint = "aboard_{}".format(depth)
+        if depth == 0:
+            connection.commit()
+            self.compact_deletions()
+            connection.execute("BEGIN IMMEDIATE")
+        else:
+            connection.execute("SAVEPOINT " + savepoint)
+        
+        journal = {"added": {}, "updated": {}, "removed": {}}
+        self.transactions.append(journal)
+        try:
+            yield self
+            self.flush()
+        except BaseException:
+            self.transactions.pop()
+            if depth == 0:
+                connection.rollback()
+            else:
+                connection.execute("ROLLBACK TO " + savepoint)
+                connection.execute("RELEASE " + savepoint)
+            
+            self.restore_cache(journal)
+            raise
+        else:
+            self.transactions.pop()
+            if depth == 0:
+                connection.commit()
+            else:
+                connection.execute("RELEASE " + savepoint)
+            
+            if not self.transactions:
+                self.compact_deletions()
+            else:
+                # The parent transaction could still be rolled back
+                parent = self.transactions[-1]
+                for kind, objects in journal.items():
+                    parent[kind].update(objects)
+    
+    def journal(self, kind, objects):
+        """Record the changed objects in the current transaction.
+        
+        The kind of change should be "added", "updated" or "removed".
+        
+        """
+        if self.transactions:
+            self.transactions[-1][kind].update(dict.fromkeys(objects, True))
+    
+    def restore_cache(self, journal):
+        """Restore the cache after a rolled back transaction.
+        
+        The changes registered but not yet flushed are discarded as well.
+        
+        """
+        removed = dict(journal["removed"])
+        removed.update(self.removed_objects)
+        updated = dict(journal["updated"])
+        updated.update(self.dirty_objects)
+        updated.update(removed)
+        self.new_objects.clear()
+        self.dirty_objects.clear()
+        self.removed_objects.clear()
+        for object in journal["added"]:
+            self.uncache_object(object)
+            self.forget_deletion(object)
+        
+        for object in removed:
+            if object not in journal["added"]:
+                self.forget_deletion(object)
+                self.cache_object(object)
+        
+        for object in updated:
+            if object not in journal["added"]:
+                self.refresh_object(object)
+    
+    def refresh_object(self, object):
+        """Read again the attributes of an object in the database."""
+        schema = get_schema(type(object))
+        query = self.statements[schema.name]["select"]
+        cursor = self.connection.cursor()
+        cursor.execute(query, schema.get_pkey_values(object))
+        row = cursor.fetchone()
+        if row is not None:
+            for name, value in zip(schema.field_names, row):
+                update_attr(object, name, value)
+            self.deferred.pop(object, None)
     
     def get_all_objects(self, model):
         """Return all the model's objects in a list."""
-        name = get_name(model)
-        plural_name = get_plural_name(model)
-        fields = get_fields(model)
-        objects = []
-        query = "SELECT * FROM " + plural_name
+        query = "SELECT * FROM " + get_plural_name(model)
         cursor = self.connection.cursor()
         cursor.execute(query)
-        for row in cursor.fetchall():
-            dict_fields = {}
-            for i, field in enumerate(fields):
-                dict_fields[field.field_name] = row[i]
+        return self.load_objects(model, cursor.fetchall())
+    
+    def iter_objects(self, model, batch_size=1000, cache=True):
+        """Iterate over the model's objects, read with 'fetchmany'."""
+        query = "SELECT * FROM " + get_plural_name(model)
+        cursor = self.connection.cursor()
+        cursor.execute(query)
+        rows = cursor.fetchmany(batch_size)
+        while rows:
+            for object in self.load_objects(model, rows, cache):
+                yield object
             
-            object = self.get_from_cache(model, dict_fields)
-            if object is None:
-                object = model.build(**dict_fields)
-                self.cache_object(object)
-            objects.append(object)
+            rows = cursor.fetchmany(batch_size)
+    
+    def select_objects(self, query):
+        """Return the objects matching the query (a QuerySet).
+        
+        The conditions are translated in a parameterized WHERE clause,
+        followed by the ORDER BY and LIMIT clauses if needed.  Only the
+        selected fields are read (see QuerySet.only).
+        
+        """
+        columns = ", ".join(query.fields) if query.fields else "*"
+        sql, params = self.build_select(query, columns)
+        cursor = self.connection.cursor()
+        cursor.execute(sql, params)
+        return self.load_objects(query.model, cursor.fetchall(),
+                names=query.fields)
+    
+    def build_select(self, query, columns="*"):
+        """Return the SELECT statement of a query and its parameters."""
+        sql = "SELECT " + columns + " FROM " + get_plural_name(query.model)
+        where, params = self.build_where(query)
+        if where:
+            sql += " WHERE " + where
+        
+        if query.ordering:
+            sql += " ORDER BY " + ", ".join(name + (" DESC" if descending \
+                    else "") for name, descending in query.ordering)
+        
+        if query.limit_count is not None:
+            sql += " LIMIT ?"
+            params.append(query.limit_count)
+        
+        return sql, tuple(params)
+    
+    def build_aggregate(self, query, columns, group=None):
+        """Return the statement aggregating the selected rows.
+        
+        The 'columns' are SQL expressions (like "COUNT(*)").  If the
+        query is limited, the rows are selected in a sub-query.  If
+        'group' is given, the rows are grouped by this field, whose
+        value is the first column.
+        
+        """
+        if group:
+            columns = [group] + list(columns)
+        
+        columns = ", ".join(columns)
+        if query.limit_count is None:
+            sql, params = self.build_select(query.clone(ordering=()),
+                    columns)
+        else:
+            sql, params = self.build_select(query)
+            sql = "SELECT {} FROM ({})".format(columns, sql)
+        
+        if group:
+            sql += " GROUP BY " + group
+        
+        return sql, params
+    
+    def count_objects(self, query):
+        """Return the number of objects matching the query (COUNT)."""
+        sql, params = self.build_aggregate(query, ["COUNT(*)"])
+        cursor = self.connection.cursor()
+        cursor.execute(sql, params)
+        return cursor.fetchone()[0]
+    
+    def aggregate_objects(self, query, aggregates):
+        """Aggregate the fields of the matching objects (SUM, MIN, MAX).
+        
+        The sum of no value is 0.
+        
+        """
+        functions = list(aggregates)
+        sql, params = self.build_aggregate(query, [SQLITE_AGGREGATES[
+                function].format(aggregates[function]) for function in \
+                functions])
+        cursor = self.connection.cursor()
+        cursor.execute(sql, params)
+        return dict(zip(functions, cursor.fetchone()))
+    
+    def group_objects(self, query, name, aggregates):
+        """Group the matching objects by the value of a field (GROUP BY)."""
+        functions = list(aggregates)
+        sql, params = self.build_aggregate(query, ["COUNT(*)"] + [
+                SQLITE_AGGREGATES[function].format(aggregates[function]) \
+                for function in functions], group=name)
+        cursor = self.connection.cursor()
+        cursor.execute(sql, params)
+        groups = {}
+        for row in cursor.fetchall():
+            results = {"count": row[1]}
+            results.update(zip(functions, row[2:]))
+            groups[row[0]] = results
+        
+        return groups
+    
+    def build_where(self, query):
+        """Return the WHERE clause of a query and its parameters."""
+        filters = []
+        params = []
+        for name, op, value in query.conditions:
+            if op == "in":
+                if not value:
+                    filters.append("0")
+                    continue
+                
+                filters.append("{} IN ({})".format(name,
+                        ", ".join("?" * len(value))))
+                params.extend(value)
+            elif value is None and op in ("exact", "ne"):
+                filters.append(name + (" IS NULL" if op == "exact" else \
+                        " IS NOT NULL"))
+            else:
+                filters.append("{} {} ?".format(name, SQLITE_OPERATORS[op]))
+                params.append(value)
         
-        return objects
+        return " AND ".join(filters), params
+    
+    def read_fields(self, objects, names):
+        """Read the specified fields of the objects.
+        
+        The objects are read by primary key, 500 at a time.
+        
+        """
+        if not objects:
+            return {}
+        
+        schema = get_schema(type(objects[0]))
+        pkey_names = schema.pkey_names
+        columns = ", ".join(pkey_names + tuple(names))
+        get_row_pkey = schema.get_pkey_getter(pkey_names + tuple(names))
+        by_pkey = dict((schema.get_pkey(object), object) for object in \
+                objects)
+        pkeys = list(by_pkey)
+        rows = []
+        cursor = self.connection.cursor()
+        if len(pkey_names) == 1:
+            for i in range(0, len(pkeys), 500):
+                chunk = pkeys[i:i + 500]
+                cursor.execute("SELECT {} FROM {} WHERE {} IN ({})".format(
+                        columns, schema.plural_name, pkey_names[0],
+                        ", ".join("?" * len(chunk))), tuple(chunk))
+                rows.extend(cursor.fetchall())
+        else:
+            query = "SELECT {} FROM {} WHERE {}".format(columns,
+                    schema.plural_name, " AND ".join(name + "=?" for \
+                    name in pkey_names))
+            for object in objects:
+                cursor.execute(query, schema.get_pkey_values(object))
+                rows.extend(cursor.fetchall())
+        
+        values = {}
+        number = len(pkey_names)
+        for row in rows:
+            object = by_pkey.get(get_row_pkey(row))
+            if object is not None:
+                values[object] = tuple(row[number:])
+        
+        return values
     
     def find_object(self, model, pkey_values):
         """Return, if found, the specified object."""
         # First, look for the object in the cached tree
-        pkey_values_list = list(pkey_values.values())
         object = self.get_from_cache(model, pkey_values)
         if object:
             return object
         
-        query = "SELECT * FROM {} WHERE ".format(get_plural_name(model))
-        params = []
-        filters = []
-        for name, value in pkey_values.items():
-            filters.append("{}=?".format(name))
-            params.append(value)
-        
-        query += " AND ".join(filters)
+        schema = get_schema(model)
+        query = self.statements[schema.name]["select"]
+        params = tuple(pkey_values[name] for name in schema.pkey_names)
         cursor = self.connection.cursor()
-        cursor.execute(query, tuple(params))
+        cursor.execute(query, params)
         row = cursor.fetchone()
         if row is None:
             raise mod_exceptions.ObjectNotFound(model, pkey_values)
         
-        dict_fields = {}
-        for i, field in enumerate(get_fields(model)):
-            dict_fields[field.field_name] = row[i]
-        
-        object = model.build(**dict_fields)
-        self.cache_object(object)
-        return object
+        object = schema.get_hydrator()(row)
+        cache = self.objects_tree[schema.name]
+        return cache.setdefault(schema.get_row_pkey(row), object)
     
     def add_object(self, object):
         """Save the object, issued from a model."""
-        name = get_name(type(object))
-        fields = get_fields(type(object))
-        plural_name = get_plural_name(type(object))
-        query = "INSERT INTO " + plural_name + " ("
-        names = []
-        values = []
-        auto_increments = []
-        for field in fields:
-            if field.auto_increment:
-                auto_increments.append(field.field_name)
-                continue
-            
-            names.append(field.field_name)
-            values.append(getattr(object, field.field_name))
-        
-        query += ", ".join(names) + ") values("
-        query += ", ".join("?" * len(values)) + ")"
+        schema = get_schema(type(object))
+        values = tuple(getattr(object, name) for name in \
+                schema.field_names if name not in schema.auto_increments)
         cursor = self.connection.cursor()
-        cursor.execute(query, tuple(values))
+        cursor.execute(self.statements[schema.name]["insert"], values)
         
-        for field in auto_increments:
-            query = "SELECT max(" + field + ") FROM " + plural_name
-            cursor.execute(query)
-            row = cursor.fetchone()
-            value = row[0]
-            update_attr(object, field, value)
+        for field in schema.auto_increments:
+            # Only the INTEGER PRIMARY KEY can be an auto-increment field
+            update_attr(object, field, cursor.lastrowid)
         
         self.cache_object(object)
+        self.journal("added", (object, ))
+    
+    def add_objects(self, objects):
+        """Save the objects, issued from the same model.
+        
+        The objects are inserted with a single 'executemany' call.  The
+        auto-increment values are assigned by sqlite3:  the statement
+        holds the write lock of the database, so that the values are
+        contiguous and deduced from the last one.
+        
+        """
+        if not objects:
+            return
+        
+        schema = get_schema(type(objects[0]))
+        cursor = self.connection.cursor()
+        if schema.auto_increments:
+            auto_increments = schema.auto_increments
+            query = self.statements[schema.name]["insert"]
+            rows = [tuple(getattr(object, name) for name in \
+                    schema.field_names if name not in auto_increments) \
+                    for object in objects]
+            cursor.executemany(query, rows)
+            cursor.execute("SELECT last_insert_rowid()")
+            first = cursor.fetchone()[0] - len(objects) + 1
+            for field in auto_increments:
+                for i, object in enumerate(objects):
+                    update_attr(object, field, first + i)
+        else:
+            query = self.statements[schema.name]["insert_all"]
+            get_values = schema.get_values
+            cursor.executemany(query, [get_values(object) for object in \
+                    objects])
+        
+        self.cache_objects(objects)
+        self.journal("added", objects)
     
     def update_object(self, object, attribute):
         """Update an object."""
+        self.update_fields(object, (attribute, ))
+    
+    def update_fields(self, object, attributes):
+        """Update several attributes of an object, in one statement."""
         self.check_update(object)
-        plural_name = get_plural_name(type(object))
-        keys = get_pkey_names(type(object))
-        params = [getattr(object, attribute)] + list(get_pkey_values(object))
-        names = [name + "=?" for name in keys]
-        query = "UPDATE " + plural_name + " SET " + attribute + "=?"
-        query += " WHERE " + " AND ".join(names)
+        schema = get_schema(type(object))
+        names = sorted(attributes, key=schema.indexes.get)
+        params = tuple(getattr(object, name) for name in names) + \
+                schema.get_pkey_values(object)
         cursor = self.connection.cursor()
-        cursor.execute(query, tuple(params))
+        cursor.execute(self.update_query(schema, names), params)
+        self.journal("updated", (object, ))
+    
+    def update_objects(self, dirty_objects):
+        """Update several objects.
+        
+        The objects of the same model with the same modified attributes
+        are updated through a single 'executemany' call.
+        
+        """
+        groups = {}
+        for object, attributes in dirty_objects.items():
+            self.check_update(object)
+            schema = get_schema(type(object))
+            names = tuple(sorted(attributes, key=schema.indexes.get))
+            params = tuple(getattr(object, name) for name in names) + \
+                    schema.get_pkey_values(object)
+            groups.setdefault((schema, names), []).append(params)
+        
+        cursor = self.connection.cursor()
+        for (schema, names), params in groups.items():
+            cursor.executemany(self.update_query(schema, names), params)
+        
+        self.journal("updated", dirty_objects)
+    
+    def update_query(self, schema, names):
+        """Return the UPDATE statement of the specified attributes.
+        
+        The statement is built once for each tuple of names.
+        
+        """
+        statements = self.statements[schema.name]["update"]
+        names = tuple(names)
+        query = statements.get(names)
+        if query is None:
+            query = "UPDATE " + schema.plural_name + " SET "
+            query += ", ".join(name + "=?" for name in names)
+            query += " WHERE " + " AND ".join(name + "=?" for name in \
+                    schema.pkey_names)
+            statements[names] = query
+        
+        return query
     
     def remove_object(self, object):
         """Delete the object."""
-        name = get_name(type(object))
-        plural_name = get_plural_name(type(object))
-        keys = get_pkey_names(type(object))
-        names = [name + "=?" for name in keys]
-        values = tuple(get_pkey_values(object))
-        query = "DELETE FROM " + plural_name
-        query += " WHERE " + " AND ".join(names)
+        schema = get_schema(type(object))
+        values = schema.get_pkey_values(object)
         cursor = self.connection.cursor()
-        cursor.execute(query, values)
+        cursor.execute(self.statements[schema.name]["delete"], values)
         
         # Delete from cache
         self.uncache_object(object)
+        self.journal("removed", (object, ))
+    
+    def remove_objects(self, objects):
+        """Delete the objects through a single 'executemany' call."""
+        if not objects:
+            return
+        
+        schema = get_schema(type(objects[0]))
+        query = self.statements[schema.name]["delete"]
+        get_pkey_values = schema.get_pkey_values
+        cursor = self.connection.cursor()
+        cursor.executemany(query, [get_pkey_values(object) for object in \
+                objects])
+        
+        # Delete from cache
+        for object in objects:
+            self.uncache_object(object)
+        
+        self.journal("removed", objects)
@@ -28,6 +28,7 @@
 
 """Module defining the YAMLConnector class."""
 
+from collections import OrderedDict
 import os
 
 driver = True
@@ -36,9 +37,17 @@ try:
     import yaml
 except ImportError:
     driver = False
+else:
+    # Use the libyaml bindings if available
+    try:
+        from yaml import CSafeLoader as Loader, CSafeDumper as Dumper
+    except ImportError:
+        from yaml import SafeLoader as Loader, SafeDumper as Dumper
 
+from dc.allocator import BlockAllocator
 from dc.connector import DataConnector
 from dc import exceptions
+from dc.yaml.index import HashIndex, SortedIndex
 from model import exceptions as mod_exceptions
 from model.functions import *
 
@@ -55,9 +64,35 @@ class YAMLConnector(DataConnector):
           username: admin
           email_address: admin@python-aboard.org
     
+    The fields declared with an index (see model.types.BaseType) are
+    indexed in memory (see ./index.py).  The indexes are updated when
+    an object is added, updated or removed and are used by the
+    'select_objects' method for equality and range lookups.  The
+    primary key (if the model has only one) is always kept in a sorted
+    index, so that the objects can be read in its order (see
+    'walk_index').
+    
+    The auto-increment values are reserved by blocks of 'id_block'
+    values (see dc.allocator.BlockAllocator):  the table header keeps
+    the end of the last reserved block, not the last used value.
+    
+    The changes are not written by rewriting the whole table:  they
+    are appended, in 'loop', to a journal (a YAML list of records, in
+    the file {table}.journal.yml) whose records are replayed when the
+    table is read.  When the journal exceeds 'journal_size' bytes, it
+    is compacted:  the table file is written again and the journal
+    removed.
+    
+    The tables are read lazily, the first time their model is accessed
+    (see 'load_table'), so that the tables which are never used are
+    not read.  The files are parsed and written with the libyaml
+    bindings (CSafeLoader and CSafeDumper) if available, with the
+    pure Python implementation otherwise.
+    
     """
     
     name = "yaml"
+    executor_workers = 1
     def __init__(self):
         """Check the driver presence.
         
@@ -71,8 +106,9 @@ class YAMLConnector(DataConnector):
         self.location = None
         self.auto_increments = {}
         self.to_update = set()
+        self.changes = {}
     
-    def setup(self, location=None):
+    def setup(self, location=None, id_block=100, journal_size=1048576):
         """Setup the data connector."""
         if location is None:
             raise exceptions.InsufficientConfiguration(
@@ -98,28 +134,83 @@ class YAMLConnector(DataConnector):
                     "cannot write in {}".format(location))
         
         DataConnector.__init__(self)
+        self.allocator = BlockAllocator(self.reserve_increments, id_block)
         self.location = location
+        self.journal_size = journal_size
         self.files = {}
+        self.indexes = {}
+        self.unloaded = set()
     
     def close(self):
-        """Close the data connector (nothing to be done)."""
-        pass
+        """Close the data connector (stop the thread pool if needed)."""
+        self.shutdown_executor()
     
     def destroy(self):
         """Erase EVERY stored data."""
         for file in os.listdir(self.location):
             os.remove(self.location + "/" + file)
+        self.changes.clear()
+        self.to_update.clear()
         self.clear_cache()
         
     def record_model(self, model):
-        """Record the given model."""
+        """Record the given model.
+        
+        Its table is not read at once (see 'load_table').
+        
+        """
         name = DataConnector.record_model(self, model)
-        filename = self.location + "/" + name + ".yml"
-        if os.path.exists(filename):
-            with open(filename, "r") as file:
-                self.read_table(name, file)
+        self.files[name] = self.location + "/" + name + ".yml"
+        self.unloaded.add(name)
+    
+    def load_table(self, name):
+        """Read the table and build its indexes, if not done yet.
+        
+        This method is called by every method accessing the objects of
+        a model.
+        
+        """
+        if name not in self.unloaded:
+            return
+        
+        with self.lock:
+            if name not in self.unloaded:
+                return
+            
+            filename = self.files[name]
+            if os.path.exists(filename):
+                with open(filename, "r") as file:
+                    self.read_table(name, file)
+            
+            self.build_indexes(self.models[name])
+            self.unloaded.discard(name)
+    
+    def build_indexes(self, model):
+        """Build the indexes of the model's declared fields."""
+        schema = get_schema(model)
+        indexes = {}
+        for field in schema.fields:
+            if field.index == "hash":
+                indexes[field.field_name] = HashIndex(field.field_name)
+            elif field.index == "sorted" or (field.index is None and \
+                    schema.pkey_names == (field.field_name, )):
+                indexes[field.field_name] = SortedIndex(field.field_name)
+        
+        objects = self.objects_tree[schema.name]
+        for field_name, index in indexes.items():
+            index.fill((pkey, getattr(object, field_name)) for pkey, \
+                    object in objects.items())
+        
+        self.indexes[schema.name] = indexes
+    
+    def create_model_cache(self, name):
+        """Create the cache of a model.
         
-        self.files[name] = filename
+        The cached objects ARE the stored datas of this data connector:
+        the cache is therefore never bounded, whatever the cache policy.
+        
+        """
+        return {}
     
     def read_table(self, table_name, file):
         """Read a whoe table contained in a file.
@@ -131,10 +222,13 @@ class YAMLConnector(DataConnector):
         the status of the autoincrement fields.  Each following dictionary
         is a line of data which sould describe a model object.
         
+        The journal of the table, if any, is then replayed (see
+        'replay_journal').
+        
         """
         name = table_name
         content = file.read()
-        datas = yaml.load(content)
+        datas = yaml.load(content, Loader=Loader)
         if not isinstance(datas, list):
             raise exceptions.DataFormattingError(
                     "the file {} must contain a YAML formatted list".format(
@@ -149,17 +243,54 @@ class YAMLConnector(DataConnector):
         
         self.read_table_header(name, class_datas)
         
+        schema = get_schema(class_table)
+        hydrate = schema.get_hydrator(mapping=True)
+        get_dict_pkey = schema.get_dict_pkey
         objects = {}
         for line in datas[1:]:
-            object = class_table.build(**line)
-            pkey = get_pkey_values(object)
-            if len(pkey) == 1:
-                pkey = pkey[0]
-            
-            objects[pkey] = object
+            objects[get_dict_pkey(line)] = hydrate(line)
         
+        self.replay_journal(name, objects)
         self.objects_tree[name] = objects
     
+    def replay_journal(self, name, objects):
+        """Replay the journal of a table on its objects.
+        
+        The 'objects' parameter is the dictionary {pkey: object} read
+        from the table file.  Each record of the journal is a dictionary
+        with one key:
+            header -- the new table header
+            set -- the attributes of an added or updated object
+            delete -- the primary key of a deleted object ({name: value})
+        
+        """
+        path = self.get_journal_path(name)
+        if not os.path.exists(path):
+            return
+        
+        with open(path, "r") as file:
+            records = yaml.load(file.read(), Loader=Loader) or []
+        
+        schema = get_schema(self.models[name])
+        hydrate = schema.get_hydrator(mapping=True)
+        get_dict_pkey = schema.get_dict_pkey
+        for record in records:
+            if "set" in record:
+                row = record["set"]
+                objects[get_dict_pkey(row)] = hydrate(row)
+            elif "delete" in record:
+                objects.pop(get_dict_pkey(record["delete"]), None)
+            elif "header" in record:
+                self.read_table_header(name, record["header"])
+            else:
+                raise exceptions.DataFormattingError(
+                        "invalid record {} in the file {}".format(
+                        repr(record), path))
+    
+    def get_journal_path(self, name):
+        """Return the path of the table's journal."""
+        return self.location + "/" + name + ".journal.yml"
+    
     def read_table_header(self, name, datas):
         """Read the table header.
         
@@ -167,18 +298,90 @@ class YAMLConnector(DataConnector):
         table (as the autoincrement fields).
         
         """
-        auto_increments = datas.get("auto_increments", [])
+        auto_increments = datas.get("auto_increments", {})
         self.auto_increments[name] = auto_increments
     
     def loop(self):
-        """Write the YAML tables."""
+        """Flush the pending changes and write them in the journals."""
+        self.write_pending_changes()
+        self.compact_deletions()
+    
+    def write_pending_changes(self):
+        """Flush the pending changes and write them in the journals."""
+        self.flush()
         for table in self.to_update:
-            self.write_table(table)
+            self.write_changes(table)
         
         self.to_update.clear()
     
+    def clear_cache(self):
+        """Clear the cache, that is the tables read.
+        
+        The cached objects are the stored datas:  the pending changes
+        are written first, then the tables (and their indexes) are read
+        again when next accessed (see 'load_table').
+        
+        """
+        with self.lock:
+            self.write_pending_changes()
+            DataConnector.clear_cache(self)
+            self.indexes.clear()
+            self.unloaded.update(self.models)
+    
+    def record_change(self, name, pkey, object):
+        """Record a changed object, to be written in 'loop'.
+        
+        The 'object' parameter should be None if the object was deleted.
+        
+        """
+        self.changes.setdefault(name, {})[pkey] = object
+        self.to_update.add(name)
+    
+    def write_changes(self, name):
+        """Append the changes of the table to its journal.
+        
+        Only the last state of each changed object is written.  If the
+        table file doesn't exist yet, or if the journal exceeds
+        'journal_size' bytes, the table is written again instead (see
+        'write_table').
+        
+        """
+        changes = self.changes.pop(name, {})
+        path = self.get_journal_path(name)
+        if not os.path.exists(self.location + "/" + name + ".yml"):
+            self.write_table(name)
+            return
+        
+        schema = get_schema(self.models[name])
+        records = []
+        if name in self.auto_increments:
+            records.append({"header": {"auto_increments": \
+                    self.auto_increments[name]}})
+        
+        for pkey, object in changes.items():
+            if object is None:
+                values = pkey if len(schema.pkey_names) > 1 else (pkey, )
+                records.append({"delete": dict(zip(schema.pkey_names,
+                        values))})
+            else:
+                records.append({"set": get_values_dict(object)})
+        
+        content = yaml.dump(records, Dumper=Dumper,
+                default_flow_style=False)
+        with open(path, "a") as file:
+            file.write(content)
+            size = file.tell()
+        
+        if size > self.journal_size:
+            self.write_table(name)
+    
     def write_table(self, name):
-        """Write the table in a file."""
+        """Write the table in a file and remove its journal.
+        
+        The table is written in a temporary file first, so that the
+        former table file and its journal are kept if the writing fails.
+        
+        """
         # First, we get the header
         header = {}
         if name in self.auto_increments:
@@ -187,18 +390,213 @@ class YAMLConnector(DataConnector):
         # Next we browse the object
         objects = []
         for object in self.objects_tree[name].values():
-            objects.append(object.__dict__)
+            objects.append(get_values_dict(object))
         
         objects.insert(0, header)
-        content = yaml.dump(objects, default_flow_style=False)
-        with open(self.location + "/" + name + ".yml", "w") as file:
+        content = yaml.dump(objects, Dumper=Dumper,
+                default_flow_style=False)
+        path = self.location + "/" + name + ".yml"
+        with open(path + ".tmp", "w") as file:
             file.write(content)
+        
+        os.replace(path + ".tmp", path)
+        self.changes.pop(name, None)
+        journal_path = self.get_journal_path(name)
+        if os.path.exists(journal_path):
+            os.remove(journal_path)
     
     def get_all_objects(self, model):
         """Return all the model's object in a list."""
         name = get_name(model)
+        self.load_table(name)
         return list(self.objects_tree.get(name, {}).values())
     
+    def iter_objects(self, model, batch_size=1000, cache=True):
+        """Iterate over the model's objects.
+        
+        The cached objects are the stored datas:  they are always kept
+        in cache, whatever 'cache'.
+        
+        """
+        return iter(self.get_all_objects(model))
+    
+    def select_objects(self, query):
+        """Return the objects matching the query (a QuerySet).
+        
+        If the query is sorted by an indexed field, the objects are
+        read in the index order (see 'walk_index').  Otherwise, if
+        possible, the candidate objects are selected through an
+        index (see 'find_candidates').  The conditions are then
+        checked in memory.
+        
+        """
+        self.load_table(get_name(query.model))
+        if query.ordering:
+            objects = self.walk_index(query)
+            if objects is not None:
+                return objects
+        
+        return query.sort(self.iter_matching(query))
+    
+    def iter_matching(self, query):
+        """Iterate over the objects matching the query's conditions.
+        
+        The candidate objects are selected through an index if possible
+        (see 'find_candidates').  The order and the limit of the query
+        are ignored.
+        
+        """
+        name = get_name(query.model)
+        self.load_table(name)
+        table = self.objects_tree.get(name, {})
+        pkeys = self.find_candidates(query)
+        if pkeys is None:
+            objects = table.values()
+        else:
+            objects = [table[pkey] for pkey in pkeys if pkey in table]
+        
+        for object in objects:
+            if query.matches(object):
+                yield object
+    
+    def select_matching(self, query):
+        """Return the objects matching the query, as an iterable.
+        
+        If the query is neither sorted nor limited, the objects are not
+        gathered in a list (see 'iter_matching').
+        
+        """
+        if query.ordering or query.limit_count is not None:
+            return self.select_objects(query)
+        
+        return self.iter_matching(query)
+    
+    def count_objects(self, query):
+        """Return the number of objects matching the query, in one pass."""
+        return sum(1 for object in self.select_matching(query))
+    
+    def aggregate_objects(self, query, aggregates):
+        """Aggregate the fields of the matching objects, in one pass."""
+        return self.reduce_objects(self.select_matching(query),
+                aggregates)[None]
+    
+    def group_objects(self, query, name, aggregates):
+        """Group the matching objects by the value of a field, in one pass."""
+        return self.reduce_objects(self.select_matching(query), aggregates,
+                name, count=True)
+    
+    def walk_index(self, query):
+        """Return the selected objects, read in the index order.
+        
+        The query should be sorted by a single field, kept in a sorted
+        index.  The index is walked from the bound of the range given
+        in the conditions (if any) until the limit is reached, so that
+        the cost doesn't depend on the position of the range.
+        
+        None is returned if no index can be walked.  Since the None
+        value isn't indexed, a range on the field is needed if it isn't
+        the primary key.
+        
+        """
+        if len(query.ordering) != 1:
+            return None
+        
+        field_name, descending = query.ordering[0]
+        schema = get_schema(query.model)
+        self.load_table(schema.name)
+        index = self.indexes.get(schema.name, {}).get(field_name)
+        if not isinstance(index, SortedIndex):
+            return None
+        
+        bounds = [None, True, None, True]
+        for name, op, value in query.conditions:
+            if name == field_name and op in ("gt", "gte", "lt", "lte") \
+                    and value is not None:
+                self.restrict_range(bounds, op, value)
+        
+        low, include_low, high, include_high = bounds
+        if field_name not in schema.pkey_names and low is None and \
+                high is None:
+            return None
+        
+        table = self.objects_tree[schema.name]
+        limit = query.limit_count
+        objects = []
+        for pkey in index.iter_range(low, high, include_low, include_high,
+                reverse=descending):
+            if limit is not None and len(objects) >= limit:
+                break
+            
+            object = table[pkey]
+            if query.matches(object):
+                objects.append(object)
+        
+        return objects
+    
+    def find_candidates(self, query):
+        """Return the list of candidate primary keys for the query.
+        
+        The indexed fields and the primary key are used to select the
+        smallest list of candidates.  None is returned if no index
+        can be used.
+        
+        """
+        schema = get_schema(query.model)
+        self.load_table(schema.name)
+        indexes = self.indexes.get(schema.name, {})
+        pkey_name = schema.pkey_names[0] if len(schema.pkey_names) == 1 \
+                else None
+        candidates = None
+        ranges = {}
+        for field_name, op, value in query.conditions:
+            if value is None or (op == "in" and None in value):
+                continue
+            
+            index = indexes.get(field_name)
+            if op == "exact" and field_name == pkey_name:
+                pkeys = [value]
+            elif index is None:
+                continue
+            elif op == "exact":
+                pkeys = index.find(value)
+            elif op == "in":
+                pkeys = list(OrderedDict.fromkeys(pkey for single in value \
+                        for pkey in index.find(single)))
+            elif op in ("gt", "gte", "lt", "lte") and isinstance(index,
+                    SortedIndex):
+                bounds = ranges.setdefault(field_name, [None, True, None,
+                        True])
+                self.restrict_range(bounds, op, value)
+                continue
+            else:
+                continue
+            
+            if candidates is None or len(pkeys) < len(candidates):
+                candidates = pkeys
+        
+        for field_name, (low, include_low, high, include_high) in \
+                ranges.items():
+            pkeys = indexes[field_name].find_range(low, high, include_low,
+                    include_high)
+            if candidates is None or len(pkeys) < len(candidates):
+                candidates = pkeys
+        
+        return candidates
+    
+    @staticmethod
+    def restrict_range(bounds, op, value):
+        """Restrict the bounds [low, include_low, high, include_high]."""
+        low, include_low, high, include_high = bounds
+        if op in ("gt", "gte"):
+            include = op == "gte"
+            if low is None or value > low or (value == low and not include):
+                bounds[0:2] = [value, include]
+        else:
+            include = op == "lte"
+            if high is None or value < high or (value == high and \
+                    not include):
+                bounds[2:4] = [value, include]
+    
     def find_object(self, model, pkey_values):
         """Return, if found, the selected object.
         
@@ -206,38 +604,85 @@ class YAMLConnector(DataConnector):
         
         """
         # Look for the object in the cached tree
+        self.load_table(get_name(model))
         object = self.get_from_cache(model, pkey_values)
         if object:
             return object
         
         raise mod_exceptions.ObjectNotFound(model, pkey_values)
     
+    def reserve_increments(self, table, field, number):
+        """Reserve 'number' values of an auto-increment field.
+        
+        The first reserved value is returned.  The next free value is
+        kept in the table header, written with the table.
+        
+        """
+        self.load_table(table)
+        auto_increments = self.auto_increments.setdefault(table, {})
+        value = auto_increments.get(field, 1)
+        auto_increments[field] = value + number
+        self.to_update.add(table)
+        return value
+    
     def add_object(self, object):
         """Save the object, issued from a model."""
-        name = get_name(type(object))
-        fields = get_fields(type(object))
-        auto_increments = self.auto_increments.get(name, {})
-        for field in fields:
-            if not field.auto_increment:
-                continue
-            
-            value = auto_increments.get(field.field_name, 1)
-            update_attr(object, field.field_name, value)
-            auto_increments[field.field_name] = value + 1
+        schema = get_schema(type(object))
+        name = schema.name
+        self.load_table(name)
+        for field in schema.auto_increments:
+            update_attr(object, field, self.allocator.allocate(name, field))
         
         self.cache_object(object)
-        self.auto_increments[name] = auto_increments
-        self.to_update.add(name)
+        pkey = schema.get_pkey(object)
+        self.record_change(name, pkey, object)
+        for field_name, index in self.indexes.get(name, {}).items():
+            index.add(pkey, getattr(object, field_name))
+    
+    def add_objects(self, objects):
+        """Save the objects, issued from the same model.
+        
+        The auto-increment values are assigned at once.
+        
+        """
+        if not objects:
+            return
+        
+        schema = get_schema(type(objects[0]))
+        name = schema.name
+        self.load_table(name)
+        for field in schema.auto_increments:
+            value = self.allocator.allocate(name, field, len(objects))
+            for i, object in enumerate(objects):
+                update_attr(object, field, value + i)
+        
+        self.cache_objects(objects)
+        get_pkey = schema.get_pkey
+        for object in objects:
+            self.record_change(name, get_pkey(object), object)
+        
+        for field_name, index in self.indexes.get(name, {}).items():
+            for object in objects:
+                index.add(get_pkey(object), getattr(object, field_name))
     
     def update_object(self, object, attribute):
         """Update an object."""
         self.check_update(object)
-        name = get_name(type(object))
-        self.to_update.add(name)
+        schema = get_schema(type(object))
+        name = schema.name
+        pkey = schema.get_pkey(object)
+        self.record_change(name, pkey, object)
+        index = self.indexes.get(name, {}).get(attribute)
+        if index:
+            index.update(pkey, getattr(object, attribute))
     
     def remove_object(self, object):
         """Delete the object."""
         # Delete from cache only
         self.uncache_object(object)
-        name = get_name(type(object))
-        self.to_update.add(name)
+        schema = get_schema(type(object))
+        name = schema.name
+        pkey = schema.get_pkey(object)
+        self.record_change(name, pkey, None)
+        for index in self.indexes.get(name, {}).values():
+            index.remove(pkey)
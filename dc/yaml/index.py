@@ -0,0 +1,205 @@
+# Copyright (c) 2012 LE GOFF Vincent
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+# * Neither the name of the copyright holder nor the names of its contributors
+#   may be used to endorse or promote products derived from this software
+#   without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT
+# OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+
+"""This module contains the secondary indexes of the YAML connector.
+
+Index classes:
+    HashIndex -- an index for equality lookups
+    SortedIndex -- an index for equality and range lookups
+
+Both indexes map field values to primary keys (the keys of the
+YAML connector's tables).  They are filled at once when a table is
+read ('fill'), then updated incrementally when an object is added,
+updated or removed.  The None value is not indexed:
+a lookup on it should be answered by browsing the table.
+
+"""
+
+from bisect import bisect_left, bisect_right
+from operator import itemgetter
+
+class HashIndex:
+    
+    """Index for equality lookups, in O(1)."""
+    
+    def __init__(self, field_name):
+        self.field_name = field_name
+        self.entries = {}
+        self.values = {}
+    
+    def __repr__(self):
+        return "<hash index on {}>".format(self.field_name)
+    
+    def fill(self, entries):
+        """Fill the empty index with the (primary key, value) pairs."""
+        for pkey, value in entries:
+            self.add(pkey, value)
+    
+    def add(self, pkey, value):
+        """Add the primary key with the indexed value."""
+        if value is None:
+            return
+        
+        self.values[pkey] = value
+        self.entries.setdefault(value, set()).add(pkey)
+    
+    def remove(self, pkey):
+        """Remove the primary key from the index."""
+        if pkey not in self.values:
+            return
+        
+        value = self.values.pop(pkey)
+        pkeys = self.entries[value]
+        pkeys.discard(pkey)
+        if not pkeys:
+            del self.entries[value]
+    
+    def update(self, pkey, value):
+        """Update the indexed value of a primary key."""
+        self.remove(pkey)
+        self.add(pkey, value)
+    
+    def find(self, value):
+        """Return the list of primary keys whose value is 'value'."""
+        return list(self.entries.get(value, ()))
+
+class SortedIndex:
+    
+    """Index for equality and range lookups, in O(log n).
+    
+    The values are kept in a sorted list, the primary keys being
+    stored in a second list in the same order.
+    
+    """
+    
+    def __init__(self, field_name):
+        self.field_name = field_name
+        self.sorted_values = []
+        self.sorted_pkeys = []
+        self.values = {}
+    
+    def __repr__(self):
+        return "<sorted index on {}>".format(self.field_name)
+    
+    def fill(self, entries):
+        """Fill the empty index with the (primary key, value) pairs.
+        
+        The pairs are sorted once, instead of being inserted one by
+        one (each insertion shifting the end of the lists).  The
+        equal values keep their order, as if added one by one.
+        
+        """
+        pairs = sorted(((pkey, value) for pkey, value in entries \
+                if value is not None), key=itemgetter(1))
+        self.values = dict(pairs)
+        self.sorted_pkeys = [pkey for pkey, value in pairs]
+        self.sorted_values = [value for pkey, value in pairs]
+    
+    def add(self, pkey, value):
+        """Add the primary key with the indexed value."""
+        if value is None:
+            return
+        
+        self.values[pkey] = value
+        position = bisect_right(self.sorted_values, value)
+        self.sorted_values.insert(position, value)
+        self.sorted_pkeys.insert(position, pkey)
+    
+    def remove(self, pkey):
+        """Remove the primary key from the index."""
+        if pkey not in self.values:
+            return
+        
+        value = self.values.pop(pkey)
+        position = bisect_left(self.sorted_values, value)
+        while self.sorted_pkeys[position] != pkey:
+            position += 1
+        
+        del self.sorted_values[position]
+        del self.sorted_pkeys[position]
+    
+    def update(self, pkey, value):
+        """Update the indexed value of a primary key."""
+        self.remove(pkey)
+        self.add(pkey, value)
+    
+    def find(self, value):
+        """Return the list of primary keys whose value is 'value'."""
+        return self.find_range(value, value)
+    
+    def find_range(self, low=None, high=None, include_low=True,
+            include_high=True):
+        """Return the list of primary keys whose value is in the range.
+        
+        If 'low' or 'high' is None, the range is not bounded on
+        this side.
+        
+        """
+        begin, end = self.find_positions(low, high, include_low,
+                include_high)
+        return self.sorted_pkeys[begin:end]
+    
+    def iter_range(self, low=None, high=None, include_low=True,
+            include_high=True, reverse=False):
+        """Iterate over the primary keys whose value is in the range.
+        
+        The primary keys are given in the order of the values (in
+        the reverse order if 'reverse' is True).  Unlike 'find_range',
+        the range isn't copied:  reading the first keys of a range is
+        fast, wherever the range begins.
+        
+        """
+        begin, end = self.find_positions(low, high, include_low,
+                include_high)
+        positions = range(begin, end)
+        if reverse:
+            positions = reversed(positions)
+        
+        pkeys = self.sorted_pkeys
+        for position in positions:
+            yield pkeys[position]
+    
+    def find_positions(self, low, high, include_low, include_high):
+        """Return the positions (begin, end) of the range."""
+        values = self.sorted_values
+        if low is None:
+            begin = 0
+        elif include_low:
+            begin = bisect_left(values, low)
+        else:
+            begin = bisect_right(values, low)
+        
+        if high is None:
+            end = len(values)
+        elif include_high:
+            end = bisect_right(values, high)
+        else:
+            end = bisect_left(values, high)
+        
+        return begin, end
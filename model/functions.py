@@ -29,30 +29,34 @@
 """This module contains different useful functions for manipulating models.
 
 Functions defined here:
+    get_schema(class) -- return the model's compiled schema
     get_fields(class) -- return the class's field
     get_name(class) -- return the model's name
     get_plural_name(class) -- return the plural class name
     get_pkey_names -- return a list of primary key fields name
     get_pkey_values -- return a list of primary key fields values
+    get_values -- return a tuple of the object's field values
+    get_values_dict -- return a dictionary of the object's field values
+    set_defaults -- set the default values of an object
     update_attr -- update an object attribute
     update -- update a whole object
 
+Most of these functions read the model's schema (see ./schema.py),
+which is built once when the model class is created.
+
 """
 
-from model.types import BaseType
+def get_schema(model):
+    """Return the model's schema (a model.schema.Schema object)."""
+    return model._schema
 
 def get_fields(model):
-    """Return a list of the defined fields in this model."""
-    fields = [getattr(model, name) for name in dir(model)]
-    fields = [field for field in fields if isinstance(field, BaseType)]
-    fields = sorted(fields, key=lambda field: field.nid)
-    return fields
+    """Return a tuple of the defined fields in this model."""
+    return model._schema.fields
 
 def get_name(model):
     """Return the model name."""
-    name = model.__name__
-    name = name.split(".")[-1]
-    return name.lower()
+    return model._schema.name
 
 def get_plural_name(model):
     """Return the plural model's name.
@@ -62,24 +66,11 @@ def get_plural_name(model):
         The singular name extended with the 's / es' rule otherwise
     
     """
-    if hasattr(model, "plural_name"):
-        return model.plural_name
-    else:
-        singular_name = get_name(model)
-        if singular_name.endswith("y"):
-            singular_name = singular_name[:-1] + "ies"
-        elif singular_name.endswith("s"):
-            singular_name += "es"
-        else:
-            singular_name += "s"
-        
-        return singular_name
+    return model._schema.plural_name
 
 def get_pkey_names(model):
-    """Return a list of field names (those defined as primary key)."""
-    fields = get_fields(model)
-    p_fields = [field.field_name for field in fields if field.pkey]
-    return p_fields
+    """Return a tuple of field names (those defined as primary key)."""
+    return model._schema.pkey_names
 
 def get_pkey_values(object):
     """Return a tuple of datas (those defined as primary key).
@@ -89,10 +80,37 @@ def get_pkey_values(object):
     Model class.
     
     """
-    fields = get_fields(type(object))
-    p_fields = [field.field_name for field in fields if field.pkey]
-    p_fields = [getattr(object, field) for field in p_fields]
-    return tuple(p_fields)
+    return object._schema.get_pkey_values(object)
+
+def get_values(object):
+    """Return a tuple of the object's field values, in the field order."""
+    return object._schema.get_values(object)
+
+def get_values_dict(object):
+    """Return a dictionary {field_name: value} of the object's fields.
+    
+    This function should be used instead of reading the object's
+    '__dict__', which doesn't exist if the model uses slots.
+    
+    """
+    return object._schema.get_values_dict(object)
+
+def set_defaults(object, names):
+    """Set the default values of the fields whose names are not in 'names'.
+    
+    The auto-increment fields are not set.  Raise a ValueError if a field
+    has no default value.
+    
+    """
+    for field in object._schema.fields:
+        name = field.field_name
+        if not field.auto_increment and not name in names:
+            default = field.default
+            if default is None:
+                raise ValueError("the field {} of model {} has no " \
+                        "default value".format(name, type(object)))
+            
+            update_attr(object, name, default)
 
 def update_attr(to_update, attribute, value):
     """Update the object passed as first argument.
@@ -100,7 +118,8 @@ def update_attr(to_update, attribute, value):
     NOTE: this function is really close to 'setattr' but it only writes
     the new attribute in the object, without calling its '__setattr__'
     magic method, which is useful for a model if you don't want to
-    update it in the data connector.
+    update it in the data connector.  It works whether the object
+    stores its attributes in a '__dict__' or in slots.
     
     """
     object.__setattr__(to_update, attribute, value)
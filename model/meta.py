@@ -28,7 +28,11 @@
 
 """This module contains the MetaModel metaclass."""
 
+from collections import OrderedDict
+
 from model.functions import *
+from model.schema import Schema
+from model.types import BaseType
 
 class MetaModel(type):
     
@@ -36,13 +40,56 @@ class MetaModel(type):
     
     Its job is to set the field list right.  The most important things are:
     -   Check that every field inherited from another class is copied
-    -   Check that the field NIDs are properly set.
+    -   Check that the field NIDs are properly set
+    -   Build the model's schema (see ./schema.py).
+    
+    If the model sets the 'use_slots' class attribute to True, the
+    metaclass generates the '__slots__' of the class from the declared
+    fields.  The objects of this model won't have a '__dict__', which
+    saves a lot of memory when many objects are kept in cache.  The
+    fields, however, are not class attributes any more:  they should
+    be accessed through the model's schema.  A model inherited from
+    such a model will use slots as well.
     
     """
     
+    def __new__(metacls, name, parents, attributes):
+        use_slots = attributes.get("use_slots", any(getattr(parent,
+                "use_slots", False) for parent in parents))
+        if use_slots:
+            attributes = dict(attributes)
+            names = []
+            for parent in parents:
+                schema = getattr(parent, "_schema", None)
+                if schema:
+                    names.extend(schema.field_names)
+            
+            for attr_name, attr in tuple(attributes.items()):
+                if isinstance(attr, BaseType):
+                    names.append(attr_name)
+                    del attributes[attr_name]
+            
+            # Don't define again the slots defined in a parent class
+            slots = set()
+            for parent in parents:
+                for ancestor in parent.__mro__:
+                    ancestor_slots = ancestor.__dict__.get("__slots__", ())
+                    if isinstance(ancestor_slots, str):
+                        ancestor_slots = (ancestor_slots, )
+                    slots.update(ancestor_slots)
+            
+            names = [attr_name for attr_name in OrderedDict.fromkeys(
+                    names) if attr_name not in slots]
+            if all(parent.__weakrefoffset__ == 0 for parent in parents):
+                names.append("__weakref__")
+            
+            attributes["__slots__"] = tuple(names)
+        
+        return type.__new__(metacls, name, parents, attributes)
+    
     def __init__(cls, name, parents, attributes):
         type.__init__(cls, name, parents, attributes)
-        fields = get_fields(cls)
+        fields = cls.collect_fields(attributes)
         clean_fields = []
         for field in fields:
             if field not in attributes.values():
@@ -51,7 +98,8 @@ class MetaModel(type):
                 # We can count on the field_name attribute whic has been set
                 # previously
                 name = field.field_name
-                setattr(cls, name, copied)
+                if not cls.use_slots:
+                    setattr(cls, name, copied)
                 field = copied
             else:
                 name = [name for name, attr in attributes.items() if attr is \
@@ -65,7 +113,41 @@ class MetaModel(type):
             field = clean_fields[i]
             field.nid = nid
             field.model = cls
+        
+        cls._schema = Schema(cls, clean_fields)
     
     def __repr__(self):
         """Return the model's name."""
         return get_name(self)
+    
+    def collect_fields(cls, attributes):
+        """Return the fields found in the class, ordered by NID.
+        
+        This method browses the class's attributes and is only called
+        once, when building the class.  Afterward, the fields should be
+        read from the model's schema.
+        
+        If the model uses slots, its fields are not class attributes:
+        they are read from the parent's schemas and the class body
+        ('attributes').
+        
+        """
+        if cls.use_slots:
+            fields = OrderedDict()
+            for parent in reversed(cls.__bases__):
+                schema = getattr(parent, "_schema", None)
+                if schema:
+                    for field in schema.fields:
+                        fields[field.field_name] = field
+            
+            for name, attr in attributes.items():
+                if isinstance(attr, BaseType):
+                    fields[name] = attr
+            
+            fields = list(fields.values())
+        else:
+            fields = [getattr(cls, name) for name in dir(cls)]
+            fields = [field for field in fields if isinstance(field,
+                    BaseType)]
+        
+        return sorted(fields, key=lambda field: field.nid)
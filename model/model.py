@@ -32,6 +32,7 @@ from collections import OrderedDict
 
 from model.functions import *
 from model.meta import MetaModel
+from model.query import QuerySet
 from model.types import *
 
 class Model(metaclass=MetaModel):
@@ -57,14 +58,44 @@ class Model(metaclass=MetaModel):
     >>> get_fields(User)
     ... [<field 'username'>, <field 'password'>, <field 'creation_date'>]
     
+    A model can store its objects' attributes in slots rather than in a
+    '__dict__', which is far more compact:
+    >>> class User(Model):
+    ...     use_slots = True
+    ...     username = String()
+    ... 
+    
     Class methods:
         build(**attributes) -- create (but don't save) a new object
         get_all() -- return all model's objects
+        iter_all(batch_size, cache) -- iterate over all model's objects
+        bulk_create(rows, batch_size) -- create and save several objects
         find(identifiers) -- get an object through its identifiers
-        filter(...) -- retrieve one or more object
+        parse_pkey(pkey, kwargs) -- return the primary key values
+        filter(**conditions) -- return a query set (see ./query.py)
+        page(after, limit, order_by) -- return a page of objects
+        only(*fields) -- return a query set reading only these fields
+        defer(*fields) -- return a query set not reading these fields
+        count() -- return the number of model's objects
+        aggregate(**aggregates) -- aggregate fields (sum, min, max)
+        group_by(field, **aggregates) -- group the objects by value
+    
+    The models can be used in coroutines (with asyncio), through an
+    asynchronous counterpart of some methods, which don't block the
+    event loop while the data connector works:
+        afind(identifiers) -- coroutine returning an object
+        aiter_all(batch_size, cache) -- asynchronous iterator
+        asave() -- coroutine saving the object's pending changes
+    >>> user = await User.afind(5)
+    >>> async for user in User.aiter_all():
+    ...     user.password = "unknown"
+    ...     await user.asave()
+    ... 
     
     """
     
+    __slots__ = ()
+    use_slots = False
     id = Integer(pkey=True, auto_increment=True)
     
     # Class methods
@@ -73,24 +104,86 @@ class Model(metaclass=MetaModel):
         """Create and return an object.
         
         The created object WILL NOT be saved through the data connector.
+        The attributes are written in the field order.
         
         """
         new_object = cls()
-        fields = get_fields(cls)
-        fields = dict((field.field_name, field) for field in fields)
-        for name, value in kwargs.items():
-            object.__setattr__(new_object, name, value)
+        for name in cls._schema.field_names:
+            if name in kwargs:
+                update_attr(new_object, name, kwargs[name])
         
         return new_object
     
+    @classmethod
+    def bulk_create(cls, rows, batch_size=1000):
+        """Create, save and return several objects.
+        
+        The 'rows' parameter should be an iterable of dictionaries, each
+        dictionary containing the attributes of an object (as the named
+        parameters of the constructor).  The objects are saved by
+        batches of 'batch_size' objects, which is much faster than
+        creating them one by one (see DataConnector.add_objects).
+        
+        Return the list of created objects.
+        
+        """
+        if batch_size < 1:
+            raise ValueError("the batch size should be a positive number")
+        
+        data_connector = getattr(Model, "data_connector", None)
+        if data_connector:
+            data_connector.flush()
+        
+        objects = []
+        batch = []
+        for attributes in rows:
+            new_object = cls.build(**attributes)
+            set_defaults(new_object, attributes)
+            batch.append(new_object)
+            if len(batch) >= batch_size:
+                if data_connector:
+                    data_connector.add_objects(batch)
+                objects.extend(batch)
+                batch = []
+        
+        if batch:
+            if data_connector:
+                data_connector.add_objects(batch)
+            objects.extend(batch)
+        
+        return objects
+    
     @classmethod
     def get_all(cls):
         """Return the full list of model's objects."""
         if Model.data_connector:
+            Model.data_connector.flush()
             return Model.data_connector.get_all_objects(cls)
         
         return []
     
+    @classmethod
+    def iter_all(cls, batch_size=1000, cache=True):
+        """Return an iterator over the model's objects.
+        
+        Unlike 'get_all', the objects are read by batches of
+        'batch_size' objects while iterating.  If 'cache' is False, the
+        objects read are not kept in cache, which allows to browse a
+        big table in constant memory:
+        >>> for user in User.iter_all(cache=False):
+        ...     print(user.username)
+        ... 
+        
+        """
+        if batch_size < 1:
+            raise ValueError("the batch size should be a positive number")
+        
+        if Model.data_connector:
+            Model.data_connector.flush()
+            return Model.data_connector.iter_objects(cls, batch_size, cache)
+        
+        return iter(())
+    
     @classmethod
     def find(cls, pkey=None, **kwargs):
         """Find and return (if found) an object.
@@ -111,8 +204,42 @@ class Model(metaclass=MetaModel):
         non-primary key fields.  See the 'filter' method instead.
         
         """
-        model_name = get_name(cls)
-        pkey_names = get_pkey_names(cls)
+        pkey_values = cls.parse_pkey(pkey, kwargs)
+        Model.data_connector.flush()
+        return Model.data_connector.find_object(cls, pkey_values)
+    
+    @classmethod
+    async def afind(cls, pkey=None, **kwargs):
+        """Find and return an object, without blocking (see 'find')."""
+        pkey_values = cls.parse_pkey(pkey, kwargs)
+        data_connector = Model.data_connector
+        await data_connector.aflush()
+        return await data_connector.afind_object(cls, pkey_values)
+    
+    @classmethod
+    def aiter_all(cls, batch_size=1000, cache=True):
+        """Return an asynchronous iterator over the model's objects.
+        
+        The objects are read by batches, without blocking (see
+        'iter_all').
+        
+        """
+        if batch_size < 1:
+            raise ValueError("the batch size should be a positive number")
+        
+        return Model.data_connector.aiter_objects(cls, batch_size, cache)
+    
+    @classmethod
+    def parse_pkey(cls, pkey, kwargs):
+        """Return the primary key values given to 'find'.
+        
+        The returned value is an ordered dictionary {name: value}.
+        Raise a ValueError if the primary key is not fully specified.
+        
+        """
+        schema = cls._schema
+        model_name = schema.name
+        pkey_names = schema.pkey_names
         pkey_values = OrderedDict()
         repr_pkey_names = tuple(repr(name) for name in pkey_names)
         if pkey:
@@ -137,7 +264,110 @@ class Model(metaclass=MetaModel):
                         "specified for the model {}, expects {}".format(
                         model_name, ", ".join(repr_pkey_names)))
         
-        return Model.data_connector.find_object(cls, pkey_values)
+        return pkey_values
+    
+    @classmethod
+    def filter(cls, **kwargs):
+        """Return a lazy query set selecting the matching objects.
+        
+        The named parameters are conditions on the fields.  For instance:
+        >>> User.filter(username="admin")
+        >>> User.filter(id__gt=10, password__ne="unknown")
+        
+        No data is read until the query set is iterated over.  See the
+        QuerySet class (./query.py) for the supported operators.
+        
+        """
+        return QuerySet(cls).filter(**kwargs)
+    
+    @classmethod
+    def only(cls, *names):
+        """Return a query set reading only the specified fields.
+        
+        The other fields are loaded when first accessed (see the
+        QuerySet class in ./query.py).
+        
+        """
+        return QuerySet(cls).only(*names)
+    
+    @classmethod
+    def defer(cls, *names):
+        """Return a query set reading all fields but the specified ones.
+        
+        The deferred fields are loaded when first accessed (see the
+        QuerySet class in ./query.py).
+        
+        """
+        return QuerySet(cls).defer(*names)
+    
+    @classmethod
+    def count(cls):
+        """Return the number of the model's objects.
+        
+        The objects are counted by the data connector, without being
+        read if possible.
+        
+        """
+        return QuerySet(cls).count()
+    
+    @classmethod
+    def aggregate(cls, **aggregates):
+        """Return the aggregated fields of the model's objects.
+        
+        For instance:
+        >>> Account.aggregate(sum="balance", max="balance")
+        {'sum': 1250, 'max': 600}
+        
+        See the QuerySet class in ./query.py.
+        
+        """
+        return QuerySet(cls).aggregate(**aggregates)
+    
+    @classmethod
+    def group_by(cls, name, **aggregates):
+        """Group the model's objects by the value of a field.
+        
+        For instance:
+        >>> Account.group_by("name", sum="balance")
+        {'bank': {'count': 3, 'sum': 800}, 'shop': {'count': 1, 'sum': 450}}
+        
+        See the QuerySet class in ./query.py.
+        
+        """
+        return QuerySet(cls).group_by(name, **aggregates)
+    
+    @classmethod
+    def page(cls, after=None, limit=20, order_by=None):
+        """Return a page of objects, in a list.
+        
+        The objects are sorted by the 'order_by' field (the primary key
+        by default, "-field" meaning a descending order).  The page
+        contains at most 'limit' objects, following the 'after' value
+        of this field, which is usually the value of the last object
+        of the previous page:
+        >>> page = User.page(limit=20)
+        >>> next_page = User.page(after=page[-1].id, limit=20)
+        
+        The page is selected through the value of the field, not through
+        an offset, so that every page is read as fast as the first
+        one.  The field should therefore be unique.
+        
+        """
+        if order_by is None:
+            pkey_names = cls._schema.pkey_names
+            if len(pkey_names) != 1:
+                raise ValueError("the model {} has several primary keys, " \
+                        "the 'order_by' field should be specified".format(
+                        cls._schema.name))
+            
+            order_by = pkey_names[0]
+        
+        query = QuerySet(cls).order_by(order_by).limit(limit)
+        if after is not None:
+            op = "lt" if order_by.startswith("-") else "gt"
+            query = query.filter(**{order_by.lstrip("-") + "__" + op: after})
+        
+        return list(query)
     
     def __init__(self, **kwargs):
         """Create an object from keyword parameters.
@@ -145,32 +375,38 @@ class Model(metaclass=MetaModel):
         This method SHOULD NOT be redefined in a subclass.
         
         """
-        fields = get_fields(type(self))
-        fields = dict((field.field_name, field) for field in fields)
         for name, value in kwargs.items():
             object.__setattr__(self, name, value)
         
         # Get the default values
         if kwargs:
-            for name, field in fields.items():
-                if not field.auto_increment and not name in kwargs:
-                    default = field.default
-                    if default is None:
-                        raise ValueError("the field {} of model {} has no " \
-                                "default value".format(field.field_name,
-                                type(self)))
-                    
-                    object.__setattr__(self, name, default)
+            set_defaults(self, kwargs)
         
         # If named parameters were specified, save the object
         if kwargs and Model.data_connector:
-            Model.data_connector.add_object(self)
+            Model.data_connector.register_new(self)
+    
+    def __getattr__(self, attr):
+        """Load a deferred field of a slots-based object.
+        
+        The other objects use the field descriptor (see
+        model.types.BaseType.__get__).
+        
+        """
+        data_connector = getattr(Model, "data_connector", None)
+        if attr in type(self)._schema.fields_by_name and data_connector \
+                and data_connector.load_deferred(self, attr):
+            return getattr(self, attr)
+        
+        raise AttributeError("{} object has no attribute {}".format(
+                repr(type(self).__name__), repr(attr)))
     
     def __repr__(self):
-        pkeys = get_pkey_values(self)
+        schema = self._schema
+        pkeys = schema.get_pkey_values(self)
         pkeys = [repr(field) for field in pkeys]
         pkeys = " ".join(pkeys)
-        return "<model {} ({})>".format(get_name(type(self)), pkeys)
+        return "<model {} ({})>".format(schema.name, pkeys)
     
     def __setattr__(self, attr, value):
         """Set the value to the field.
@@ -178,15 +414,27 @@ class Model(metaclass=MetaModel):
         This method checks the value type as well.
         
         """
-        field = getattr(self, attr)
-        if isinstance(field, BaseType):
+        field = self._schema.fields_by_name.get(attr)
+        if field is not None:
             # Check the value type
             check = field.accept_value(value)
         
         object.__setattr__(self, attr, value)
         
         if Model.data_connector and Model.data_connector.running:
-            Model.data_connector.update_object(self, attr)
+            Model.data_connector.register_update(self, attr)
+    
+    async def asave(self):
+        """Save the pending changes of the object, without blocking.
+        
+        In write-behind mode (see DataConnector), the object's
+        changes are sent at once, the other pending changes waiting for
+        the next flush.  Otherwise, the changes were already sent and
+        nothing is done.
+        
+        """
+        if Model.data_connector:
+            await Model.data_connector.asave_object(self)
     
     def delete(self):
         """Destroy the created object.
@@ -196,4 +444,4 @@ class Model(metaclass=MetaModel):
         
         """
         if Model.data_connector:
-            Model.data_connector.remove_object(self)
+            Model.data_connector.register_delete(self)
@@ -0,0 +1,342 @@
+# Copyright (c) 2012 LE GOFF Vincent
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+# * Neither the name of the copyright holder nor the names of its contributors
+#   may be used to endorse or promote products derived from this software
+#   without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT
+# OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+
+"""This module contains the QuerySet class, described below."""
+
+import operator
+
+OPERATORS = {
+    "exact": operator.eq,
+    "ne": operator.ne,
+    "gt": operator.gt,
+    "gte": operator.ge,
+    "lt": operator.lt,
+    "lte": operator.le,
+    "in": lambda value, values: value in values,
+}
+
+AGGREGATES = ("sum", "min", "max")
+
+class QuerySet:
+    
+    """Class representing a lazy selection of objects.
+    
+    A query set is created by the Model.filter class method.  It
+    doesn't access the datas until it is iterated over:
+    >>> users = User.filter(username="admin")  # nothing is read yet
+    >>> for user in users:  # the query is sent to the data connector
+    ...     print(user)
+    ... 
+    
+    Query sets can be chained, each call to 'filter' returning a
+    new query set with additional conditions:
+    >>> User.filter(id__gt=10).filter(id__lte=20)
+    
+    A condition is expressed by a named parameter.  Its name is the
+    field name, optionally followed by two underscores and an operator:
+        exact -- equal to the value (the default operator)
+        ne -- not equal to the value
+        gt -- greater than the value
+        gte -- greater than or equal to the value
+        lt -- lower than the value
+        lte -- lower than or equal to the value
+        in -- in the specified sequence of values
+    
+    The selected objects can be sorted and their number limited:
+    >>> User.filter(id__gt=10).order_by("-id").limit(20)
+    
+    Only some fields can be read, the others being loaded when first
+    accessed (for every object of the query set at once):
+    >>> User.filter(id__gt=10).only("username")
+    >>> User.filter(id__gt=10).defer("biography")
+    The primary key fields are always read.
+    
+    The selected objects can be counted, their fields aggregated and
+    grouped by value, without building the objects if the data
+    connector can avoid it:
+    >>> User.filter(password="unknown").count()
+    >>> Account.filter(balance__gt=0).aggregate(sum="balance", max="balance")
+    {'sum': 1250, 'max': 600}
+    >>> Account.group_by("name", sum="balance")
+    {'bank': {'count': 3, 'sum': 800}, 'shop': {'count': 1, 'sum': 450}}
+    The aggregate functions are "sum", "min" and "max".  The order
+    and the limit, if any, are applied before aggregating.
+    
+    Each data connector translates the conditions, the order and the
+    limit (see the 'select_objects' method of DataConnector).  The
+    'matches' and 'sort' methods, however, can be used to check the
+    conditions and sort the objects in memory.
+    
+    Attributes:
+        model -- the model (Model subclass)
+        conditions -- a tuple of conditions (field, operator, value)
+        ordering -- a tuple of (field, descending) pairs
+        limit_count -- the maximum number of objects (None if unlimited)
+        fields -- the tuple of field names to read (None if all)
+    
+    """
+    
+    def __init__(self, model, conditions=(), ordering=(), limit_count=None,
+            fields=None):
+        self.model = model
+        self.conditions = tuple(conditions)
+        self.ordering = tuple(ordering)
+        self.limit_count = limit_count
+        self.fields = fields
+        self.results = None
+    
+    def __iter__(self):
+        return iter(self.fetch())
+    
+    def __len__(self):
+        return len(self.fetch())
+    
+    def __repr__(self):
+        conditions = []
+        for name, op, value in self.conditions:
+            conditions.append("{}__{}={}".format(name, op, repr(value)))
+        
+        for name, descending in self.ordering:
+            conditions.append("order_by={}{}".format("-" if descending \
+                    else "", name))
+        if self.limit_count is not None:
+            conditions.append("limit={}".format(self.limit_count))
+        if self.fields is not None:
+            conditions.append("only={}".format(",".join(self.fields)))
+        
+        return "<query on {} ({})>".format(repr(self.model),
+                ", ".join(conditions))
+    
+    def clone(self, **kwargs):
+        """Return a copy of the query set, with some attributes changed.
+        
+        The results are not copied.
+        
+        """
+        conditions = kwargs.get("conditions", self.conditions)
+        ordering = kwargs.get("ordering", self.ordering)
+        limit_count = kwargs.get("limit_count", self.limit_count)
+        fields = kwargs.get("fields", self.fields)
+        return type(self)(self.model, conditions, ordering, limit_count,
+                fields)
+    
+    def filter(self, **kwargs):
+        """Return a new query set with additional conditions."""
+        conditions = list(self.conditions)
+        for key, value in sorted(kwargs.items()):
+            conditions.append(self.parse_condition(key, value))
+        
+        return self.clone(conditions=conditions)
+    
+    def order_by(self, *names):
+        """Return a new query set sorted by the specified fields.
+        
+        A field name preceded by a minus sign ("-id") means a
+        descending order.  The previous order is replaced.
+        
+        """
+        schema = self.model._schema
+        ordering = []
+        for name in names:
+            descending = name.startswith("-")
+            name = name.lstrip("-")
+            if name not in schema.fields_by_name:
+                raise ValueError("the field name {} is not a field of " \
+                        "the model {}".format(repr(name), schema.name))
+            
+            ordering.append((name, descending))
+        
+        return self.clone(ordering=ordering)
+    
+    def limit(self, number):
+        """Return a new query set selecting at most 'number' objects."""
+        if number < 0:
+            raise ValueError("the limit should be a positive number")
+        
+        return self.clone(limit_count=number)
+    
+    def only(self, *names):
+        """Return a new query set reading only the specified fields.
+        
+        The primary key fields are read as well.
+        
+        """
+        schema = self.model._schema
+        self.check_field_names(names)
+        names = set(names).union(schema.pkey_names)
+        fields = tuple(name for name in schema.field_names if name in names)
+        return self.clone(fields=fields)
+    
+    def defer(self, *names):
+        """Return a new query set reading all but the specified fields.
+        
+        The primary key fields are always read.
+        
+        """
+        schema = self.model._schema
+        self.check_field_names(names)
+        fields = self.fields if self.fields is not None else \
+                schema.field_names
+        fields = tuple(name for name in fields if name not in names or \
+                name in schema.pkey_names)
+        return self.clone(fields=fields)
+    
+    def check_field_names(self, names):
+        """Raise a ValueError if a name is not a field name."""
+        schema = self.model._schema
+        for name in names:
+            if name not in schema.fields_by_name:
+                raise ValueError("the field name {} is not a field of " \
+                        "the model {}".format(repr(name), schema.name))
+    
+    def check_aggregates(self, aggregates):
+        """Raise a ValueError if an aggregate function or field is unknown."""
+        for function in aggregates:
+            if function not in AGGREGATES:
+                raise ValueError("unknown aggregate function {}, expected " \
+                        "one of {}".format(repr(function), AGGREGATES))
+        
+        self.check_field_names(aggregates.values())
+    
+    def parse_condition(self, key, value):
+        """Return the condition (field, operator, value).
+        
+        Raise a ValueError if the field or the operator is unknown.
+        
+        """
+        name, sep, op = key.partition("__")
+        op = op or "exact"
+        schema = self.model._schema
+        if name not in schema.fields_by_name:
+            raise ValueError("the field name {} is not a field of the " \
+                    "model {}".format(repr(name), schema.name))
+        
+        if op not in OPERATORS:
+            raise ValueError("unknown operator {} in {}".format(repr(op),
+                    repr(key)))
+        
+        if op == "in":
+            value = tuple(value)
+        
+        return (name, op, value)
+    
+    def fetch(self):
+        """Fetch and return the list of selected objects.
+        
+        The data connector is called only once:  the results are then
+        kept in the query set.
+        
+        """
+        if self.results is None:
+            data_connector = getattr(self.model, "data_connector", None)
+            if data_connector:
+                data_connector.flush()
+                self.results = list(data_connector.select_objects(self))
+            else:
+                self.results = []
+        
+        return self.results
+    
+    def count(self):
+        """Return the number of selected objects.
+        
+        If the query set was already fetched, its objects are counted.
+        Otherwise, the data connector counts them (see
+        DataConnector.count_objects).
+        
+        """
+        if self.results is not None:
+            return len(self.results)
+        
+        data_connector = getattr(self.model, "data_connector", None)
+        if data_connector:
+            data_connector.flush()
+            return data_connector.count_objects(self)
+        
+        return 0
+    
+    def aggregate(self, **aggregates):
+        """Return the aggregated fields of the selected objects.
+        
+        The named parameters are the aggregate functions, their values
+        the field names.  Return a dictionary {function: value}.  The
+        None values are ignored:  the sum of no value is 0, the minimum
+        and the maximum of no value are None.
+        
+        """
+        self.check_aggregates(aggregates)
+        data_connector = getattr(self.model, "data_connector", None)
+        if data_connector:
+            data_connector.flush()
+            return data_connector.aggregate_objects(self, aggregates)
+        
+        return dict((function, 0 if function == "sum" else None) for \
+                function in aggregates)
+    
+    def group_by(self, name, **aggregates):
+        """Group the selected objects by the value of a field.
+        
+        Return a dictionary {value: results}, the results of each group
+        being a dictionary containing the number of objects ("count")
+        and the aggregated fields (see 'aggregate').
+        
+        """
+        self.check_field_names((name, ))
+        self.check_aggregates(aggregates)
+        data_connector = getattr(self.model, "data_connector", None)
+        if data_connector:
+            data_connector.flush()
+            return data_connector.group_objects(self, name, aggregates)
+        
+        return {}
+    
+    def matches(self, object):
+        """Return whether the object matches all the conditions."""
+        for name, op, value in self.conditions:
+            if not OPERATORS[op](getattr(object, name), value):
+                return False
+        
+        return True
+    
+    def sort(self, objects):
+        """Sort the objects in memory and return them, in a list.
+        
+        The None values are placed before the other values.  The
+        number of returned objects is limited if needed.
+        
+        """
+        objects = list(objects)
+        for name, descending in reversed(self.ordering):
+            objects.sort(key=lambda object: (getattr(object, name) is \
+                    not None, getattr(object, name)), reverse=descending)
+        
+        if self.limit_count is not None:
+            objects = objects[:self.limit_count]
+        
+        return objects
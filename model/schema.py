@@ -0,0 +1,239 @@
+# Copyright (c) 2012 LE GOFF Vincent
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+# * Neither the name of the copyright holder nor the names of its contributors
+#   may be used to endorse or promote products derived from this software
+#   without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT
+# OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+
+"""This module contains the Schema class, described below."""
+
+from operator import attrgetter, itemgetter
+
+class Schema:
+    
+    """Class representing the compiled schema of a model.
+    
+    A schema is built once, by the MetaModel metaclass, when the model
+    class is created.  It gathers every information about the model
+    which is needed when manipulating its objects (the field list,
+    the primary keys, the model's name...), so that it doesn't have
+    to be computed again on every call.
+    
+    A schema is frozen:  its attributes can't be modified once built.
+    
+    Attributes:
+        model -- the model (Model subclass)
+        name -- the model's name
+        plural_name -- the model's plural name
+        fields -- a tuple of fields, ordered by NID
+        field_names -- a tuple of field names, in the same order
+        fields_by_name -- a dictionary {field_name: field}
+        indexes -- a dictionary {field_name: column index}
+        pkey_names -- a tuple of primary key field names
+        pkey_indexes -- a tuple of primary key column indexes
+        auto_increments -- a tuple of auto increment field names
+    
+    Methods:
+        get_values(object) -- return a tuple of the object's field values
+        get_values_dict(object) -- return a dictionary {field: value}
+        get_pkey(object) -- return the object's key in cache
+        get_pkey_values(object) -- return a tuple of primary key values
+        get_row_pkey(row) -- return the key in cache of a row (tuple)
+        get_dict_pkey(attributes) -- return the key in cache of a dictionary
+        get_pkey_getter(names) -- return a row-to-key function
+        get_hydrator(names, mapping) -- return a row-to-object function
+    
+    The key in cache is the primary key value if the model has only
+    one primary key field, or the tuple of primary key values otherwise.
+    
+    The field values are always read in the field order, through the
+    attributes of the object, so the objects can be stored in a
+    '__dict__' or in slots (see the MetaModel metaclass).
+    
+    The hydrators are functions building an object from a row (a tuple
+    of values, like a sqlite3 row) or from a mapping (a dictionary, like
+    a MongoDB document).  They are generated the first time they are
+    needed and kept in the schema.  They write the attributes directly
+    in the new object, without calling the model's constructor or its
+    '__setattr__' method, which makes reading a whole table much faster
+    than building each object with Model.build.
+    
+    """
+    
+    def __init__(self, model, fields):
+        """Build the schema of 'model', 'fields' being ordered by NID."""
+        self._frozen = False
+        self._hydrators = {}
+        self.model = model
+        self.name = model.__name__.split(".")[-1].lower()
+        self.plural_name = getattr(model, "plural_name", None) or \
+                self.pluralize(self.name)
+        self.fields = tuple(fields)
+        self.field_names = tuple(field.field_name for field in self.fields)
+        self.fields_by_name = dict(zip(self.field_names, self.fields))
+        self.indexes = dict((name, i) for i, name in enumerate(
+                self.field_names))
+        self.pkey_names = tuple(field.field_name for field in self.fields \
+                if field.pkey)
+        self.pkey_indexes = tuple(self.indexes[name] for name in \
+                self.pkey_names)
+        self.auto_increments = tuple(field.field_name for field in \
+                self.fields if field.auto_increment)
+        
+        # Build the field values accessor
+        if len(self.field_names) == 1:
+            values_getter = attrgetter(self.field_names[0])
+            self.get_values = lambda object: (values_getter(object), )
+        else:
+            self.get_values = attrgetter(*self.field_names)
+        
+        # Build the primary key extractors
+        names = self.pkey_names
+        if len(names) == 1:
+            name = names[0]
+            getter = attrgetter(name)
+            self.get_pkey = getter
+            self.get_pkey_values = lambda object: (getter(object), )
+            self.get_row_pkey = itemgetter(self.pkey_indexes[0])
+            self.get_dict_pkey = lambda attributes: attributes.get(name)
+        else:
+            getter = attrgetter(*names) if names else lambda object: ()
+            row_getter = itemgetter(*self.pkey_indexes) if names else \
+                    lambda row: ()
+            self.get_pkey = getter
+            self.get_pkey_values = getter
+            self.get_row_pkey = row_getter
+            self.get_dict_pkey = lambda attributes: tuple(
+                    attributes.get(name) for name in names)
+        
+        self._frozen = True
+    
+    def get_values_dict(self, object):
+        """Return a dictionary {field_name: value} of the object's fields."""
+        return dict(zip(self.field_names, self.get_values(object)))
+    
+    def get_pkey_getter(self, names):
+        """Return the function extracting the key in cache from a row.
+        
+        The row values are expected in the 'names' order, which should
+        contain every primary key field.
+        
+        """
+        names = tuple(names)
+        if names == self.field_names:
+            return self.get_row_pkey
+        
+        positions = [names.index(name) for name in self.pkey_names]
+        if len(positions) == 1:
+            return itemgetter(positions[0])
+        elif positions:
+            return itemgetter(*positions)
+        
+        return lambda row: ()
+    
+    def get_hydrator(self, names=None, mapping=False):
+        """Return the function building an object from a row.
+        
+        Parameters:
+            names -- the field names, in the row order (all the fields
+                    in the field order if not specified)
+            mapping -- if True, the row is a dictionary whose keys are
+                    the field names, otherwise it's a sequence.  A
+                    field missing from the dictionary gets its
+                    default value (a KeyError is raised if it has
+                    none).
+        
+        The returned function expects the row as only argument and
+        returns the new object.  It is generated once for each set of
+        parameters.
+        
+        """
+        names = self.field_names if names is None else tuple(names)
+        key = (names, mapping)
+        hydrator = self._hydrators.get(key)
+        if hydrator is None:
+            hydrator = self.compile_hydrator(names, mapping)
+            self._hydrators[key] = hydrator
+        
+        return hydrator
+    
+    def compile_hydrator(self, names, mapping=False):
+        """Generate and return a hydrator (see 'get_hydrator')."""
+        use_slots = self.model.use_slots
+        namespace = {
+            "model": self.model,
+            "new": object.__new__,
+            "setattr_": object.__setattr__,
+        }
+        lines = ["def hydrate(row):", "    obj = new(model)"]
+        for i, name in enumerate(names):
+            default = self.fields_by_name[name].default
+            if mapping and default is not None:
+                namespace["default_{}".format(i)] = default
+                value = "row.get({}, default_{})".format(repr(name), i)
+            else:
+                value = "row[{}]".format(repr(name) if mapping else i)
+            
+            if use_slots:
+                # Use the slot descriptor directly
+                setter = "set_{}".format(i)
+                namespace[setter] = getattr(self.model, name).__set__
+                lines.append("    {}(obj, {})".format(setter, value))
+            else:
+                lines.append("    setattr_(obj, {}, {})".format(
+                        repr(name), value))
+        
+        lines.append("    return obj")
+        source = "\n".join(lines)
+        code = compile(source, "<hydrator of {}>".format(self.name), "exec")
+        exec(code, namespace)
+        return namespace["hydrate"]
+    
+    def __repr__(self):
+        return "<schema {} ({})>".format(self.name,
+                ", ".join(self.field_names))
+    
+    def __setattr__(self, name, value):
+        """Prevent the schema from being modified once built."""
+        if getattr(self, "_frozen", False):
+            raise AttributeError("the schema of {} is read-only".format(
+                    self.name))
+        
+        object.__setattr__(self, name, value)
+    
+    def __delattr__(self, name):
+        """Prevent the schema from being modified once built."""
+        raise AttributeError("the schema of {} is read-only".format(
+                self.name))
+    
+    @staticmethod
+    def pluralize(singular_name):
+        """Return the plural name, using the 's / es' rule."""
+        if singular_name.endswith("y"):
+            return singular_name[:-1] + "ies"
+        elif singular_name.endswith("s"):
+            return singular_name + "es"
+        
+        return singular_name + "s"
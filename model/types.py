@@ -43,9 +43,21 @@ class BaseType:
     in which it is defined.  This identifier is used to order the fields
     for an object.
     
+    A field can be declared as indexed, with the 'index' parameter:
+        None -- the field is not indexed (the default)
+        "hash" -- the field is indexed for equality lookups
+        "sorted" -- the field is indexed for equality and range lookups
+    The data connectors which manage their own indexes (like the
+    YAML connector) use this information.
+    
+    The fields are descriptors:  if an object was read without this
+    field (see QuerySet.only), reading the attribute asks the data
+    connector to load it (see DataConnector.load_deferred).
+    
     """
     
     current_nid = 1
+    index_types = (None, "hash", "sorted")
     
     @classmethod
     def next_nid(cls):
@@ -53,14 +65,19 @@ class BaseType:
         BaseType.current_nid += 1
         return nid
     
-    def __init__(self, pkey=False, default=None):
+    def __init__(self, pkey=False, default=None, index=None):
         """The basetype field constructor."""
+        if index not in self.index_types:
+            raise ValueError("invalid index type {}, expected one " \
+                    "of {}".format(repr(index), self.index_types))
+        
         self.nid = self.next_nid()
         self.model = None
         self.field_name = "unknown name"
         self.pkey = pkey
         self.auto_increment = False
         self.default = default
+        self.index = index
         
         if default:
             # Check that the default value is accepted
@@ -69,6 +86,23 @@ class BaseType:
     def __repr__(self):
         return "<field {} ({})>".format(repr(self.field_name), self.nid)
     
+    def __get__(self, instance, owner=None):
+        """Return the field, or load the deferred value of an object.
+        
+        This method is only called if the object has no value for this
+        field (the value is stored in the object's '__dict__').
+        
+        """
+        if instance is None:
+            return self
+        
+        data_connector = getattr(owner, "data_connector", None)
+        if data_connector and data_connector.load_deferred(instance,
+                self.field_name):
+            return getattr(instance, self.field_name)
+        
+        return self
+    
     def copy(self):
         """Return a shallow copy of self."""
         copied = copy.copy(self)
@@ -95,8 +129,9 @@ class Integer(BaseType):
     
     """
     
-    def __init__(self, pkey=False, auto_increment=False, default=None):
-        BaseType.__init__(self, pkey, default)
+    def __init__(self, pkey=False, auto_increment=False, default=None,
+            index=None):
+        BaseType.__init__(self, pkey, default, index)
         self.auto_increment = auto_increment
     
     def accept_value(self, value):
@@ -115,11 +150,19 @@ class String(BaseType):
     """Field type: string.
     
     This type of field handles a string of characters of different length.
+    The maximum length (in characters) can be set with the 'max_size'
+    parameter.  The data connectors storing fixed-width records (like
+    the mmap connector) use it to size the field, reserving enough
+    bytes for any encoded string of this length.
     
     """
     
-    def __init__(self, pkey=False, default=None):
-        BaseType.__init__(self, pkey, default)
+    def __init__(self, pkey=False, default=None, index=None, max_size=None):
+        if max_size is not None and max_size < 1:
+            raise ValueError("the maximum size should be a positive number")
+        
+        self.max_size = max_size
+        BaseType.__init__(self, pkey, default, index)
     
     def accept_value(self, value):
         """Return True if this value is accepted.
@@ -130,4 +173,9 @@ class String(BaseType):
         if not isinstance(value, str):
             BaseType.accept_value(self, value)
         
+        if self.max_size is not None and len(value) > self.max_size:
+            raise ValueError("the value {} of {}.{} is longer than {} " \
+                    "characters".format(repr(value), repr(self.model),
+                    self.field_name, self.max_size))
+        
         return True
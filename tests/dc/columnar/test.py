@@ -0,0 +1,89 @@
+# Copyright (c) 2012 LE GOFF Vincent
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+# * Neither the name of the copyright holder nor the names of its contributors
+#   may be used to endorse or promote products derived from this software
+#   without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT
+# OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+
+"""Test for the columnar data connector."""
+
+from unittest import TestCase
+
+from tests.dc.test import AbstractDCTest
+from tests.model import *
+from dc.columnar.connector import ColumnarConnector
+
+class DCTest(AbstractDCTest, TestCase):
+    
+    name = "columnar"
+    connector = ColumnarConnector
+    
+    def test_vectorized(self):
+        """Select, count and sum the accounts on the columns."""
+        Account.bulk_create([{"name": "Vector_" + str(i % 3),
+                "balance": i} for i in range(30)])
+        self.teardown_data_connector()
+        self.setup_data_connector()
+        query = Account.filter(name="Vector_1", balance__gte=10)
+        self.assertEqual(self.dc.count_objects(query), 7)
+        self.assertEqual(self.dc.aggregate_objects(query, {"sum": "balance",
+                "min": "balance", "max": "name"}), {"sum": 133, "min": 10,
+                "max": "Vector_1"})
+        self.assertEqual(self.dc.stats()["cached_objects"], 0)
+        
+        # Only the selected objects are built
+        accounts = list(query.order_by("-balance").limit(2))
+        self.assertEqual([account.balance for account in accounts], [28, 25])
+        self.assertEqual(self.dc.stats()["cached_objects"], 2)
+        self.assertEqual(len(Account.filter(name__in=("Vector_0",
+                "Unknown"))), 10)
+        self.assertEqual(len(Account.filter(name__lt="Vector_1")), 10)
+    
+    def test_string_codes(self):
+        """Give the codes of the strings no longer used to the new ones."""
+        table = self.dc.tables["account"]
+        accounts = Account.bulk_create([{"name": "Coded_" + str(i)} \
+                for i in range(3)])
+        for i in range(20):
+            accounts[0].name = "Renamed_" + str(i)
+        
+        accounts[1].delete()
+        Account(name="Shared")
+        accounts[2].name = "Shared"
+        self.assertLessEqual(len(table.strings["name"]), 4)
+        self.assertEqual(sorted(table.codes["name"]), ["Renamed_19",
+                "Shared"])
+        self.assertEqual(len(Account.filter(name="Shared")), 2)
+        self.assertEqual(len(Account.filter(name__ne="Shared")), 1)
+        
+        # The unused codes are found again when the table is read
+        self.teardown_data_connector()
+        self.setup_data_connector()
+        table = self.dc.tables["account"]
+        self.assertEqual(sorted(table.codes["name"]), ["Renamed_19",
+                "Shared"])
+        self.assertEqual(table.uses["name"][table.codes["name"]["Shared"]],
+                2)
+        self.assertEqual(Account.find(accounts[0].id).name, "Renamed_19")
@@ -0,0 +1,86 @@
+# Copyright (c) 2012 LE GOFF Vincent
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+# * Neither the name of the copyright holder nor the names of its contributors
+#   may be used to endorse or promote products derived from this software
+#   without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT
+# OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+
+"""Test for the mmap data connector."""
+
+import os
+from unittest import TestCase
+
+from model import Model, Integer, String
+from tests.dc.test import AbstractDCTest
+from tests.model import *
+from dc.mmap.connector import MMapConnector
+
+class DCTest(AbstractDCTest, TestCase):
+    
+    name = "mmap"
+    connector = MMapConnector
+    
+    def test_fixed_width(self):
+        """Check the records addressed by ID in the table file."""
+        table = self.dc.tables["user"]
+        users = [User(username="Fixed_" + str(i)) for i in range(100)]
+        self.assertEqual(table.read(users[70].id), (users[70].id,
+                "Fixed_70", "unknown"))
+        self.assertGreaterEqual(table.capacity, 100)
+        self.assertEqual(os.path.getsize(table.path), 64 + \
+                table.capacity * table.record_size)
+        users[3].delete()
+        self.assertIsNone(table.read(users[3].id))
+        self.assertRaises(ValueError, User, username="x" * 65)
+        
+        # The records are read again after reconnecting
+        uid = users[70].id
+        self.teardown_data_connector()
+        self.setup_data_connector()
+        self.assertEqual(User.find(uid).username, "Fixed_70")
+        self.assertEqual(len(User.get_all()), 99)
+        self.assertGreater(self.dc.tables["user"].next_id, users[-1].id)
+    
+    def test_not_fixed_width(self):
+        """Check that the unsupported models are refused."""
+        class Tag(Model):
+            
+            name = String(pkey=True)
+        
+        self.assertRaises(ValueError, self.dc.record_model, Tag)
+    
+    def test_max_size(self):
+        """Store non-ASCII strings as long as the maximum size."""
+        class Label(Model):
+            
+            name = String(max_size=3)
+            weight = Integer(default=0)
+        
+        self.dc.record_model(Label)
+        self.assertEqual(self.dc.tables["label"].fields[1], ("s", 12))
+        label = Label(name="\u20ac\U0001f600\u00e9")
+        self.dc.clear_cache()
+        self.assertEqual(Label.find(label.id).name,
+                "\u20ac\U0001f600\u00e9")
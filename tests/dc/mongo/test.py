@@ -31,9 +31,69 @@
 from unittest import TestCase
 
 from tests.dc.test import AbstractDCTest
+from tests.model import *
 from dc.mongo.connector import MongoDBConnector
 
 class DCTest(AbstractDCTest, TestCase):
     
     name = "mongo"
     connector = MongoDBConnector
+    
+    def test_set_updates(self):
+        """Send the modified fields only, by bulk writes if pending."""
+        users = [User(username="Set_" + str(i)) for i in range(3)]
+        collection = self.dc.datas["user"]
+        collection.update_many({}, {"$set": {"extra": True}})
+        users[0].password = "changed"
+        self.dc.write_behind = True
+        for user in users[1:]:
+            user.username = user.username + "_bulk"
+        self.dc.flush()
+        documents = list(collection.find({}, {"_id": False}))
+        self.assertTrue(all(document["extra"] for document in documents))
+        self.assertEqual(sorted((document["username"], document["password"]) \
+                for document in documents), [("Set_0", "changed"),
+                ("Set_1_bulk", "unknown"), ("Set_2_bulk", "unknown")])
+    
+    def test_document_id(self):
+        """Check that the primary key is stored as the document's _id."""
+        user = User(username="Keyed")
+        collection = self.dc.datas["user"]
+        self.assertEqual(collection.find_one({"_id": user.id}), {
+                "_id": user.id, "username": "Keyed", "password": "unknown"})
+        self.assertEqual(self.dc.build_filter(User.filter(id__gte=3)),
+                {"_id": {"$gte": 3}})
+        uid = user.id
+        self.teardown_data_connector()
+        self.setup_data_connector()
+        self.assertEqual(User.find(uid).username, "Keyed")
+        self.assertEqual([user.id for user in User.only("username")], [uid])
+    
+    def test_migrate_documents(self):
+        """Migrate once, by batches, the documents with a generated _id."""
+        collection = self.dc.datas["user"]
+        collection.insert_many([{"id": 8, "username": "Old",
+                "password": "old"}, {"id": 9, "username": "Older"}])
+        self.dc.increments["user"].delete_many({"name": "__format__"})
+        self.dc.migration_batch_size = 1
+        self.assertEqual(self.dc.migrate_documents(User._schema), 2)
+        self.assertEqual(collection.find_one({"_id": 8}), {"_id": 8,
+                "username": "Old", "password": "old"})
+        self.assertEqual(collection.count_documents({"id": {
+                "$exists": True}}), 0)
+        self.assertEqual(User.find(9).password, "unknown")
+        
+        # The collection is not browsed again
+        collection.insert_one({"id": 10, "username": "Late"})
+        self.teardown_data_connector()
+        self.setup_data_connector()
+        self.assertEqual(self.dc.migrate_documents(User._schema), 0)
+        self.assertEqual(self.dc.datas["user"].count_documents({"id": 10}),
+                1)
+    
+    def test_pkey_update(self):
+        """Refuse to modify the primary key of a stored object."""
+        user = User(username="Keyed")
+        self.assertRaises(ValueError, self.dc.build_update, user, ["id"])
+        self.assertEqual(self.dc.build_update(user, ["username"]),
+                {"$set": {"username": "Keyed"}})
@@ -28,12 +28,312 @@
 
 """Test for the sqlite3 data connector."""
 
+import gc
+import sqlite3
+import threading
 from unittest import TestCase
 
 from tests.dc.test import AbstractDCTest
+from model import exceptions as mod_exceptions
+from tests.model import *
+from dc.connector import DataConnector
 from dc.sqlite3.connector import Sqlite3Connector
 
 class DCTest(AbstractDCTest, TestCase):
     
     name = "sqlite3"
     connector = Sqlite3Connector
+    
+    def test_coalesced_updates(self):
+        """Check that one UPDATE is sent by modified object."""
+        users = User.bulk_create([{"username": "Coalesced"}] * 3)
+        self.dc.write_behind = True
+        for user in users:
+            user.username = "Updated"
+            user.password = "updated"
+        
+        statements = []
+        self.dc.connection.set_trace_callback(statements.append)
+        self.dc.flush()
+        self.dc.connection.set_trace_callback(None)
+        updates = [statement for statement in statements if \
+                statement.startswith("UPDATE")]
+        self.assertEqual(len(updates), 3)
+        self.assertEqual(len(User.filter(password="updated")), 3)
+    
+    def test_transaction(self):
+        """Commit and roll back (nested) transactions."""
+        kept = User(username="Kept")
+        with self.dc.transaction():
+            created = User(username="Committed")
+        
+        # The transaction is committed without calling loop
+        connection = sqlite3.connect(self.dc.location)
+        rows = connection.execute("SELECT username FROM users").fetchall()
+        connection.close()
+        self.assertEqual(rows, [("Kept", ), ("Committed", )])
+        
+        try:
+            with self.dc.transaction():
+                doomed = User(username="Doomed")
+                kept.username = "Changed"
+                with self.dc.transaction():
+                    inner = User(username="Inner")
+                created.delete()
+                raise RuntimeError("rollback")
+        except RuntimeError:
+            pass
+        
+        self.assertEqual(kept.username, "Kept")
+        self.assertIs(User.find(created.id), created)
+        created.password = "still updatable"
+        for object in (doomed, inner):
+            self.assertRaises(mod_exceptions.ObjectNotFound, User.find,
+                    object.id)
+    
+    def test_savepoint(self):
+        """Roll back a nested transaction only."""
+        with self.dc.transaction():
+            outer = User(username="Outer")
+            try:
+                with self.dc.transaction():
+                    User(username="Rolled")
+                    outer.username = "Modified"
+                    raise ValueError("rollback the savepoint")
+            except ValueError:
+                pass
+        
+        self.assertEqual(outer.username, "Outer")
+        self.assertEqual(list(User.filter(username="Outer")), [outer])
+        self.assertEqual(len(User.filter(username="Rolled")), 0)
+    
+    def test_bounded_cache(self):
+        """Check that the LRU and weak caches don't keep every object."""
+        self.dc.set_cache_policy("lru", limit=2)
+        users = User.bulk_create([{"username": "Lru"}] * 5)
+        self.assertEqual(len(self.dc.objects_tree["user"]), 2)
+        found = User.find(users[0].id)
+        self.assertIn(users[0].id, self.dc.objects_tree["user"])
+        
+        # The evicted object was read again as a new object
+        self.assertIsNot(found, users[0])
+        cache = self.dc.objects_tree["user"]
+        self.assertIs(cache.pop(users[0].id), found)
+        self.assertIsNone(cache.pop(users[0].id, None))
+        self.assertRaises(KeyError, cache.pop, users[0].id)
+        users[-1].delete()
+        self.assertEqual(len(cache), 0)
+        
+        self.dc.set_cache_policy("weak")
+        loaded = User.get_all()
+        self.assertEqual(len(self.dc.objects_tree["user"]), 4)
+        del users, loaded
+        gc.collect()
+        self.assertEqual(len(self.dc.objects_tree["user"]), 0)
+    
+    def test_iter_all_uncached(self):
+        """Iterate over the users without keeping them in cache."""
+        ids = [user.id for user in User.bulk_create([{"username": \
+                "Stream"}] * 5)]
+        self.dc.clear_cache()
+        usernames = [user.username for user in User.iter_all(batch_size=2,
+                cache=False)]
+        self.assertEqual(usernames, ["Stream"] * 5)
+        self.assertEqual(self.dc.stats()["cached_objects"], 0)
+        
+        # The default implementation doesn't keep them either
+        kept = User.find(ids[0])
+        users = list(DataConnector.iter_objects(self.dc, User, cache=False))
+        self.assertEqual(len(users), 5)
+        self.assertIn(kept, users)
+        self.assertEqual(self.dc.stats()["cached_objects"], 1)
+    
+    def test_deferred_fields(self):
+        """Load the deferred fields of several objects at once."""
+        User.bulk_create([{"username": "Deferred", "password": "secret_" + \
+                str(i)} for i in range(3)])
+        Account.bulk_create([{"name": "Deferred", "balance": i} \
+                for i in range(3)])
+        self.dc.clear_cache()
+        users = list(User.only("username").filter(username="Deferred"))
+        self.assertEqual(len(users), 3)
+        self.assertNotIn("password", vars(users[0]))
+        users[2].password = "changed"
+        self.assertEqual(users[0].password, "secret_0")
+        self.assertIn("password", vars(users[1]))
+        self.assertEqual(len(self.dc.deferred), 0)
+        self.assertEqual(User.find(users[2].id).password, "changed")
+        
+        accounts = list(Account.defer("balance").filter(name="Deferred"))
+        self.assertEqual([account.balance for account in accounts],
+                [0, 1, 2])
+    
+    def test_statements(self):
+        """Check that the statements are built once by model."""
+        statements = self.dc.statements["user"]
+        self.assertEqual(statements["delete"],
+                "DELETE FROM users WHERE id=?")
+        self.assertIn(("username", ), statements["update"])
+        self.dc.write_behind = True
+        user = User(username="Stated")
+        self.dc.flush()
+        user.username = "Restated"
+        user.password = "secret"
+        self.dc.flush()
+        self.assertIn(("username", "password"), statements["update"])
+        self.assertIs(self.dc.statements["user"], statements)
+    
+    def test_threads(self):
+        """Create and read users from several threads."""
+        self.dc.loop()
+        errors = []
+        def work(number):
+            try:
+                with self.dc.transaction():
+                    users = [User(username="Thread_" + str(number)) \
+                            for i in range(10)]
+                
+                found = list(User.filter(username="Thread_" + str(number)))
+                if found != users:
+                    errors.append(number)
+            except Exception as err:
+                errors.append(err)
+            finally:
+                self.dc.release_connection()
+        
+        threads = [threading.Thread(target=work, args=(i, )) \
+                for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        
+        self.assertEqual(errors, [])
+        self.assertEqual(len(self.dc.connections), 1)
+        mode = self.dc.connection.execute("PRAGMA journal_mode").fetchone()
+        self.assertEqual(mode[0], "wal")
+        ids = [user.id for user in User.filter(
+                username__in=["Thread_" + str(i) for i in range(4)])]
+        self.assertEqual(len(ids), 40)
+        self.assertEqual(len(set(ids)), 40)
+
+    def test_threaded_ids(self):
+        """Create users one by one and by batches from several threads.
+        
+        Another writer (like another process) inserts users through its
+        own connection meanwhile.
+        
+        """
+        def write():
+            connection = sqlite3.connect(self.dc.location, timeout=5)
+            for i in range(5):
+                with connection:
+                    connection.execute("INSERT INTO users (username) " \
+                            "values('Other')")
+            connection.close()
+        
+        User.bulk_create([{"username": "Mixed_first"}] * 2)
+        self.dc.loop()
+        write()
+        User.bulk_create([{"username": "Mixed_first"}] * 2)
+        self.dc.loop()
+        errors = []
+        def work(number):
+            username = "Mixed_" + str(number)
+            try:
+                for i in range(5):
+                    with self.dc.transaction():
+                        if number % 2:
+                            User.bulk_create([{"username": username}] * 3)
+                        else:
+                            User(username=username)
+            except Exception as err:
+                errors.append(err)
+            finally:
+                self.dc.release_connection()
+        
+        threads = [threading.Thread(target=work, args=(i, )) \
+                for i in range(6)]
+        threads.append(threading.Thread(target=write))
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        
+        self.assertEqual(errors, [])
+        users = User.filter(username__in=["Mixed_" + str(i) for i in range(6)])
+        ids = [user.id for user in users]
+        self.assertEqual(len(ids), 60)
+        self.assertEqual(len(set(ids)), 60)
+        others = [user.id for user in User.filter(username="Other")]
+        self.assertEqual(len(others), 10)
+        self.assertFalse(set(others) & set(ids))
+        self.dc.clear_cache()
+        for user in users:
+            self.assertEqual(User.find(user.id).username, user.username)
+    
+    def test_immediate_transaction(self):
+        """Take the write lock when the outermost transaction begins."""
+        self.dc.loop()
+        other = sqlite3.connect(self.dc.location, timeout=0)
+        with self.dc.transaction():
+            self.assertRaises(sqlite3.OperationalError, other.execute,
+                    "BEGIN IMMEDIATE")
+            with self.dc.transaction():
+                User(username="Immediate")
+        
+        other.execute("BEGIN IMMEDIATE")
+        other.rollback()
+        other.close()
+        self.assertEqual(len(User.filter(username="Immediate")), 1)
+    
+    def test_reclaim_connections(self):
+        """Close the connections of the threads that have ended."""
+        self.dc.loop()
+        def work(number):
+            User.count()
+            with self.dc.transaction():
+                User(username="Reclaimed_" + str(number))
+        
+        threads = [threading.Thread(target=work, args=(i, )) \
+                for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        
+        del threads
+        gc.collect()
+        self.assertEqual(len(self.dc.connections), 1)
+        usernames = ["Reclaimed_" + str(i) for i in range(4)]
+        self.assertEqual(len(User.filter(username__in=usernames)), 4)
+    
+    def test_pragmas(self):
+        """Switch the PRAGMA presets at runtime."""
+        connection = self.dc.connection
+        previous = self.dc.set_pragmas("bulk_load")
+        self.assertEqual(previous["synchronous"], "full")
+        self.assertEqual(connection.execute(
+                "PRAGMA synchronous").fetchone()[0], 0)
+        User.bulk_create([{"username": "Bulk"}] * 100)
+        self.dc.set_pragmas(**previous)
+        self.assertEqual(connection.execute(
+                "PRAGMA synchronous").fetchone()[0], 2)
+        self.dc.set_pragmas("balanced")
+        self.assertEqual(connection.execute(
+                "PRAGMA synchronous").fetchone()[0], 1)
+        self.assertRaises(ValueError, self.dc.set_pragmas, "fast")
+        self.assertRaises(ValueError, self.dc.set_pragmas, locking="none")
+        self.assertRaises(ValueError, self.dc.set_pragmas,
+                synchronous="off; DROP TABLE users")
+    
+    def test_aggregate_in_sql(self):
+        """Count and aggregate the users without reading them."""
+        User.bulk_create([{"username": "Counted_" + str(i % 4)} \
+                for i in range(20)])
+        self.teardown_data_connector()
+        self.setup_data_connector()
+        self.assertEqual(User.count(), 20)
+        self.assertEqual(User.aggregate(max="username"), {"max": "Counted_3"})
+        self.assertEqual(len(User.group_by("username")), 4)
+        self.assertEqual(self.dc.stats()["cached_objects"], 0)
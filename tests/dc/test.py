@@ -48,6 +48,7 @@ class DCTest(AbstractDCTest, TestCase):
 
 """
 
+import asyncio
 import os
 import yaml
 
@@ -77,6 +78,20 @@ class AbstractDCTest:
         test_default -- test the default value of a field
         test_find -- try to a retrieve a single object
         test_get_all -- try to retrieve all the created objects
+        test_slots -- create, update and retrieve a slots-based object
+        test_filter -- select objects with conditions on their fields
+        test_bulk_create -- create several objects at once
+        test_write_behind -- coalesce the changes until they are flushed
+        test_cache_policy -- retrieve objects with a bounded cache
+        test_tombstones -- compact the tombstones of deleted objects
+        test_delete_evicted -- delete an object evicted from cache
+        test_flush_error -- keep the changes not sent by a failed flush
+        test_allocator -- allocate IDs one by one and by batches
+        test_iter_all -- iterate over the objects by batches
+        test_page -- read the objects page by page
+        test_only -- read some fields only
+        test_async -- save, find and iterate from coroutines
+        test_aggregate -- count, aggregate and group the objects
     
     Other methods:
         setUp -- set up the test case
@@ -236,3 +251,239 @@ class AbstractDCTest:
         user = User(username="Crowd")
         users = User.get_all()
         self.assertIn(user, users)
+    
+    def test_slots(self):
+        """Create, update and retrieve an object stored in slots."""
+        account = Account(name="Slotted")
+        account.balance = 12
+        aid = account.id
+        self.teardown_data_connector()
+        self.setup_data_connector()
+        retrieved = Account.find(aid)
+        self.assertIsNot(retrieved, account)
+        self.assertEqual(retrieved.name, "Slotted")
+        self.assertEqual(retrieved.balance, 12)
+        self.assertIn(retrieved, Account.get_all())
+    
+    def test_filter(self):
+        """Select users through the filter method."""
+        first = User(username="Filtered", password="one")
+        second = User(username="Filtered", password="two")
+        third = User(username="Other", password="two")
+        query = User.filter(username="Filtered")
+        self.assertEqual(set(query), {first, second})
+        self.assertEqual(list(query.filter(password__ne="one")), [second])
+        self.assertEqual(set(User.filter(id__gte=second.id,
+                id__lte=third.id)), {second, third})
+        self.assertEqual(list(User.filter(id__in=[third.id])), [third])
+        self.assertEqual(len(User.filter(id__in=[])), 0)
+        self.assertRaises(ValueError, User.filter, unknown=1)
+        self.assertRaises(ValueError, User.filter, id__between=1)
+        
+        # Updated and deleted objects
+        second.password = "one"
+        first.delete()
+        self.assertEqual(list(User.filter(username="Filtered",
+                password="one")), [second])
+    
+    def test_bulk_create(self):
+        """Create several users at once, by batches."""
+        first = User(username="Before")
+        rows = [{"username": "Bulk_" + str(i)} for i in range(7)]
+        users = User.bulk_create(rows, batch_size=3)
+        self.assertEqual([user.username for user in users],
+                [row["username"] for row in rows])
+        uids = [user.id for user in users]
+        self.assertEqual(len(set(uids)), 7)
+        self.assertTrue(first.id < min(uids))
+        self.assertEqual(users[0].password, "unknown")
+        self.assertIs(User.find(uids[3]), users[3])
+        self.assertRaises(ValueError, User.bulk_create, [{}])
+        
+        # Reset the data connection
+        self.teardown_data_connector()
+        self.setup_data_connector()
+        self.assertEqual(User.find(uids[-1]).username, "Bulk_6")
+        last = User(username="After")
+        self.assertTrue(last.id > max(uids))
+    
+    def test_write_behind(self):
+        """Record the changes and send them when flushing."""
+        kept = User(username="Kept")
+        self.dc.write_behind = True
+        created = User(username="Pending")
+        cancelled = User(username="Cancelled")
+        cancelled.delete()
+        kept.username = "Renamed"
+        kept.password = "first"
+        kept.password = "second"
+        self.assertEqual(self.dc.dirty_objects, {kept: {"username",
+                "password"}})
+        self.dc.flush()
+        self.assertFalse(self.dc.new_objects or self.dc.dirty_objects)
+        self.assertTrue(created.id > kept.id)
+        self.assertIs(User.find(created.id), created)
+        
+        # Deleted objects can't be updated any more
+        kept.delete()
+        self.assertRaises(mod_exceptions.UpdateDeletedObject, setattr,
+                kept, "username", "no")
+        
+        # Reset the data connection (loop flushes the changes)
+        kid, cid = kept.id, created.id
+        self.teardown_data_connector()
+        self.setup_data_connector()
+        self.assertRaises(mod_exceptions.ObjectNotFound, User.find, kid)
+        self.assertEqual(User.find(cid).username, "Pending")
+        self.assertEqual([user.username for user in User.get_all()],
+                ["Pending"])
+    
+    def test_cache_policy(self):
+        """Create and retrieve objects with a LRU cache of 2 users."""
+        self.dc.set_cache_policy("lru", limit=2, limits={"account": 1})
+        users = [User(username="Cached_" + str(i)) for i in range(4)]
+        for user in users:
+            self.assertEqual(User.find(user.id).username, user.username)
+        
+        last = User.find(users[-1].id)
+        self.assertIs(User.find(users[-1].id), last)
+        self.assertEqual(len(User.get_all()), 4)
+        self.assertRaises(ValueError, self.dc.set_cache_policy, "random")
+    
+    def test_tombstones(self):
+        """Delete users and compact the tombstones."""
+        users = [User(username="Dead_" + str(i)) for i in range(3)]
+        for user in users:
+            user.delete()
+        
+        self.assertEqual(self.dc.stats()["tombstones"], 3)
+        self.dc.loop()
+        self.assertEqual(self.dc.stats()["tombstones"], 0)
+        self.assertRaises(mod_exceptions.UpdateDeletedObject, setattr,
+                users[0], "username", "no")
+    
+    def test_delete_evicted(self):
+        """Delete a user evicted from a LRU cache of 1 user."""
+        self.dc.set_cache_policy("lru", limit=1)
+        evicted = User(username="Evicted")
+        User(username="Cached")
+        evicted.delete()
+        self.assertRaises(mod_exceptions.UpdateDeletedObject, setattr,
+                evicted, "username", "no")
+        self.assertRaises(mod_exceptions.ObjectNotFound, User.find,
+                evicted.id)
+    
+    def test_flush_error(self):
+        """Keep the pending changes when a flush fails."""
+        users = [User(username="Pending_" + str(i)) for i in range(3)]
+        self.dc.write_behind = True
+        for user in users:
+            user.username = user.username + "_updated"
+        
+        # Delete a modified user outside the unit of work
+        self.dc.write_behind = False
+        users[1].delete()
+        self.dc.write_behind = True
+        created = User(username="Pending_new")
+        users[2].delete()
+        self.assertRaises(mod_exceptions.UpdateDeletedObject, self.dc.flush)
+        self.assertEqual(set(self.dc.dirty_objects), {users[0]})
+        self.assertEqual(list(self.dc.removed_objects), [users[2]])
+        ids = [user.id for user in users + [created]]
+        self.teardown_data_connector()
+        self.setup_data_connector()
+        self.assertEqual(User.find(ids[0]).username, "Pending_0_updated")
+        self.assertEqual(User.find(ids[3]).username, "Pending_new")
+        for id in ids[1:3]:
+            self.assertRaises(mod_exceptions.ObjectNotFound, User.find, id)
+    
+    def test_allocator(self):
+        """Create users one by one and by batches, checking their IDs."""
+        users = [User(username="Alloc_" + str(i)) for i in range(3)]
+        users += User.bulk_create([{"username": "Bulk_" + str(i)} \
+                for i in range(5)], batch_size=2)
+        users.append(User(username="Alloc_last"))
+        ids = [user.id for user in users]
+        self.assertEqual(ids, sorted(set(ids)))
+        for user in users:
+            self.assertIs(User.find(user.id), user)
+    
+    def test_iter_all(self):
+        """Iterate over the users by batches."""
+        users = User.bulk_create([{"username": "Iter_" + str(i)} \
+                for i in range(5)])
+        iterated = list(User.iter_all(batch_size=2))
+        self.assertEqual(sorted(user.id for user in iterated),
+                sorted(user.id for user in users))
+        for user in users:
+            self.assertIn(user, iterated)
+        self.assertRaises(ValueError, User.iter_all, batch_size=0)
+    
+    def test_page(self):
+        """Read the users page by page, in both orders."""
+        users = User.bulk_create([{"username": "Page_" + str(i)} \
+                for i in range(7)])
+        first = User.page(after=users[0].id - 1, limit=3)
+        self.assertEqual(first, users[:3])
+        self.assertEqual(User.page(after=first[-1].id, limit=3), users[3:6])
+        self.assertEqual(User.page(after=users[-1].id), [])
+        self.assertEqual(User.page(limit=2, order_by="-id"), users[:-3:-1])
+        self.assertEqual(User.page(after=users[3].id, limit=2,
+                order_by="-id"), users[2:0:-1])
+        query = User.filter(username__in=("Page_2", "Page_5", "Page_4"))
+        self.assertEqual(list(query.order_by("-username").limit(2)),
+                [users[5], users[4]])
+        self.assertRaises(ValueError, query.order_by, "unknown")
+    
+    def test_only(self):
+        """Read the users with some fields only."""
+        users = User.bulk_create([{"username": "Only_" + str(i),
+                "password": "secret_" + str(i)} for i in range(3)])
+        selected = list(User.only("username").filter(username="Only_1"))
+        self.assertEqual(selected, [users[1]])
+        self.assertEqual(selected[0].password, "secret_1")
+        selected = list(User.defer("password").filter(username="Only_2"))
+        self.assertEqual([user.password for user in selected], ["secret_2"])
+        self.assertEqual(User.defer("password").fields, ("id", "username"))
+        self.assertRaises(ValueError, User.only, "unknown")
+    
+    def test_async(self):
+        """Save, find and iterate over users from coroutines."""
+        self.dc.loop()
+        self.dc.write_behind = True
+        users = [User(username="Async_" + str(i)) for i in range(5)]
+        async def work():
+            await asyncio.gather(*[user.asave() for user in users])
+            found = await asyncio.gather(*[User.afind(user.id) for user in \
+                    users])
+            iterated = [user async for user in User.aiter_all(batch_size=2)]
+            return found, iterated
+        
+        found, iterated = asyncio.run(work())
+        self.assertEqual(self.dc.stats()["new_objects"], 0)
+        self.assertEqual(found, users)
+        for user in users:
+            self.assertIn(user, iterated)
+    
+    def test_aggregate(self):
+        """Count, aggregate and group the accounts."""
+        Account.bulk_create([{"name": "Group_" + str(i % 2), "balance": i} \
+                for i in range(1, 7)])
+        self.assertEqual(Account.count(), 6)
+        self.assertEqual(Account.filter(name="Group_1").count(), 3)
+        self.assertEqual(Account.aggregate(sum="balance", min="balance",
+                max="name"), {"sum": 21, "min": 1, "max": "Group_1"})
+        self.assertEqual(Account.filter(balance__gt=10).aggregate(
+                sum="balance", max="balance"), {"sum": 0, "max": None})
+        self.assertEqual(Account.group_by("name", sum="balance"), {
+                "Group_0": {"count": 3, "sum": 12},
+                "Group_1": {"count": 3, "sum": 9}})
+        
+        # The order and the limit are applied first
+        query = Account.filter(balance__gte=2).order_by("-balance").limit(3)
+        self.assertEqual(query.count(), 3)
+        self.assertEqual(query.aggregate(sum="balance"), {"sum": 15})
+        self.assertEqual(query.group_by("name"), {"Group_0": {"count": 2},
+                "Group_1": {"count": 1}})
+        self.assertRaises(ValueError, Account.aggregate, avg="balance")
+        self.assertRaises(ValueError, Account.group_by, "unknown")
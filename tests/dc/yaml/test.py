@@ -28,12 +28,125 @@
 
 """Test for the sqlite3 data connector."""
 
+import os
 from unittest import TestCase
 
 from tests.dc.test import AbstractDCTest
+from tests.model import *
 from dc.yaml.connector import YAMLConnector
+from dc.yaml.index import SortedIndex
 
 class DCTest(AbstractDCTest, TestCase):
     
     name = "yaml"
     connector = YAMLConnector
+    
+    def test_hash_index(self):
+        """Check that the hash index follows the objects."""
+        self.dc.load_table("user")
+        index = self.dc.indexes["user"]["username"]
+        user = User(username="Indexed")
+        self.assertEqual(index.find("Indexed"), [user.id])
+        user.username = "Reindexed"
+        self.assertEqual(index.find("Indexed"), [])
+        query = User.filter(username="Reindexed")
+        self.assertEqual(self.dc.find_candidates(query), [user.id])
+        self.assertEqual(list(query), [user])
+        user.delete()
+        self.assertEqual(index.find("Reindexed"), [])
+    
+    def test_sorted_index(self):
+        """Check the range lookups through the sorted index."""
+        accounts = [Account(name="Range", balance=i) for i in range(10)]
+        accounts[5].balance = 50
+        accounts[6].delete()
+        query = Account.filter(balance__gt=2, balance__lte=7)
+        self.assertEqual(self.dc.find_candidates(query), [accounts[i].id \
+                for i in (3, 4, 7)])
+        self.assertEqual(list(query), [accounts[i] for i in (3, 4, 7)])
+        self.assertEqual(list(Account.filter(balance=50)), [accounts[5]])
+        
+        # The indexes are built again when the tables are read
+        Account(name="Range", balance=4)
+        self.teardown_data_connector()
+        self.setup_data_connector()
+        self.assertEqual(len(Account.filter(balance__gte=4)), 6)
+        index = self.dc.indexes["account"]["balance"]
+        self.assertEqual(index.sorted_values, sorted(index.sorted_values))
+        self.assertEqual(len(index.find(4)), 2)
+        incremental = SortedIndex("balance")
+        for pkey, account in self.dc.objects_tree["account"].items():
+            incremental.add(pkey, account.balance)
+        self.assertEqual(incremental.sorted_pkeys, index.sorted_pkeys)
+    
+    def test_walk_index(self):
+        """Read sorted objects through the sorted indexes."""
+        accounts = [Account(name="Walk", balance=i) for i in range(10)]
+        query = Account.filter(balance__gte=3).order_by("-balance").limit(3)
+        self.assertEqual(self.dc.walk_index(query), [accounts[i] for i in \
+                (9, 8, 7)])
+        query = Account.filter(name="Walk").order_by("id")
+        self.assertEqual(self.dc.walk_index(query), accounts)
+        self.assertIsNone(self.dc.walk_index(query.order_by("balance")))
+    
+    def test_clear_cache(self):
+        """Read the tables and their indexes again after clearing the cache."""
+        accounts = [Account(name="Cleared", balance=i) for i in range(5)]
+        accounts[4].balance = 10
+        self.dc.clear_cache()
+        self.assertIn("account", self.dc.unloaded)
+        query = Account.filter(balance__gte=2).order_by("-balance").limit(2)
+        self.assertEqual([account.balance for account in query], [10, 3])
+        self.assertEqual([account.id for account in Account.page(
+                limit=2)], [accounts[0].id, accounts[1].id])
+    
+    def test_journal(self):
+        """Check that the changes are appended to the journal."""
+        users = [User(username="Journal{}".format(i)) for i in range(5)]
+        self.dc.loop()
+        table = self.dc.location + "/user.yml"
+        journal = self.dc.get_journal_path("user")
+        with open(table, "r") as file:
+            snapshot = file.read()
+        
+        users[0].username = "Updated"
+        users[1].delete()
+        self.dc.loop()
+        self.assertTrue(os.path.exists(journal))
+        with open(table, "r") as file:
+            self.assertEqual(file.read(), snapshot)
+        
+        # The journal is replayed when the table is read
+        self.teardown_data_connector()
+        self.setup_data_connector()
+        self.assertEqual(User.find(id=users[0].id).username, "Updated")
+        self.assertEqual(len(User.filter(username="Journal1")), 0)
+        self.assertEqual(len(User.get_all()), 4)
+        
+        # Compact the journal once it becomes too large
+        self.dc.journal_size = 0
+        User(username="Compacted")
+        self.dc.loop()
+        self.assertFalse(os.path.exists(journal))
+        self.teardown_data_connector()
+        self.setup_data_connector()
+        self.assertEqual(len(User.get_all()), 5)
+        self.assertEqual(len(User.filter(username="Updated")), 1)
+    
+    def test_lazy_loading(self):
+        """Check that the tables are read on first access."""
+        user = User(username="Lazy")
+        Account(name="Lazy")
+        self.teardown_data_connector()
+        self.setup_data_connector()
+        self.assertIn("user", self.dc.unloaded)
+        self.assertIn("account", self.dc.unloaded)
+        self.assertEqual(User.find(id=user.id).username, "Lazy")
+        self.assertNotIn("user", self.dc.unloaded)
+        self.assertIn("account", self.dc.unloaded)
+        
+        # The auto-increment values are read before being allocated
+        account = Account(name="Other")
+        self.assertNotIn("account", self.dc.unloaded)
+        self.assertEqual(len(Account.get_all()), 2)
+        self.assertEqual(len(set(a.id for a in Account.get_all())), 2)
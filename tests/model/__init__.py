@@ -28,6 +28,7 @@
 
 """This package contains the Model test and examples."""
 
+from tests.model.account import Account
 from tests.model.user import User
 
-models = [User]
+models = [Account, User]
@@ -0,0 +1,110 @@
+# Copyright (c) 2012 LE GOFF Vincent
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+# * Neither the name of the copyright holder nor the names of its contributors
+#   may be used to endorse or promote products derived from this software
+#   without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT
+# OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+
+"""Tests for the model structure (no data connector is needed)."""
+
+from unittest import TestCase
+
+from model import Model, String
+from model.functions import *
+from tests.model import *
+
+class ModelTest(TestCase):
+    
+    """Test case for the model structure.
+    
+    Testing methods:
+        test_schema -- check the schema built by the metaclass
+        test_schema_frozen -- check that a schema can't be modified
+        test_slots -- check the objects of a slots-based model
+        test_hydrators -- build objects from rows and mappings
+        test_max_size -- check the maximum size of a string field
+    
+    """
+    
+    def test_schema(self):
+        """Check the schema of the User model."""
+        schema = get_schema(User)
+        self.assertIs(schema.model, User)
+        self.assertEqual(schema.name, "user")
+        self.assertEqual(schema.plural_name, "users")
+        self.assertEqual(schema.field_names, ("id", "username", "password"))
+        self.assertEqual(schema.pkey_names, ("id", ))
+        self.assertEqual(schema.auto_increments, ("id", ))
+        self.assertEqual(schema.indexes["username"], 1)
+        self.assertIsNot(get_fields(User)[0], get_fields(Model)[0])
+        
+        user = User.build(id=3, username="Schema")
+        self.assertEqual(schema.get_pkey(user), 3)
+        self.assertEqual(get_pkey_values(user), (3, ))
+        self.assertEqual(schema.get_row_pkey((3, "Schema", "unknown")), 3)
+    
+    def test_schema_frozen(self):
+        """Check that a schema is read-only."""
+        schema = get_schema(User)
+        self.assertRaises(AttributeError, setattr, schema, "name", "other")
+    
+    def test_slots(self):
+        """Check that a slots-based model doesn't create a __dict__."""
+        account = Account.build(id=1, name="Compact", balance=5)
+        self.assertFalse(hasattr(account, "__dict__"))
+        self.assertEqual(get_fields(Account)[0].field_name, "id")
+        self.assertEqual(get_values(account), (1, "Compact", 5))
+        self.assertEqual(get_values_dict(account), {"id": 1,
+                "name": "Compact", "balance": 5})
+        self.assertRaises(ValueError, Account.build(id=2).__setattr__,
+                "balance", "not a number")
+    
+    def test_hydrators(self):
+        """Build objects with the generated hydrators."""
+        for model in (User, Account):
+            schema = get_schema(model)
+            row = (4, "Hydrated", schema.fields[2].default)
+            from_row = schema.get_hydrator()(row)
+            mapping = dict(zip(schema.field_names, row), _id="ignored")
+            from_dict = schema.get_hydrator(mapping=True)(mapping)
+            self.assertIs(schema.get_hydrator(), schema.get_hydrator())
+            for object in (from_row, from_dict):
+                self.assertIsInstance(object, model)
+                self.assertEqual(get_values(object), row)
+            
+            # A missing field with a default value gets it
+            del mapping[schema.field_names[2]]
+            partial = schema.get_hydrator(mapping=True)(mapping)
+            self.assertEqual(get_values(partial), row)
+            del mapping[schema.field_names[1]]
+            self.assertRaises(KeyError, schema.get_hydrator(mapping=True),
+                    mapping)
+    
+    def test_max_size(self):
+        """Check the values accepted by a string field with a maximum size."""
+        field = String(max_size=5)
+        self.assertTrue(field.accept_value("short"))
+        self.assertRaises(ValueError, field.accept_value, "too long")
+        self.assertRaises(ValueError, String, max_size=0)
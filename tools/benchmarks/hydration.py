@@ -0,0 +1,108 @@
+# Copyright (c) 2012 LE GOFF Vincent
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+# * Neither the name of the copyright holder nor the names of its contributors
+#   may be used to endorse or promote products derived from this software
+#   without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT
+# OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+
+"""Benchmark comparing the ways of building objects from sqlite3 rows.
+
+Usage:
+$ python -m tools.benchmarks.hydration [number of rows]
+
+A table of users is created in a temporary sqlite3 database and read
+with a single query.  The rows are then converted to objects:
+-   Through a dictionary and Model.build (the former connector code)
+-   Through the hydrator generated by the model's schema.
+
+"""
+
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+from model import *
+from model.functions import get_schema
+
+class BenchUser(Model):
+    
+    """User model used for the benchmark."""
+    
+    username = String()
+    password = String(default="unknown")
+
+class BenchSlotsUser(Model):
+    
+    """User model, storing its attributes in slots."""
+    
+    use_slots = True
+    username = String()
+    password = String(default="unknown")
+
+def build_rows(model, rows):
+    """Build the objects through a dictionary and Model.build."""
+    fields = get_schema(model).field_names
+    return [model.build(**dict(zip(fields, row))) for row in rows]
+
+def hydrate_rows(model, rows):
+    """Build the objects through the generated hydrator."""
+    hydrate = get_schema(model).get_hydrator()
+    return [hydrate(row) for row in rows]
+
+def fetch_rows(number):
+    """Create a temporary table and return all its rows."""
+    directory = tempfile.mkdtemp()
+    location = os.path.join(directory, "bench.db")
+    connection = sqlite3.connect(location)
+    connection.execute("CREATE TABLE users (id integer PRIMARY KEY, " \
+            "username text, password text)")
+    connection.executemany("INSERT INTO users VALUES (?, ?, ?)",
+            ((i, "user_" + str(i), "unknown") for i in range(1, number + 1)))
+    connection.commit()
+    rows = connection.execute("SELECT * FROM users").fetchall()
+    connection.close()
+    os.remove(location)
+    os.rmdir(directory)
+    return rows
+
+def main(number=1000000):
+    """Run the benchmark and print its results."""
+    rows = fetch_rows(number)
+    print("Building {} objects from sqlite3 rows:".format(number))
+    for model in (BenchUser, BenchSlotsUser):
+        timings = []
+        for function in (build_rows, hydrate_rows):
+            begin = time.perf_counter()
+            function(model, rows)
+            timings.append(time.perf_counter() - begin)
+        
+        print("  {:<15} build: {:.2f}s, hydrator: {:.2f}s ({:.1f}x " \
+                "faster)".format(model.__name__, timings[0], timings[1],
+                timings[0] / timings[1]))
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
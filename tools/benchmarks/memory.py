@@ -0,0 +1,91 @@
+# Copyright (c) 2012 LE GOFF Vincent
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+# * Neither the name of the copyright holder nor the names of its contributors
+#   may be used to endorse or promote products derived from this software
+#   without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT
+# OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+
+"""Memory benchmark comparing the '__dict__' and slots object layouts.
+
+Usage:
+$ python -m tools.benchmarks.memory [number of objects]
+
+The same model is defined twice, once with the default layout (each
+object has a '__dict__') and once with 'use_slots' set to True.  The
+objects are built (not saved) and kept in a dictionary, as they would
+be in the data connector's cache.  The memory allocated is measured
+with the tracemalloc module.
+
+"""
+
+import sys
+import tracemalloc
+
+from model import *
+
+class DictUser(Model):
+    
+    """User model storing its objects' attributes in a __dict__."""
+    
+    username = String()
+    password = String(default="unknown")
+
+class SlotsUser(Model):
+    
+    """User model storing its objects' attributes in slots."""
+    
+    use_slots = True
+    username = String()
+    password = String(default="unknown")
+
+def measure(model, number):
+    """Return the memory (in bytes) allocated to cache 'number' objects."""
+    # The strings are created before the measure, to only count the objects
+    usernames = ["user_" + str(i) for i in range(number)]
+    tracemalloc.start()
+    cache = {}
+    for i, username in enumerate(usernames):
+        cache[i] = model.build(id=i, username=username, password="unknown")
+    
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return size
+
+def main(number=200000):
+    """Run the benchmark and print its results."""
+    print("Caching {} objects:".format(number))
+    results = {}
+    for model in (DictUser, SlotsUser):
+        size = measure(model, number)
+        results[model] = size
+        print("  {:<10} {:>8.1f} MiB ({:.0f} bytes per object)".format(
+                model.__name__, size / 1024 ** 2, size / number))
+    
+    ratio = results[SlotsUser] / results[DictUser]
+    print("Slots objects use {:.0%} of the memory of dict objects".format(
+            ratio))
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,90 @@
+# Copyright (c) 2012 LE GOFF Vincent
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+# * Neither the name of the copyright holder nor the names of its contributors
+#   may be used to endorse or promote products derived from this software
+#   without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT
+# OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+
+"""Benchmark comparing the PRAGMA presets of the sqlite3 connector.
+
+Usage:
+$ python -m tools.benchmarks.pragmas [number of rows] [batch size]
+
+For each preset, users are created in a temporary sqlite3 database
+through Model.bulk_create, the changes being committed after each
+batch (as an import job would do).
+
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from dc.sqlite3.connector import Sqlite3Connector
+from model import *
+
+class BenchUser(Model):
+    
+    """User model used for the benchmark."""
+    
+    username = String()
+    password = String(default="unknown")
+
+def load(preset, number, batch_size):
+    """Create 'number' users with the preset and return the duration."""
+    directory = tempfile.mkdtemp()
+    connector = Sqlite3Connector()
+    connector.setup(os.path.join(directory, "bench.db"), preset=preset)
+    connector.record_models([BenchUser])
+    Model.data_connector = connector
+    try:
+        begin = time.perf_counter()
+        for start in range(0, number, batch_size):
+            count = min(batch_size, number - start)
+            BenchUser.bulk_create({"username": "user_" + str(start + i)} \
+                    for i in range(count))
+            connector.loop()
+            connector.clear_cache()
+        
+        return time.perf_counter() - begin
+    finally:
+        Model.data_connector = None
+        connector.close()
+        shutil.rmtree(directory)
+
+def main(number=200000, batch_size=100):
+    """Run the benchmark and print its results."""
+    print("Creating {} users by batches of {}:".format(number, batch_size))
+    timings = {}
+    for preset in ("durable", "balanced", "bulk_load"):
+        timings[preset] = load(preset, number, batch_size)
+        print("  {:<10} {:.2f}s ({:.1f}x faster than durable)".format(
+                preset, timings[preset], timings["durable"] / \
+                timings[preset]))
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])